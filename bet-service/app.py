@@ -1,13 +1,18 @@
 import sys
-import traceback
+
+import startup_timing
+from shared_utils import log
+
+logger = log.get_logger('app')
+startup_timing.mark('interpreter')
 
 # Load environment variables first
 try:
     from flask.cli import load_dotenv
     load_dotenv()
-    print("[app] Environment variables loaded")
+    logger.info("Environment variables loaded")
 except Exception as e:
-    print(f"[app] Warning: Could not load .env file: {e}")
+    logger.warning(f"Could not load .env file: {e}")
 
 from flask import Flask, jsonify
 from flask_cors import CORS
@@ -15,41 +20,54 @@ import os
 
 # Create Flask app FIRST - this must succeed
 app = Flask(__name__)
-print("[app] Flask app created")
+logger.info("Flask app created")
+startup_timing.mark('flask')
+
+# Per-route latency histograms and /metrics (aggregated over gunicorn workers)
+from shared_utils import metrics, profiling
+metrics.init_app(app, 'bet-service')
+
+# Sampled / admin-requested request profiles with per-span breakdowns
+profiling.init_app(app, 'bet-service')
+
+# Request ids on every log record
+log.init_app(app, 'bet-service')
+startup_timing.init_app(app)
 
 # Configure CORS before registering blueprints
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001,https://neuralbets.vercel.app")
 allowed_origins = [o.strip() for o in cors_origins.split(",") if o.strip()]
-CORS(app, resources={r"/bets/*": {"origins": allowed_origins}, r"/health": {"origins": allowed_origins}, r"/": {"origins": allowed_origins}})
-print(f"[app] CORS enabled for origins: {allowed_origins}")
+CORS(app, resources={r"/bets/*": {"origins": allowed_origins}, r"/health": {"origins": allowed_origins}, r"/": {"origins": allowed_origins}},
+     expose_headers=['X-Stale', 'X-Cached-At', 'Retry-After'])
+logger.info(f"CORS enabled for origins: {allowed_origins}")
 
 # Set basic config
 app.config['EXTERNAL_API_KEY'] = os.getenv('ODDS_API_KEY')
-print("[app] Config set")
+logger.info("Config set")
+startup_timing.mark('instrumentation')
 
 # Import config early to initialize MongoDB connection (if available)
 try:
     import config
-    print("[app] Config module loaded successfully")
+    logger.info("Config module loaded successfully")
 except Exception as e:
-    print(f"[app] Warning: Error loading config: {e}")
-    traceback.print_exc()
+    logger.warning(f"Error loading config: {e}", exc_info=True)
     # Continue anyway - app can run without MongoDB
+startup_timing.mark('config')
 
 # Import routes with error handling
 routes_loaded = False
 try:
-    print("[app] Attempting to import routes.api_routes...")
+    logger.info("Attempting to import routes.api_routes...")
     from routes.api_routes import api_bp
-    print("[app] API routes imported successfully")
+    logger.info("API routes imported successfully")
     
-    print("[app] Attempting to register blueprint...")
+    logger.info("Attempting to register blueprint...")
     app.register_blueprint(api_bp)
-    print("[app] Blueprint registered successfully")
+    logger.info("Blueprint registered successfully")
     routes_loaded = True
 except Exception as e:
-    print(f"[app] CRITICAL ERROR: Failed to load routes: {e}")
-    traceback.print_exc()
+    logger.critical(f"Failed to load routes: {e}", exc_info=True)
     # Create error route so app can at least start and show the error
     @app.route('/error')
     def import_error():
@@ -59,18 +77,23 @@ except Exception as e:
             "message": "Check logs for full traceback"
         }), 500
     # Don't raise - allow app to start so we can debug
-    print("[app] App will start with limited functionality due to route import failure")
+    logger.warning("App will start with limited functionality due to route import failure")
+
+startup_timing.mark('routes')
 
-# Import and run startup tasks
+# Import and run startup tasks. Under gunicorn (gunicorn.conf.py) they start
+# in each worker after the fork instead, so a preloaded master starts no
+# threads and opens no connections.
 try:
     from startup_tasks import run_on_startup
-    print("[app] Startup tasks module loaded")
-    run_on_startup(app)
-    print("[app] Startup tasks initiated")
+    logger.info("Startup tasks module loaded")
+    if os.getenv('STARTUP_TASKS_POST_FORK', 'false').lower() != 'true':
+        run_on_startup(app)
+        logger.info("Startup tasks initiated")
 except Exception as e:
-    print(f"[app] Warning: Startup tasks failed: {e}")
-    traceback.print_exc()
+    logger.warning(f"Startup tasks failed: {e}", exc_info=True)
     # Don't fail app startup if startup tasks fail
+startup_timing.mark('startup_tasks')
 
 @app.route('/', methods=['GET'])
 def home():
@@ -85,3 +108,5 @@ def home():
 def health_check():
     """Endpoint for container health checks."""
     return jsonify({"status": "ok"}), 200
+
+startup_timing.report_import()
@@ -1 +1,281 @@
-# this file will contain logic for calling things for other db updates
\ No newline at end of file
+"""
+Bet placement.
+
+Each leg of a slip is checked against the odds index (price known, fresh,
+unchanged since the user saw it, event not started). Then:
+- the bets are stored as pending_debit
+- the stakes of the whole slip are debited with one user-service call
+- the bets are confirmed as pending, ready for settlement
+
+If the debit is refused (e.g. insufficient balance) the stored bets are
+discarded. If it fails otherwise (timeout, 5xx) it may or may not have been
+applied, so the bets stay pending_debit. Retrying the slip finishes the
+debit; once an event has started, a retry only confirms a debit the wallet
+already applied. Bets nobody retries are resolved against the wallet by
+resolve_unconfirmed_bets: confirmed if debited, discarded if not.
+
+Bet ids are derived from (user_id, slip_id, leg index), so retrying a slip
+with the same slip_id never charges twice. A retry must repeat the original
+legs: same events, selections, prices and stakes.
+"""
+
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+from odds_index import odds_index, quote_is_stale, parse_commence_time, quote_key
+from bet_store import bet_store
+from user_service_client import user_service, UserServiceError
+from schemas import Bet, bet_to_dict
+from shared_utils import log
+
+logger = log.get_logger('bet_service')
+
+# Placement limits
+MAX_SLIP_SIZE = int(os.getenv('MAX_SLIP_SIZE', 20))
+PRICE_TOLERANCE = 1e-6
+# Longer than a debit can take with its retries, so a request still in flight is not resolved
+UNCONFIRMED_BET_MAX_AGE_SECONDS = float(os.getenv('UNCONFIRMED_BET_MAX_AGE_SECONDS', 300))
+UNCONFIRMED_BET_BATCH_SIZE = int(os.getenv('UNCONFIRMED_BET_BATCH_SIZE', 500))
+
+BET_ID_NAMESPACE = uuid.UUID('6f1c2a52-8f8e-4a8e-9d4c-1c1b7c2f5e10')
+
+
+class SlipConflict(ValueError):
+    """A retried slip_id does not match the slip stored under it."""
+
+
+class BetRejected(ValueError):
+    """A slip failed validation against the current odds (one error per rejected leg)."""
+
+    def __init__(self, message: str, errors: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.errors = errors
+
+
+def slip_bet_id(user_id: str, slip_id: str, index: int) -> str:
+    """Deterministic bet id of a slip leg."""
+    return str(uuid.uuid5(BET_ID_NAMESPACE, f"{user_id}:{slip_id}:{index}"))
+
+
+def _parse_leg(index: int, leg: Any) -> Dict[str, Any]:
+    if not isinstance(leg, dict):
+        raise ValueError(f"Bet {index}: must be an object")
+    event_id, selection = leg.get('event_id'), leg.get('selection')
+    if not event_id or not selection:
+        raise ValueError(f"Bet {index}: event_id and selection are required")
+    try:
+        price = float(leg.get('price'))
+        stake = float(leg.get('stake'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Bet {index}: price and stake must be numbers")
+    if price <= 1.0 or stake <= 0:
+        raise ValueError(f"Bet {index}: price must be greater than 1 and stake positive")
+    return {'event_id': str(event_id), 'selection': str(selection), 'price': price, 'stake': round(stake, 2)}
+
+
+def _check_quote(index: int, leg: Dict[str, Any], quote: Optional[Dict[str, Any]],
+                 now: float) -> Optional[Dict[str, Any]]:
+    """Return an error dict if the leg cannot be placed at its price, else None."""
+    error = {'index': index, 'event_id': leg['event_id'], 'selection': leg['selection']}
+    if quote is None:
+        return dict(error, reason='odds_unavailable')
+    if quote_is_stale(quote, now):
+        return dict(error, reason='odds_stale')
+    commence = parse_commence_time(quote['commence_time'])
+    if commence is not None and commence <= now:
+        return dict(error, reason='event_started')
+    if abs(quote['price'] - leg['price']) > PRICE_TOLERANCE:
+        return dict(error, reason='price_changed', current_price=quote['price'])
+    return None
+
+
+def place_slip(user_id: str, legs: List[Dict[str, Any]], slip_id: str) -> Dict[str, Any]:
+    """
+    Validate and place a slip of bets.
+
+    Args:
+        user_id: Firebase user ID
+        legs: List of dicts with event_id, selection, price (decimal odds the
+            user accepted) and stake
+        slip_id: Client-chosen id that makes retries safe
+
+    Returns:
+        Dict with slip_id, bets, total_stake, potential_payout and balance
+        (balance is None when a completed slip is replayed)
+
+    Raises:
+        ValueError: Malformed slip
+        SlipConflict: The slip_id was used for a slip with other events,
+            selections, prices or stakes
+        BetRejected: A leg's odds are unavailable, stale or have changed, or
+            an unfinished slip is retried after its event started and the
+            wallet never debited it
+        UserServiceError: The wallet debit failed (e.g. insufficient balance)
+    """
+    if not user_id:
+        raise ValueError("user_id is required")
+    if not isinstance(legs, list) or not legs:
+        raise ValueError("bets must be a non-empty list")
+    if len(legs) > MAX_SLIP_SIZE:
+        raise ValueError(f"A slip can hold at most {MAX_SLIP_SIZE} bets")
+    parsed = [_parse_leg(index, leg) for index, leg in enumerate(legs)]
+    if len({(leg['event_id'], leg['selection']) for leg in parsed}) != len(parsed):
+        raise ValueError("A slip cannot contain the same selection twice")
+    bet_ids = [slip_bet_id(user_id, slip_id, index) for index in range(len(parsed))]
+
+    existing = {bet['bet_id']: bet for bet in bet_store.get_bets(bet_ids)}
+    _check_retry(parsed, bet_ids, existing)
+    if len(existing) == len(bet_ids):
+        bets = [existing[bet_id] for bet_id in bet_ids]
+        if all(bet['status'] != 'pending_debit' for bet in bets):
+            # A retry of a slip that already went through returns the stored bets
+            return _slip_result(slip_id, bets, None, replayed=True)
+        # The debit of an earlier attempt failed or was cut short, but may have
+        # been applied. Debiting now once the outcome may be known would let the
+        # user choose to bet late, so started legs go through only if the wallet
+        # already has their debit (the resent debit then skips them)
+        errors = _started_legs(bets, time.time())
+        if errors:
+            debited = user_service.placed_bet_ids(user_id, [bets[error['index']]['bet_id'] for error in errors])
+            errors = [error for error in errors if bets[error['index']]['bet_id'] not in debited]
+        if errors:
+            raise BetRejected("The slip was not completed before its events started", errors)
+    else:
+        bets = _new_bets(user_id, slip_id, parsed, bet_ids)
+        bet_store.insert_bets(bets)
+        # A concurrent attempt with the same slip_id may have stored its bets first
+        stored = {bet['bet_id']: bet for bet in bet_store.get_bets(bet_ids)}
+        _check_retry(parsed, bet_ids, stored)
+        if len(stored) != len(bet_ids):
+            raise SlipConflict("slip_id is being placed by another request")
+        bets = [stored[bet_id] for bet_id in bet_ids]
+
+    try:
+        wallet = user_service.place_bets(
+            user_id, [{'bet_id': bet['bet_id'], 'bet_amount': bet['stake']} for bet in bets]
+        )
+    except UserServiceError as e:
+        if e.status_code < 500 and e.status_code != 409:
+            # Refused: nothing was debited, so the slip can be placed again
+            # (409: the wallet holds these bet_ids with other stakes)
+            bet_store.discard_unconfirmed_bets(bet_ids)
+        raise
+    bets = [dict(bet, status='pending') if bet['status'] == 'pending_debit' else bet for bet in bets]
+    if bet_store.confirm_bets(bet_ids) < len(bet_ids):
+        # resolve_unconfirmed_bets may have discarded old bets of a retried
+        # slip while its debit was in flight (already confirmed ones are skipped)
+        bet_store.insert_bets(bets)
+    return _slip_result(slip_id, bets, wallet.get('balance'))
+
+
+def _check_retry(parsed: List[Dict[str, Any]], bet_ids: List[str], existing: Dict[str, Dict[str, Any]]):
+    """Raise SlipConflict if stored bets of the slip differ from the requested legs."""
+    for leg, bet_id in zip(parsed, bet_ids):
+        bet = existing.get(bet_id)
+        if bet is not None and (bet['event_id'] != leg['event_id']
+                                or not _same_selection(bet, leg)
+                                or abs(bet['price'] - leg['price']) > PRICE_TOLERANCE
+                                or abs(bet['stake'] - leg['stake']) > 0.005):
+            raise SlipConflict("slip_id was already used for a different slip")
+
+
+def _same_selection(bet: Dict[str, Any], leg: Dict[str, Any]) -> bool:
+    """A leg may name the stored bet's selection by side, team name or team id."""
+    key = quote_key(leg['event_id'], leg['selection'])
+    return key in (quote_key(bet['event_id'], bet['side']), quote_key(bet['event_id'], bet['selection']))
+
+
+def _started_legs(bets: List[Dict[str, Any]], now: float) -> List[Dict[str, Any]]:
+    errors = []
+    for index, bet in enumerate(bets):
+        commence = parse_commence_time(bet['commence_time'])
+        if commence is not None and commence <= now:
+            errors.append({'index': index, 'event_id': bet['event_id'],
+                           'selection': bet['selection'], 'reason': 'event_started'})
+    return errors
+
+
+def _new_bets(user_id: str, slip_id: str, parsed: List[Dict[str, Any]],
+              bet_ids: List[str]) -> List[Dict[str, Any]]:
+    """Check the legs against the current odds and build their bets, pending debit."""
+    now = time.time()
+    quotes = odds_index.get_quotes([(leg['event_id'], leg['selection']) for leg in parsed])
+    errors = [
+        error for error in (
+            _check_quote(index, leg, quote, now)
+            for index, (leg, quote) in enumerate(zip(parsed, quotes))
+        ) if error
+    ]
+    if errors:
+        raise BetRejected("Some bets could not be placed at the requested odds", errors)
+
+    placed_at = datetime.utcnow().isoformat()
+    return [
+        bet_to_dict(Bet(
+            bet_id=bet_id,
+            slip_id=slip_id,
+            user_id=user_id,
+            event_id=leg['event_id'],
+            sport_key=quote['sport_key'],
+            selection=quote['team'],
+            side=quote['side'],
+            price=quote['price'],
+            stake=leg['stake'],
+            potential_payout=round(leg['stake'] * quote['price'], 2),
+            commence_time=quote['commence_time'],
+            placed_at=placed_at,
+            status='pending_debit'
+        ))
+        for bet_id, leg, quote in zip(bet_ids, parsed, quotes)
+    ]
+
+
+def resolve_unconfirmed_bets(max_age_seconds: float = UNCONFIRMED_BET_MAX_AGE_SECONDS) -> Dict[str, int]:
+    """
+    Settle the fate of bets left pending_debit by an interrupted placement.
+
+    Bets the wallet has debited are confirmed. Bets it has not are discarded:
+    no money was taken, and the user was never told they were placed.
+
+    Args:
+        max_age_seconds: Only bets placed at least this long ago are resolved
+
+    Returns:
+        Dict with the number of bets checked, confirmed and discarded
+    """
+    placed_before = (datetime.utcnow() - timedelta(seconds=max_age_seconds)).isoformat()
+    bets = bet_store.get_unconfirmed_bets(placed_before, UNCONFIRMED_BET_BATCH_SIZE)
+    by_user: Dict[str, List[str]] = {}
+    for bet in bets:
+        by_user.setdefault(bet['user_id'], []).append(bet['bet_id'])
+
+    summary = {'bets': len(bets), 'confirmed': 0, 'discarded': 0}
+    for user_id, bet_ids in by_user.items():
+        try:
+            debited = user_service.placed_bet_ids(user_id, bet_ids)
+        except UserServiceError as e:
+            logger.warning(f"Could not check the debits of {len(bet_ids)} bets of {user_id}: {e}")
+            continue
+        summary['confirmed'] += bet_store.confirm_bets([bet_id for bet_id in bet_ids if bet_id in debited])
+        summary['discarded'] += bet_store.discard_unconfirmed_bets(
+            [bet_id for bet_id in bet_ids if bet_id not in debited]
+        )
+    if bets:
+        logger.info(f"Resolved {len(bets)} unconfirmed bets: {summary['confirmed']} confirmed, "
+                    f"{summary['discarded']} discarded")
+    return summary
+
+
+def _slip_result(slip_id: str, bets: List[Dict[str, Any]], balance: Optional[float],
+                 replayed: bool = False) -> Dict[str, Any]:
+    return {
+        'slip_id': slip_id,
+        'bets': bets,
+        'total_stake': round(sum(bet['stake'] for bet in bets), 2),
+        'potential_payout': round(sum(bet['potential_payout'] for bet in bets), 2),
+        'balance': balance,
+        'replayed': replayed
+    }
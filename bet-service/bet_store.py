@@ -0,0 +1,356 @@
+"""
+Storage for placed bets.
+
+Backends:
+    - sqlite: embedded SQLite file in WAL mode, shared by all workers on a host
+    - mongo:  'bets' collection in the bet-service MongoDB database (config.db_handle)
+
+Select the backend with BET_STORE (default: sqlite). Bets are indexed by
+(event_id, status) so the pending bets of an event can be found without
+scanning, by (user_id, placed_at) for bet history, and by
+(status, commence_time) to find started events that still need settling.
+
+A slip's bets are stored as 'pending_debit' before the wallet is debited and
+confirmed as 'pending' after, so no debit happens without its bets. Only
+pending bets are settled.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Optional, List, Dict, Any
+
+from shared_utils import log
+
+logger = log.get_logger('bet_store')
+
+# Storage configuration
+BET_STORE = os.getenv('BET_STORE', 'sqlite').lower()
+BET_SQLITE_PATH = os.getenv('BET_SQLITE_PATH', '/tmp/neuralbets_bets.db')
+# In production the SQLite file is only used when asked for explicitly: on
+# Cloud Run it is local to one instance and lost when the instance goes away
+PRODUCTION = os.getenv('FLASK_ENV', '').lower() == 'production'
+BET_STORE_EXPLICIT = 'BET_STORE' in os.environ
+
+BET_FIELDS = [
+    'bet_id', 'slip_id', 'user_id', 'event_id', 'sport_key', 'selection', 'side',
+    'price', 'stake', 'potential_payout', 'commence_time', 'placed_at',
+    'status', 'payout', 'settled_at'
+]
+
+
+class BetStore:
+    """
+    Interface every bet storage backend implements.
+    Bets are exchanged as plain dicts (see schemas.Bet).
+    """
+
+    # True if every instance of the service sees the same bets
+    shared = False
+
+    def insert_bets(self, bets: List[Dict[str, Any]]) -> int:
+        """Insert bets, skipping bet_ids that already exist. Returns the number inserted."""
+        raise NotImplementedError
+
+    def get_bets(self, bet_ids: List[str]) -> List[Dict[str, Any]]:
+        """Bets with the given ids (missing ids are skipped)."""
+        raise NotImplementedError
+
+    def confirm_bets(self, bet_ids: List[str]) -> int:
+        """Move bets from pending_debit to pending once debited. Returns the number updated."""
+        raise NotImplementedError
+
+    def discard_unconfirmed_bets(self, bet_ids: List[str]) -> int:
+        """Delete bets still pending_debit (their debit was refused). Returns the number deleted."""
+        raise NotImplementedError
+
+    def get_unconfirmed_bets(self, placed_before: str, limit: int = 500) -> List[Dict[str, Any]]:
+        """Bets still pending_debit that were placed before the given ISO time, oldest first."""
+        raise NotImplementedError
+
+    def get_bets_by_user(self, user_id: str, limit: int = 50,
+                         status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A user's bets, most recent first."""
+        raise NotImplementedError
+
+    def get_pending_bets(self, event_id: str) -> List[Dict[str, Any]]:
+        """Pending bets on an event."""
+        raise NotImplementedError
+
+    def get_pending_events(self, started_before: str) -> Dict[str, List[str]]:
+        """sport_key -> event_ids with pending bets that started before the given ISO time."""
+        raise NotImplementedError
+
+    def mark_settled(self, settlements: List[Dict[str, Any]]) -> int:
+        """
+        Record settlement results (dicts with bet_id, status, payout, settled_at).
+        Only pending bets are updated. Returns the number updated.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBetStore(BetStore):
+    """
+    Embedded SQLite storage in WAL mode. Connections are opened per thread
+    and per process (after the gunicorn fork).
+    """
+
+    def __init__(self, path: str = BET_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS bets (
+                bet_id TEXT PRIMARY KEY,
+                slip_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                sport_key TEXT NOT NULL,
+                selection TEXT NOT NULL,
+                side TEXT NOT NULL,
+                price REAL NOT NULL,
+                stake REAL NOT NULL,
+                potential_payout REAL NOT NULL,
+                commence_time TEXT NOT NULL,
+                placed_at TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payout REAL,
+                settled_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_bets_event_status ON bets (event_id, status);
+            CREATE INDEX IF NOT EXISTS idx_bets_user_placed ON bets (user_id, placed_at);
+            CREATE INDEX IF NOT EXISTS idx_bets_status_commence ON bets (status, commence_time, sport_key, event_id);
+        """)
+
+    def insert_bets(self, bets: List[Dict[str, Any]]) -> int:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO bets ({', '.join(BET_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in BET_FIELDS)})",
+                [[bet.get(f) for f in BET_FIELDS] for bet in bets]
+            )
+            return conn.total_changes - before
+
+    def get_bets(self, bet_ids: List[str]) -> List[Dict[str, Any]]:
+        if not bet_ids:
+            return []
+        rows = self._connect().execute(
+            f"SELECT * FROM bets WHERE bet_id IN ({', '.join('?' for _ in bet_ids)})", bet_ids
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def _update_unconfirmed(self, statement: str, bet_ids: List[str]) -> int:
+        if not bet_ids:
+            return 0
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f"{statement} WHERE bet_id IN ({', '.join('?' for _ in bet_ids)}) AND status = 'pending_debit'",
+                bet_ids
+            )
+            return cursor.rowcount
+
+    def confirm_bets(self, bet_ids: List[str]) -> int:
+        return self._update_unconfirmed("UPDATE bets SET status = 'pending'", bet_ids)
+
+    def discard_unconfirmed_bets(self, bet_ids: List[str]) -> int:
+        return self._update_unconfirmed("DELETE FROM bets", bet_ids)
+
+    def get_unconfirmed_bets(self, placed_before: str, limit: int = 500) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT * FROM bets WHERE status = 'pending_debit' AND placed_at < ? ORDER BY placed_at LIMIT ?",
+            (placed_before, max(limit, 0))
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_bets_by_user(self, user_id: str, limit: int = 50,
+                         status: Optional[str] = None) -> List[Dict[str, Any]]:
+        clauses, params = ["user_id = ?"], [user_id]
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        rows = self._connect().execute(
+            f"SELECT * FROM bets WHERE {' AND '.join(clauses)} ORDER BY placed_at DESC LIMIT ?",
+            params + [max(limit, 0)]
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_pending_bets(self, event_id: str) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT * FROM bets WHERE event_id = ? AND status = 'pending'", (event_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_pending_events(self, started_before: str) -> Dict[str, List[str]]:
+        rows = self._connect().execute(
+            "SELECT DISTINCT sport_key, event_id FROM bets "
+            "WHERE status = 'pending' AND commence_time <= ?", (started_before,)
+        ).fetchall()
+        events: Dict[str, List[str]] = {}
+        for sport_key, event_id in rows:
+            events.setdefault(sport_key, []).append(event_id)
+        return events
+
+    def mark_settled(self, settlements: List[Dict[str, Any]]) -> int:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE bets SET status = ?, payout = ?, settled_at = ? "
+                "WHERE bet_id = ? AND status = 'pending'",
+                [(s['status'], s['payout'], s['settled_at'], s['bet_id']) for s in settlements]
+            )
+            return conn.total_changes - before
+
+
+class MongoBetStore(BetStore):
+    """'bets' collection in the bet-service MongoDB database."""
+
+    shared = True
+
+    def __init__(self, db):
+        from pymongo import ASCENDING, DESCENDING
+        self.bets = db['bets']
+        self.bets.create_index([('bet_id', ASCENDING)], unique=True)
+        self.bets.create_index([('event_id', ASCENDING), ('status', ASCENDING)])
+        self.bets.create_index([('user_id', ASCENDING), ('placed_at', DESCENDING)])
+        self.bets.create_index([('status', ASCENDING), ('commence_time', ASCENDING)])
+
+    def insert_bets(self, bets: List[Dict[str, Any]]) -> int:
+        from pymongo import UpdateOne
+        if not bets:
+            return 0
+        result = self.bets.bulk_write(
+            [UpdateOne({'bet_id': bet['bet_id']}, {'$setOnInsert': dict(bet)}, upsert=True) for bet in bets],
+            ordered=False
+        )
+        return result.upserted_count
+
+    def get_bets(self, bet_ids: List[str]) -> List[Dict[str, Any]]:
+        return list(self.bets.find({'bet_id': {'$in': list(bet_ids)}}, {'_id': 0}))
+
+    def confirm_bets(self, bet_ids: List[str]) -> int:
+        return self.bets.update_many(
+            {'bet_id': {'$in': list(bet_ids)}, 'status': 'pending_debit'}, {'$set': {'status': 'pending'}}
+        ).modified_count
+
+    def discard_unconfirmed_bets(self, bet_ids: List[str]) -> int:
+        return self.bets.delete_many(
+            {'bet_id': {'$in': list(bet_ids)}, 'status': 'pending_debit'}
+        ).deleted_count
+
+    def get_unconfirmed_bets(self, placed_before: str, limit: int = 500) -> List[Dict[str, Any]]:
+        from pymongo import ASCENDING
+        return list(
+            self.bets.find({'status': 'pending_debit', 'placed_at': {'$lt': placed_before}}, {'_id': 0})
+            .sort('placed_at', ASCENDING).limit(max(limit, 0))
+        )
+
+    def get_bets_by_user(self, user_id: str, limit: int = 50,
+                         status: Optional[str] = None) -> List[Dict[str, Any]]:
+        from pymongo import DESCENDING
+        query: Dict[str, Any] = {'user_id': user_id}
+        if status is not None:
+            query['status'] = status
+        return list(self.bets.find(query, {'_id': 0}).sort('placed_at', DESCENDING).limit(max(limit, 0)))
+
+    def get_pending_bets(self, event_id: str) -> List[Dict[str, Any]]:
+        return list(self.bets.find({'event_id': event_id, 'status': 'pending'}, {'_id': 0}))
+
+    def get_pending_events(self, started_before: str) -> Dict[str, List[str]]:
+        groups = self.bets.aggregate([
+            {'$match': {'status': 'pending', 'commence_time': {'$lte': started_before}}},
+            {'$group': {'_id': '$sport_key', 'event_ids': {'$addToSet': '$event_id'}}}
+        ])
+        return {g['_id']: g['event_ids'] for g in groups}
+
+    def mark_settled(self, settlements: List[Dict[str, Any]]) -> int:
+        from pymongo import UpdateOne
+        if not settlements:
+            return 0
+        result = self.bets.bulk_write([
+            UpdateOne(
+                {'bet_id': s['bet_id'], 'status': 'pending'},
+                {'$set': {'status': s['status'], 'payout': s['payout'], 'settled_at': s['settled_at']}}
+            ) for s in settlements
+        ], ordered=False)
+        return result.modified_count
+
+
+def create_bet_store(backend: str = BET_STORE) -> BetStore:
+    """
+    Build the configured storage backend.
+    Falls back to SQLite if MongoDB is not available, except in production.
+
+    Raises:
+        RuntimeError: In production (FLASK_ENV=production), if the bets would
+            end up in SQLite without BET_STORE=sqlite being set
+    """
+    if backend == 'mongo':
+        from config import db_handle
+        if db_handle is not None:
+            logger.info("Using MongoBetStore")
+            return MongoBetStore(db_handle)
+        if PRODUCTION:
+            raise RuntimeError("BET_STORE=mongo but MongoDB is not available")
+        logger.warning("MongoDB not available, using SQLite bet store")
+    elif PRODUCTION and not BET_STORE_EXPLICIT:
+        raise RuntimeError(
+            f"Refusing to keep bets in {BET_SQLITE_PATH} in production: "
+            "set BET_STORE=mongo (or BET_STORE=sqlite for a single-host deploy)"
+        )
+    logger.info(f"Using SQLiteBetStore at {BET_SQLITE_PATH}")
+    return SQLiteBetStore()
+
+
+class _LazyBetStore:
+    """
+    The configured store, created on first use in each process.
+    With gunicorn's preload the module is imported in the master, so the
+    store (and its MongoClient) must not be built at import and inherited
+    by the forked workers. Each worker builds its own, like config.py and
+    redis_cache.py do.
+    """
+
+    def __init__(self):
+        self._store: Optional[BetStore] = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._store = None
+        self._lock = threading.Lock()
+
+    def _get(self) -> BetStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = create_bet_store()
+        return self._store
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+# Global store instance (built on first use in each process)
+bet_store = _LazyBetStore()
@@ -0,0 +1,188 @@
+"""
+Encoding of values stored in Redis by RedisCache.
+
+Values are written as a frame: a 2-byte header followed by the payload.
+- The first header byte is 0xC1. No JSON text starts with it, and it is not
+  valid as the first byte of UTF-8 text either, so a frame is never mistaken
+  for a legacy JSON value.
+- The second header byte is the id of the codec that wrote the payload.
+
+Codecs (see CODECS):
+- 1, msgpack
+- 2, msgpack+zstd
+
+CACHE_CODEC picks the codec new values are written with:
+- msgpack (default): msgpack for values under CACHE_COMPRESS_MIN_BYTES
+  (statuses, small entries), msgpack+zstd for everything larger (odds boards,
+  odds and events responses)
+- msgpack+zstd: every value compressed
+- json: plain JSON without a header, as before
+Any other value is refused at import. register_codec(..., write=True) makes
+an added codec the writer.
+
+Readers decode any frame plus plain JSON whatever CACHE_CODEC is set to, so
+the setting can be changed (or rolled back) without flushing Redis. msgpack
+and zstandard are optional: without them, values are written as JSON.
+
+Connections that only carry text (the Upstash REST API) store frames as '~'
+followed by the frame in base64.
+"""
+
+import os
+import json
+import base64
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+from shared_utils import log
+
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = zstandard = None
+
+logger = log.get_logger('cache_codec')
+
+# Codec configuration
+CACHE_CODEC = os.getenv('CACHE_CODEC', 'msgpack').lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', 512))
+CACHE_ZSTD_LEVEL = int(os.getenv('CACHE_ZSTD_LEVEL', 3))
+
+MAGIC = 0xC1
+TEXT_PREFIX = '~'
+CODEC_MSGPACK = 1
+CODEC_MSGPACK_ZSTD = 2
+CACHE_CODECS = ('msgpack', 'msgpack+zstd', 'json')
+
+
+class Codec(NamedTuple):
+    """A payload format, identified in frames by its id."""
+    name: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+class Writer(NamedTuple):
+    """Codec new values are written with, and the one for values of CACHE_COMPRESS_MIN_BYTES or more."""
+    codec_id: int
+    large_codec_id: Optional[int] = None
+
+
+# zstd contexts are not safe to share between threads
+_zstd = threading.local()
+
+
+def _compressor():
+    if not hasattr(_zstd, 'compressor'):
+        _zstd.compressor = zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL)
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd
+
+
+def _pack(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _unpack(payload: bytes) -> Any:
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+# Codec id -> codec. Ids are written to Redis: never reuse or renumber one.
+CODECS: Dict[int, Codec] = {}
+if msgpack is not None:
+    CODECS[CODEC_MSGPACK] = Codec('msgpack', _pack, _unpack)
+    CODECS[CODEC_MSGPACK_ZSTD] = Codec(
+        'msgpack+zstd',
+        lambda value: _compressor().compressor.compress(_pack(value)),
+        lambda payload: _unpack(_compressor().decompressor.decompress(payload))
+    )
+
+
+def _codec_id(name: str) -> int:
+    return next(codec_id for codec_id, codec in CODECS.items() if codec.name == name)
+
+
+def _resolve_writer(name: str) -> Optional[Writer]:
+    """
+    Writer for a CACHE_CODEC value (None: plain JSON).
+
+    Raises:
+        ValueError: If the value is not one of CACHE_CODECS
+    """
+    if name not in CACHE_CODECS:
+        raise ValueError(f"Unknown CACHE_CODEC {name!r}, expected one of {', '.join(CACHE_CODECS)}")
+    if name == 'json':
+        return None
+    if msgpack is None:
+        logger.warning("msgpack/zstandard not installed, writing cache values as JSON")
+        return None
+    if name == 'msgpack':
+        return Writer(_codec_id('msgpack'), _codec_id('msgpack+zstd'))
+    return Writer(_codec_id(name))
+
+
+WRITER = _resolve_writer(CACHE_CODEC)
+
+
+def register_codec(codec_id: int, codec: Codec, write: bool = False):
+    """
+    Add a codec that frames can be decoded with (ids 1-255).
+
+    Args:
+        codec_id: Id written in the frame header
+        codec: The codec
+        write: Also write new values with it, whatever CACHE_CODEC is
+    """
+    global WRITER
+    if not 0 < codec_id < 256 or codec_id in CODECS:
+        raise ValueError(f"Codec id {codec_id} is invalid or taken")
+    CODECS[codec_id] = codec
+    if write:
+        WRITER = Writer(codec_id)
+
+
+def encode(value: Any) -> Union[bytes, str]:
+    """
+    Value as stored in Redis: a frame of the WRITER codec, or JSON text when
+    CACHE_CODEC=json.
+    """
+    writer = WRITER
+    if writer is None:
+        return json.dumps(value)
+    codec_id = writer.codec_id
+    payload = CODECS[codec_id].encode(value)
+    if writer.large_codec_id is not None and len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        codec_id = writer.large_codec_id
+        payload = CODECS[codec_id].encode(value)
+    return bytes((MAGIC, codec_id)) + payload
+
+
+def encode_text(value: Any) -> str:
+    """Value as stored over a text-only connection (frames in base64)."""
+    encoded = encode(value)
+    if isinstance(encoded, str):
+        return encoded
+    return TEXT_PREFIX + base64.b64encode(encoded).decode('ascii')
+
+
+def decode(stored: Union[bytes, str]) -> Any:
+    """
+    Value of what encode() or encode_text() stored, or of plain JSON.
+
+    Raises:
+        ValueError: If the value is a frame of an unknown codec, or is corrupt
+    """
+    if isinstance(stored, str):
+        if not stored.startswith(TEXT_PREFIX):
+            return json.loads(stored)
+        stored = base64.b64decode(stored[1:])
+    if not stored or stored[0] != MAGIC:
+        return json.loads(stored)
+    codec = CODECS.get(stored[1]) if len(stored) > 1 else None
+    if codec is None:
+        raise ValueError(f"Unknown cache codec {stored[1:2].hex() or 'header'}")
+    try:
+        return codec.decode(stored[2:])
+    except Exception as e:
+        raise ValueError(f"Corrupt {codec.name} cache value: {e}") from e
@@ -0,0 +1,173 @@
+"""
+Demand-driven cache warming.
+
+The most requested odds and events combinations (see popularity.py) are
+fetched into the Odds API cache (odds_api_cache.py) before users ask for them:
+- as soon as a worker becomes the warmer, i.e. right after a deploy
+- then every CACHE_WARM_INTERVAL_SECONDS, which refills what Redis evicted
+
+Like the odds refresher, every worker runs the loop, but only the holder of
+a Redis lease warms.
+
+Each run:
+- looks at the top CACHE_WARM_TOP_N combinations, plus the default odds
+  board when the refresher is disabled
+- skips those already cached, at no cost
+- fetches the rest, CACHE_WARM_CONCURRENCY at a time, spending at most
+  CACHE_WARM_BUDGET Odds API credits. Combinations that do not fit the
+  budget wait for the next run.
+
+Every worker's loop also flushes its popularity counts to Redis.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+import requests
+from flask import Flask, current_app
+
+from redis_cache import redis_cache, odds_manifest_key
+from circuit_breaker import CircuitOpenError
+from odds_api_cache import odds_api_cache, ENDPOINTS
+from odds_refresher import odds_refresher
+from popularity import popularity, parse_member, POPULARITY_FLUSH_SECONDS
+from shared_utils import log
+
+logger = log.get_logger('cache_warmer')
+
+# Warmer configuration
+CACHE_WARM_ENABLED = os.getenv('CACHE_WARM_ENABLED', 'true').lower() == 'true'
+CACHE_WARM_INTERVAL_SECONDS = float(os.getenv('CACHE_WARM_INTERVAL_SECONDS', 900))
+CACHE_WARM_TOP_N = int(os.getenv('CACHE_WARM_TOP_N', 20))
+CACHE_WARM_BUDGET = int(os.getenv('CACHE_WARM_BUDGET', 10))
+CACHE_WARM_CONCURRENCY = int(os.getenv('CACHE_WARM_CONCURRENCY', 4))
+CACHE_WARM_LEASE_SECONDS = POPULARITY_FLUSH_SECONDS * 3
+CACHE_WARM_LEASE_KEY = 'cache_warmer_lease'
+CACHE_WARM_STATUS_KEY = 'cache_warmer_status'
+
+
+class CacheWarmer:
+    """Popularity flush loop in every worker; warming by one leader per cluster."""
+
+    def __init__(self, cache=redis_cache):
+        self._cache = cache
+        self.worker_id = None
+        self.is_leader = False
+        self._warmed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, app: Flask):
+        """Start the loop in this worker (call after the gunicorn fork)."""
+        if not CACHE_WARM_ENABLED or not self._cache.available:
+            logger.info("Disabled (CACHE_WARM_ENABLED=false or Redis unavailable)")
+            return
+        if self._thread is not None:
+            return
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._thread = threading.Thread(target=self._loop, args=(app,), name='cache-warmer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the loop, flushing counts and handing the lease over if held."""
+        self._stop.set()
+        popularity.flush()
+        if self.is_leader:
+            self._cache.release_lease(CACHE_WARM_LEASE_KEY, self.worker_id)
+            self.is_leader = False
+
+    def _loop(self, app: Flask):
+        while not self._stop.is_set():
+            try:
+                popularity.flush()
+                leader = self._cache.acquire_lease(CACHE_WARM_LEASE_KEY, self.worker_id, CACHE_WARM_LEASE_SECONDS)
+                if leader != self.is_leader:
+                    logger.info(f"{self.worker_id} {'became' if leader else 'is no longer'} the cache warmer")
+                    self.is_leader = leader
+                # A new leader warms at once: after a deploy the cache is cold
+                if leader and (not self._warmed or self._warm_due()):
+                    with app.app_context():
+                        self.warm()
+                    self._warmed = True
+            except Exception as e:
+                logger.exception(f"Error in cache warmer loop: {e}")
+            self._stop.wait(POPULARITY_FLUSH_SECONDS)
+
+    def _warm_due(self) -> bool:
+        status = self._cache.get_json(CACHE_WARM_STATUS_KEY) or {}
+        return time.time() - (status.get('finished_at') or 0) >= CACHE_WARM_INTERVAL_SECONDS
+
+    def warm(self) -> Dict[str, Any]:
+        """
+        Fetch the most popular uncached combinations within the credit budget.
+        Must run inside the Flask application context (for the Odds API key).
+
+        Returns:
+            The status record written to Redis
+        """
+        start = time.time()
+        budget = CACHE_WARM_BUDGET
+        status = {'worker': self.worker_id, 'started_at': start, 'warmed': [],
+                  'already_cached': 0, 'deferred': 0, 'error': None}
+        try:
+            board_cached = self._cache.exists(odds_manifest_key('live_odds'))
+            if not odds_refresher.active and not board_cached and budget >= 1:
+                # The default board (/bets/getdefaultodds) has no refresher to keep it warm
+                odds_refresher.refresh()
+                budget -= 1
+                status['warmed'].append('default')
+            selected = []
+            for key, score in popularity.top(CACHE_WARM_TOP_N):
+                endpoint, sport, regions, markets = parse_member(key)
+                if endpoint not in ENDPOINTS:
+                    continue
+                if odds_api_cache.is_cached(endpoint, sport, regions, markets):
+                    status['already_cached'] += 1
+                    continue
+                cost = ENDPOINTS[endpoint][2](regions, markets)
+                if cost > budget:
+                    status['deferred'] += 1
+                    continue
+                budget -= cost
+                selected.append(key)
+            if selected:
+                app = current_app._get_current_object()
+                with ThreadPoolExecutor(max_workers=min(CACHE_WARM_CONCURRENCY, len(selected))) as pool:
+                    for key, error in zip(selected, pool.map(lambda key: self._warm_one(app, key), selected)):
+                        if error is None:
+                            status['warmed'].append(key)
+                        else:
+                            status['error'] = error
+        except (CircuitOpenError, requests.RequestException) as e:
+            status['error'] = str(e)
+        status.update(credits_spent=CACHE_WARM_BUDGET - budget, finished_at=time.time(),
+                      duration_ms=round((time.time() - start) * 1000, 1))
+        self._cache.set_json(CACHE_WARM_STATUS_KEY, status)
+        logger.info(
+            f"Warmed {len(status['warmed'])} combinations ({status['already_cached']} already cached, "
+            f"{status['deferred']} deferred) in {status['duration_ms']:.0f}ms",
+            extra={'credits_spent': status['credits_spent'], 'error': status['error']}
+        )
+        return status
+
+    @staticmethod
+    def _warm_one(app: Flask, key: str) -> Optional[str]:
+        """Fill the cache entry of a popularity member; returns the error if the upstream failed."""
+        try:
+            with app.app_context():
+                odds_api_cache.warm(*parse_member(key))
+            return None
+        except (CircuitOpenError, requests.RequestException) as e:
+            # The next run picks it up again
+            return str(e)
+
+
+# Global warmer instance (one loop per worker)
+cache_warmer = CacheWarmer()
@@ -0,0 +1,157 @@
+"""
+Circuit breaker for calls to an upstream service.
+
+Each worker keeps its own breaker per upstream:
+- closed: calls go through. Outcomes of the calls made in the last
+  window_seconds are kept. Once there are at least min_calls of them, the
+  circuit opens if too many failed (error_rate) or were slow (slow_rate).
+- open: calls are rejected with CircuitOpenError without contacting the
+  upstream, for open_seconds.
+- half-open: a single probe call goes through. Its success closes the
+  circuit; a failure or slow response opens it again.
+
+At most max_concurrent calls are in flight per worker. Calls beyond that
+are rejected too, so an upstream that hangs ties up a bounded number of
+requests rather than all of them.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Dict, Any
+
+from shared_utils import metrics, log
+
+logger = log.get_logger('circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+CIRCUIT_OPEN = metrics.gauge('circuit_breaker_open', 'Workers whose circuit to an upstream is open', ['upstream'])
+CIRCUIT_REJECTIONS = metrics.counter(
+    'circuit_breaker_rejections_total', 'Upstream calls rejected without being made', ['upstream', 'reason']
+)
+
+
+class CircuitOpenError(Exception):
+    """A call rejected without contacting the upstream (circuit open or too many calls in flight)."""
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker with a concurrency limit."""
+
+    def __init__(self, name: str, error_rate: float = 0.5, slow_call_seconds: float = 2.0,
+                 slow_rate: float = 0.5, min_calls: int = 5, window_seconds: float = 60,
+                 open_seconds: float = 30, max_concurrent: int = 20):
+        self.name = name
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._calls: deque = deque()  # (finished_at, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._in_flight = 0
+        self._open_gauge = CIRCUIT_OPEN.labels(name)
+        self._rejected_open = CIRCUIT_REJECTIONS.labels(name, 'open')
+        self._rejected_busy = CIRCUIT_REJECTIONS.labels(name, 'concurrency')
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def acquire(self) -> bool:
+        """
+        Admit a call, or raise CircuitOpenError.
+        Every admitted call must be followed by release().
+
+        Returns:
+            True if the call is the half-open probe
+        """
+        with self._lock:
+            probe = False
+            if self._state == OPEN:
+                if self._probing or time.monotonic() - self._opened_at < self.open_seconds:
+                    self._rejected_open.inc()
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                self._probing = probe = True
+            if self._in_flight >= self.max_concurrent:
+                if probe:
+                    self._probing = False
+                self._rejected_busy.inc()
+                raise CircuitOpenError(f"{self.name} has {self._in_flight} calls in flight")
+            self._in_flight += 1
+            return probe
+
+    def release(self, probe: bool, ok: bool, seconds: float):
+        """
+        Record the outcome of an admitted call.
+
+        Args:
+            probe: What acquire() returned
+            ok: False if the call failed (connection error, timeout, 5xx)
+            seconds: How long the call took
+        """
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            self._in_flight -= 1
+            if probe:
+                self._probing = False
+                if ok and not slow:
+                    self._close()
+                else:
+                    self._open(f"probe {'failed' if not ok else f'took {seconds:.1f}s'}")
+                return
+            if self._state != CLOSED:
+                return  # a call admitted before the circuit opened
+            now = time.monotonic()
+            self._calls.append((now, not ok, slow))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+            if len(self._calls) < self.min_calls:
+                return
+            failed = sum(1 for _, f, _ in self._calls if f) / len(self._calls)
+            slowed = sum(1 for _, _, s in self._calls if s) / len(self._calls)
+            if failed >= self.error_rate:
+                self._open(f"{failed:.0%} of {len(self._calls)} calls failed")
+            elif slowed >= self.slow_rate:
+                self._open(f"{slowed:.0%} of {len(self._calls)} calls took {self.slow_call_seconds}s or more")
+
+    def _open(self, reason: str):
+        if self._state == CLOSED:
+            self._open_gauge.inc()
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        logger.warning(f"{self.name} circuit opened: {reason}",
+                       extra={'upstream': self.name, 'open_seconds': self.open_seconds})
+
+    def _close(self):
+        if self._state != CLOSED:
+            self._open_gauge.dec()
+        self._state = CLOSED
+        self._calls.clear()
+        logger.info(f"{self.name} circuit closed", extra={'upstream': self.name})
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State, recent calls and calls in flight of this worker's breaker."""
+        state = self.state
+        with self._lock:
+            return {
+                'upstream': self.name,
+                'state': state,
+                'recent_calls': len(self._calls),
+                'recent_failures': sum(1 for _, f, _ in self._calls if f),
+                'recent_slow_calls': sum(1 for _, _, s in self._calls if s),
+                'in_flight': self._in_flight,
+                'open_for_seconds': round(time.monotonic() - self._opened_at, 1) if state != CLOSED else None
+            }
@@ -1,71 +1,92 @@
 import os
+import threading
+import importlib.util
 
-# Initialize variables FIRST - must be defined at module level for imports
-# This ensures db_handle is always importable, even if MongoDB setup fails
-mongo_client = None
-db_handle = None
-MONGO_URI = None
+from shared_utils import log
+
+logger = log.get_logger('config')
+
+# MongoDB is connected on first use in each process, never at import time:
+# with gunicorn's preload the app is imported once in the master, and a
+# MongoClient must not be shared across the fork. `config.db_handle` (and
+# `from config import db_handle`) still work and trigger the connection.
+MONGO_URI = os.getenv("MONGO_CONNECTION_STRING")
 DB_NAME = "betting_sports_db"
 
-# Try to import pymongo, but don't fail if it's not available
-try:
-    import pymongo
+_mongo_client = None
+_db_handle = None
+_initialized = False
+_init_lock = threading.Lock()
+
+if MONGO_URI and importlib.util.find_spec('pymongo') is None:
+    logger.warning("pymongo not available")
+    logger.info("MongoDB functionality will be disabled")
+    MONGO_URI = None
+elif MONGO_URI:
+    # Imported here (not lazily) so that with preload the workers share it
     from pymongo.mongo_client import MongoClient
-    MONGO_URI = os.getenv("MONGO_CONNECTION_STRING")
-except ImportError as e:
-    print(f"[config] Warning: pymongo not available: {e}")
-    print(f"[config] MongoDB functionality will be disabled")
+
 
 def init_mongodb():
     """Initialize MongoDB connection. Returns True if successful."""
-    global mongo_client, db_handle, MONGO_URI
+    global _mongo_client, _db_handle
     try:
         if not MONGO_URI:
-            print(f"[config] Warning: MONGO_CONNECTION_STRING not set, MongoDB disabled")
+            logger.info("MongoDB URI not configured, db_handle will remain None")
             return False
-        
-        # Check if pymongo is available
-        try:
-            from pymongo.mongo_client import MongoClient
-        except ImportError:
-            print(f"[config] Warning: pymongo not available")
-            return False
-        
-        print(f"[config] Attempting to connect to MongoDB...")
+
+        logger.info("Attempting to connect to MongoDB...")
         # Use shorter timeout and connectTimeoutMS to prevent hanging
-        mongo_client = MongoClient(
-            MONGO_URI, 
+        _mongo_client = MongoClient(
+            MONGO_URI,
             serverSelectionTimeoutMS=3000,  # Reduced from 5000
             connectTimeoutMS=3000,
             socketTimeoutMS=3000
         )
-        db_handle = mongo_client[DB_NAME]
+        _db_handle = _mongo_client[DB_NAME]
         # Ping with timeout to verify connection
-        mongo_client.admin.command('ping', maxTimeMS=3000)
-        print(f"[config] MongoDB client initialized successfully.")
+        _mongo_client.admin.command('ping', maxTimeMS=3000)
+        logger.info("MongoDB client initialized successfully.")
         return True
     except Exception as e:
-        print(f"[config] Warning: Could not connect to MongoDB: {e}")
-        print(f"[config] App will continue, but database operations may fail")
-        # Keep db_handle as None - repository will handle this
+        logger.warning(f"Could not connect to MongoDB: {e}")
+        logger.warning("App will continue, but database operations may fail")
         return False
 
-# Try to initialize, but ensure db_handle is always defined (even if None)
-# Use a try-except to prevent any import-time blocking
-try:
-    if MONGO_URI:
-        try:
-            init_mongodb()
-        except Exception as e:
-            print(f"[config] Error during MongoDB initialization: {e}")
-            import traceback
-            traceback.print_exc()
-            # db_handle remains None, which is acceptable
-    else:
-        print(f"[config] MongoDB URI not configured, db_handle will remain None")
-except Exception as e:
-    print(f"[config] Critical error in config initialization: {e}")
-    import traceback
-    traceback.print_exc()
-    # Ensure db_handle is None if everything fails
-    db_handle = None
\ No newline at end of file
+
+def get_db_handle():
+    """
+    The MongoDB database, connecting on first use in this process.
+
+    Returns:
+        Database handle, or None if MongoDB is not configured
+    """
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_mongodb()
+                _initialized = True
+    return _db_handle
+
+
+def _after_fork():
+    # A forked worker opens its own client on first use
+    global _mongo_client, _db_handle, _initialized, _init_lock
+    _mongo_client = None
+    _db_handle = None
+    _initialized = False
+    _init_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def __getattr__(name):
+    if name == 'db_handle':
+        return get_db_handle()
+    if name == 'mongo_client':
+        get_db_handle()
+        return _mongo_client
+    raise AttributeError(f"module 'config' has no attribute {name!r}")
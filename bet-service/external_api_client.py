@@ -1,6 +1,64 @@
 import requests
 import os
+import time
+from requests.adapters import HTTPAdapter
 from flask import current_app, jsonify
+from circuit_breaker import CircuitBreaker
+from shared_utils import metrics, log
+
+logger = log.get_logger('external_api_client')
+
+# Odds API configuration (ODDS_API_URL can point at a local stand-in)
+ODDS_API_URL = os.getenv('ODDS_API_URL', 'https://api.the-odds-api.com/v4').rstrip('/')
+ODDS_API_POOL_SIZE = int(os.getenv('ODDS_API_POOL_SIZE', 50))
+
+# Circuit breaker configuration (see circuit_breaker.py)
+ODDS_API_BREAKER_ERROR_RATE = float(os.getenv('ODDS_API_BREAKER_ERROR_RATE', 0.5))
+ODDS_API_BREAKER_SLOW_SECONDS = float(os.getenv('ODDS_API_BREAKER_SLOW_SECONDS', 2.0))
+ODDS_API_BREAKER_SLOW_RATE = float(os.getenv('ODDS_API_BREAKER_SLOW_RATE', 0.5))
+ODDS_API_BREAKER_MIN_CALLS = int(os.getenv('ODDS_API_BREAKER_MIN_CALLS', 5))
+ODDS_API_BREAKER_OPEN_SECONDS = float(os.getenv('ODDS_API_BREAKER_OPEN_SECONDS', 30))
+ODDS_API_MAX_CONCURRENCY = int(os.getenv('ODDS_API_MAX_CONCURRENCY', 20))
+
+# One keep-alive pool per worker. Under the gevent worker every in-flight
+# request is a greenlet, so the pool must be large enough to not serialize them.
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=ODDS_API_POOL_SIZE))
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=ODDS_API_POOL_SIZE))
+
+odds_api_breaker = CircuitBreaker(
+    'odds_api',
+    error_rate=ODDS_API_BREAKER_ERROR_RATE,
+    slow_call_seconds=ODDS_API_BREAKER_SLOW_SECONDS,
+    slow_rate=ODDS_API_BREAKER_SLOW_RATE,
+    min_calls=ODDS_API_BREAKER_MIN_CALLS,
+    open_seconds=ODDS_API_BREAKER_OPEN_SECONDS,
+    max_concurrent=ODDS_API_MAX_CONCURRENCY
+)
+
+
+def _timed_get(operation, url, params, timeout):
+    """
+    GET an Odds API endpoint through the circuit breaker, recording its
+    latency by operation and HTTP status.
+    Raises CircuitOpenError if the breaker rejects the call.
+    """
+    probe = odds_api_breaker.acquire()
+    ok = False
+    start = time.perf_counter()
+    try:
+        resp = _session.get(url, params=params, timeout=timeout)
+        # Client errors (unknown sport, bad key) say nothing about upstream health
+        ok = resp.status_code < 500 and resp.status_code != 429
+    except requests.RequestException:
+        metrics.DEPENDENCY_DURATION.labels('odds_api', operation, 'error').observe(time.perf_counter() - start)
+        raise
+    finally:
+        odds_api_breaker.release(probe, ok, time.perf_counter() - start)
+    metrics.DEPENDENCY_DURATION.labels('odds_api', operation, str(resp.status_code)).observe(
+        time.perf_counter() - start
+    )
+    return resp
 
 def fetch_sports_data():
     """Call external api to retrieve odds"""
@@ -8,16 +66,16 @@ def fetch_sports_data():
     if not key:
         return jsonify({"error": "missing api key"}), 500
     
-    url = "https://api.the-odds-api.com/v4/sports/"
+    url = f"{ODDS_API_URL}/sports/"
     params = {
         "apiKey": key
     }
-    resp = requests.get(url, params=params, timeout=5)
+    resp = _timed_get('sports', url, params, timeout=5)
     try:
         resp.raise_for_status()
     except requests.HTTPError:
         return jsonify({"error": "external API error", "details": resp.text}), resp.status_code
-    print("success - sending sports data")
+    logger.info("success - sending sports data")
     return resp.json()
 
 # can't just store this in a single no-sql db
@@ -27,18 +85,18 @@ def fetch_odds_data(sport, regions='us', markets='h2h'):
     if not key:
         return jsonify({"error": "missing api key"}), 500
     
-    url = f"https://api.the-odds-api.com/v4/sports/{sport}/odds/"
+    url = f"{ODDS_API_URL}/sports/{sport}/odds/"
     params = {
         "apiKey": key,
         "regions": regions,
         "markets": markets
     }
-    resp = requests.get(url, params=params, timeout=7)
+    resp = _timed_get('odds', url, params, timeout=7)
     try:
-        resp.raise_for_status
+        resp.raise_for_status()
     except requests.HTTPError:
         return jsonify({"error": "external API error", "details": resp.text}), resp.status_code
-    print("success - sending odds data")
+    logger.info("success - sending odds data", extra={'sport': sport})
     # WILL NEED TO DETERMINE IF NEED TO UPDATE ANY DB
     return resp.json()
 
@@ -48,14 +106,33 @@ def fetch_events_data(sport):
     if not key:
         return jsonify({"error": "missing api key"}), 500
     
-    url = f"https://api.the-odds-api.com/v4/sports/{sport}/events"
+    url = f"{ODDS_API_URL}/sports/{sport}/events"
     params = {
         "apiKey": key
     }
-    resp = requests.get(url, params=params, timeout=7)
+    resp = _timed_get('events', url, params, timeout=7)
     try:
         resp.raise_for_status()
     except requests.HTTPError:
         return jsonify({"error": "external API error", "details": resp.text}), resp.status_code
-    print("success - sending events data")
-    return resp.json()
\ No newline at end of file
+    logger.info("success - sending events data", extra={'sport': sport})
+    return resp.json()
+
+def fetch_scores_data(sport, days_from=3):
+    """Return scores of live and recently completed events"""
+    key = current_app.config.get('EXTERNAL_API_KEY')
+    if not key:
+        return jsonify({"error": "missing api key"}), 500
+
+    url = f"{ODDS_API_URL}/sports/{sport}/scores/"
+    params = {
+        "apiKey": key,
+        "daysFrom": days_from
+    }
+    resp = _timed_get('scores', url, params, timeout=7)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        return jsonify({"error": "external API error", "details": resp.text}), resp.status_code
+    logger.info("success - sending scores data", extra={'sport': sport})
+    return resp.json()
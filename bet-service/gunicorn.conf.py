@@ -0,0 +1,43 @@
+"""
+Gunicorn settings, loaded automatically from the working directory
+(Dockerfile CMD and start.sh).
+
+Serving modes (GUNICORN_WORKER_CLASS):
+- gevent (default): async I/O. Each request runs on a greenlet, and the
+  Redis, MongoDB and HTTP clients yield while they wait on a socket. A
+  worker serves up to GUNICORN_WORKER_CONNECTIONS requests at once, so a
+  slow upstream holds a greenlet, not the worker, and the long-lived
+  /bets/stream connections do not each hold a thread.
+- sync: one request at a time per worker; concurrency is the worker count.
+
+The app is preloaded: imported once in the master and forked into the
+workers, instead of imported again by every worker. Network clients
+(MongoDB, Redis, the user-service pool) connect on first use in each
+worker. Startup tasks (refresher, settlement, MongoDB seeding) start in
+post_worker_init.
+"""
+
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 2000))
+# A gevent worker keeps heartbeating while its requests wait on upstreams,
+# so this only catches a worker stuck on the CPU (or a sync worker's request)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+if worker_class == 'gevent' and preload_app:
+    # Patch before the master imports the app, or the locks and thread-locals
+    # it creates would be real threads' rather than greenlets'
+    from gevent import monkey
+    monkey.patch_all()
+
+os.environ['STARTUP_TASKS_POST_FORK'] = 'true'
+
+
+def post_worker_init(worker):
+    import startup_timing
+    from startup_tasks import run_on_startup
+    run_on_startup(worker.wsgi)
+    startup_timing.worker_ready()
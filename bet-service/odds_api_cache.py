@@ -0,0 +1,234 @@
+"""
+Cached fetches of Odds API endpoints.
+
+Every response is cached in Redis under (endpoint, sport, regions, markets),
+in the same {'data', 'cached_at'} JSON format as RedisCache's odds cache, so
+upstream calls grow with the number of distinct keys rather than with traffic:
+- each endpoint has its own TTL (events change rarely, odds often)
+- upstream 4xx responses (unknown sport, bad parameters) are cached too, as
+  {'error', 'status', 'cached_at'}, for NEGATIVE_CACHE_TTL_SECONDS
+- 5xx and 429 responses, timeouts and a missing API key are never cached
+
+Every successful response is also kept as the key's last known good entry
+for LAST_KNOWN_GOOD_TTL_SECONDS. When the Odds API is unavailable (circuit
+open, connection error, timeout, 5xx or 429), that entry is served instead,
+flagged with 'stale': True.
+
+Lookups that return data are counted by popularity.py, and the cache
+warmer pre-fetches the most requested combinations.
+
+Concurrent misses for the same key in a worker wait for a single upstream
+call instead of each making their own. Without Redis, that is the only
+sharing left: every request past it goes upstream.
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Tuple
+
+import requests
+
+from circuit_breaker import CircuitOpenError
+from redis_cache import redis_cache, CACHE_EXPIRY_SECONDS
+from external_api_client import fetch_odds_data, fetch_events_data
+from popularity import popularity
+from shared_utils import metrics, log
+
+logger = log.get_logger('odds_api_cache')
+
+# Cache TTLs per endpoint
+ODDS_CACHE_TTL_SECONDS = int(os.getenv('ODDS_CACHE_TTL_SECONDS', CACHE_EXPIRY_SECONDS))
+EVENTS_CACHE_TTL_SECONDS = int(os.getenv('EVENTS_CACHE_TTL_SECONDS', 600))
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv('NEGATIVE_CACHE_TTL_SECONDS', 300))
+LAST_KNOWN_GOOD_TTL_SECONDS = int(os.getenv('LAST_KNOWN_GOOD_TTL_SECONDS', 86400))
+
+# How long a request waits for another request's upstream call before making its own
+FETCH_WAIT_SECONDS = 10
+
+_HIT = metrics.CACHE_REQUESTS.labels('odds_api', 'hit')
+_NEGATIVE_HIT = metrics.CACHE_REQUESTS.labels('odds_api', 'negative_hit')
+_MISS = metrics.CACHE_REQUESTS.labels('odds_api', 'miss')
+_SHARED = metrics.CACHE_REQUESTS.labels('odds_api', 'shared')
+_STALE = metrics.CACHE_REQUESTS.labels('odds_api', 'stale')
+
+
+# endpoint -> (cache TTL, fetch(sport, regions, markets), Odds API credits per call)
+ENDPOINTS: Dict[str, Tuple[int, Callable[..., Any], Callable[..., int]]] = {
+    'odds': (
+        ODDS_CACHE_TTL_SECONDS,
+        lambda sport, regions, markets: fetch_odds_data(sport, regions, markets),
+        # The Odds API charges one credit per region per market
+        lambda regions, markets: len(regions.split(',')) * len(markets.split(','))
+    ),
+    'events': (
+        EVENTS_CACHE_TTL_SECONDS,
+        lambda sport, regions, markets: fetch_events_data(sport),
+        lambda regions, markets: 1
+    )
+}
+
+
+def cache_key(endpoint: str, sport: str, regions: Optional[str] = None,
+              markets: Optional[str] = None) -> str:
+    """Redis key of a cached fetch ('-' for parameters the endpoint does not take)."""
+    return f"odds_api:{endpoint}:{sport}:{regions or '-'}:{markets or '-'}"
+
+
+def to_entry(result: Any) -> Dict[str, Any]:
+    """
+    Cache entry for what an external_api_client fetch returned: its data, or
+    for an error the (jsonify response, status) pair's body and status.
+    """
+    cached_at = datetime.utcnow().isoformat()
+    if isinstance(result, tuple):
+        response, status = result
+        return {'error': response.get_json(silent=True), 'status': status, 'cached_at': cached_at}
+    return {'data': result, 'cached_at': cached_at}
+
+
+def upstream_unavailable(entry: Dict[str, Any]) -> bool:
+    """True for an entry of an upstream failure (5xx, or 429 when out of quota)."""
+    return 'error' in entry and (entry['status'] >= 500 or entry['status'] == 429)
+
+
+class _Flight:
+    """One upstream call that concurrent requests for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class OddsApiCache:
+    """Read-through Redis cache in front of the Odds API."""
+
+    def __init__(self, cache=redis_cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def get_odds(self, sport: str, regions: str = 'us', markets: str = 'h2h') -> Dict[str, Any]:
+        """
+        Odds for a sport (see fetch_odds_data), from cache if fresh.
+        Requests that return data count towards the sport's popularity.
+
+        Returns:
+            Cache entry: {'data', 'cached_at'[, 'stale']} or {'error', 'status', 'cached_at'}
+        """
+        return self._get('odds', sport, regions, markets)
+
+    def get_events(self, sport: str) -> Dict[str, Any]:
+        """
+        Events of a sport (see fetch_events_data), from cache if fresh.
+        Requests that return data count towards the sport's popularity.
+
+        Returns:
+            Cache entry: {'data', 'cached_at'[, 'stale']} or {'error', 'status', 'cached_at'}
+        """
+        return self._get('events', sport)
+
+    def _get(self, endpoint: str, sport: str, regions: Optional[str] = None,
+             markets: Optional[str] = None) -> Dict[str, Any]:
+        ttl_seconds, fetch, _cost = ENDPOINTS[endpoint]
+        entry = self.fetch(cache_key(endpoint, sport, regions, markets), ttl_seconds,
+                           lambda: fetch(sport, regions, markets))
+        if 'data' in entry:
+            popularity.record(endpoint, sport, regions, markets)
+        return entry
+
+    def is_cached(self, endpoint: str, sport: str, regions: Optional[str] = None,
+                  markets: Optional[str] = None) -> bool:
+        """True if the combination has a fresh (or negative) cache entry."""
+        return self._cache.exists(cache_key(endpoint, sport, regions, markets))
+
+    def warm(self, endpoint: str, sport: str, regions: Optional[str] = None,
+             markets: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fill the cache entry of a combination, without counting it as a request.
+
+        Returns:
+            The cache entry
+        """
+        ttl_seconds, fetch, _cost = ENDPOINTS[endpoint]
+        return self.fetch(cache_key(endpoint, sport, regions, markets), ttl_seconds,
+                          lambda: fetch(sport, regions, markets))
+
+    def fetch(self, key: str, ttl_seconds: int, fetch: Callable[[], Any]) -> Dict[str, Any]:
+        """
+        The cached entry for key, or the entry of a fresh fetch() stored for
+        ttl_seconds (NEGATIVE_CACHE_TTL_SECONDS for 4xx errors).
+        If the upstream is unavailable, the last known good entry is returned
+        instead, with 'stale': True. Without one, the failure is returned
+        (5xx/429 entry) or raised (CircuitOpenError, requests.RequestException)
+        to every request waiting on it.
+        """
+        entry = self._cache.get_json(key)
+        if entry is not None:
+            (_NEGATIVE_HIT if 'error' in entry else _HIT).inc()
+            return entry
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader and flight.done.wait(FETCH_WAIT_SECONDS):
+            _SHARED.inc()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        _MISS.inc()
+        try:
+            entry = self._fetch_or_last_known_good(key, fetch)
+            if leader:
+                flight.entry = entry
+            self._store(key, ttl_seconds, entry)
+            return entry
+        except BaseException as e:
+            if leader:
+                flight.error = e
+            raise
+        finally:
+            if leader:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+    def _fetch_or_last_known_good(self, key: str, fetch: Callable[[], Any]) -> Dict[str, Any]:
+        error = None
+        try:
+            entry = to_entry(fetch())
+            if not upstream_unavailable(entry):
+                return entry
+        except (CircuitOpenError, requests.RequestException) as e:
+            entry, error = None, e
+        last_good = self._cache.get_json(f"last_known_good:{key}")
+        if last_good is None:
+            if error is not None:
+                raise error
+            return entry
+        _STALE.inc()
+        reason = error if error is not None else f"upstream returned {entry['status']}"
+        logger.warning(f"Serving last known good {key}: {reason}",
+                       extra={**log.SAMPLED, 'cached_at': last_good['cached_at']})
+        return {**last_good, 'stale': True}
+
+    def _store(self, key: str, ttl_seconds: int, entry: Dict[str, Any]):
+        if entry.get('stale') or upstream_unavailable(entry):
+            return
+        if 'error' in entry:
+            ttl_seconds = NEGATIVE_CACHE_TTL_SECONDS
+            logger.info(f"Caching upstream {entry['status']} for {key}",
+                        extra={'status': entry['status'], 'ttl_seconds': ttl_seconds})
+        elif LAST_KNOWN_GOOD_TTL_SECONDS > 0:
+            self._cache.set_json(f"last_known_good:{key}", entry, LAST_KNOWN_GOOD_TTL_SECONDS)
+        if ttl_seconds > 0:
+            self._cache.set_json(key, entry, ttl_seconds)
+
+
+# Global cache instance
+odds_api_cache = OddsApiCache()
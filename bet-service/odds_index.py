@@ -0,0 +1,111 @@
+"""
+Price lookup for bet placement.
+
+Whenever odds are refreshed, every (event, selection) price is written to a
+Redis hash so any worker can look up the prices of a bet slip with a single
+HMGET, without loading and scanning the whole cached odds list. Each worker
+also keeps the quotes it indexed itself, used when Redis is unavailable.
+
+A selection is addressed as "home", "away", the team name, or the team id
+used by the frontend ("<event_id>-home" / "<event_id>-away").
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+
+from redis_cache import redis_cache, CACHE_EXPIRY_SECONDS
+
+# Quotes older than this are rejected at placement
+ODDS_MAX_AGE_SECONDS = float(os.getenv('ODDS_MAX_AGE_SECONDS', CACHE_EXPIRY_SECONDS + 30))
+ODDS_QUOTES_KEY = 'odds_quotes'
+
+
+def quote_key(event_id: str, selection: str) -> str:
+    """Hash field for a selection of an event."""
+    if selection in (f"{event_id}-home", f"{event_id}-away"):
+        selection = selection.rsplit('-', 1)[1]
+    return f"{event_id}:{selection}"
+
+
+def parse_commence_time(value: str) -> Optional[float]:
+    """Epoch seconds of an Odds API commence_time ("2024-01-01T20:00:00Z")."""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class OddsIndex:
+    """(event_id, selection) -> quote lookup backed by a Redis hash."""
+
+    def __init__(self, cache=redis_cache):
+        self._cache = cache
+        self._local: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_quotes(events: List[Dict[str, Any]], cached_at: float) -> Dict[str, Dict[str, Any]]:
+        """
+        Quotes for events in the frontend format (see transform_odds_for_frontend_optimized).
+        Each selection is indexed under its side and its team name.
+        """
+        quotes = {}
+        for event in events:
+            for side in ('home', 'away'):
+                price = event.get(f'{side}_team_price')
+                team = event.get(f'{side}_team')
+                if not price or not team:
+                    continue
+                quote = {
+                    'event_id': event['id'],
+                    'sport_key': event.get('sport_key', ''),
+                    'side': side,
+                    'team': team,
+                    'price': float(price),
+                    'commence_time': event.get('start_time', ''),
+                    'cached_at': cached_at,
+                }
+                quotes[quote_key(event['id'], side)] = quote
+                quotes[quote_key(event['id'], team)] = quote
+        return quotes
+
+    def update(self, events: List[Dict[str, Any]]):
+        """Index freshly fetched odds (replaces the previous quotes)."""
+        quotes = self.build_quotes(events, time.time())
+        with self._lock:
+            self._local = quotes
+        self._cache.set_hash(
+            ODDS_QUOTES_KEY,
+            {key: json.dumps(quote) for key, quote in quotes.items()},
+            int(ODDS_MAX_AGE_SECONDS)
+        )
+
+    def get_quotes(self, selections: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Current quotes for (event_id, selection) pairs, in order (None if unknown).
+        One Redis round trip for the whole list.
+        """
+        keys = [quote_key(event_id, selection) for event_id, selection in selections]
+        values = self._cache.get_hash_fields(ODDS_QUOTES_KEY, keys)
+        local = self._local
+        quotes = []
+        for index, key in enumerate(keys):
+            value = values[index] if values else None
+            if value is not None:
+                quotes.append(json.loads(value) if isinstance(value, str) else value)
+            else:
+                quotes.append(local.get(key))
+        return quotes
+
+
+def quote_is_stale(quote: Dict[str, Any], now: Optional[float] = None) -> bool:
+    """True if a quote is older than ODDS_MAX_AGE_SECONDS."""
+    return (now or time.time()) - quote['cached_at'] > ODDS_MAX_AGE_SECONDS
+
+
+# Global index instance
+odds_index = OddsIndex()
@@ -0,0 +1,194 @@
+"""
+Leader-elected odds refresher.
+
+Every worker runs the refresher loop, but only the holder of a Redis lease
+polls the Odds API. Upstream is therefore called once per interval
+cluster-wide, however many workers and instances run.
+
+Leadership and failover:
+- The leader renews its lease on every tick.
+- If the leader dies, the lease expires after REFRESH_LEASE_SECONDS and
+  another worker takes over.
+- A new leader only refreshes when the last cluster-wide refresh is older
+  than REFRESH_INTERVAL_SECONDS.
+
+Each refresh publishes the board to:
+- the Redis odds cache
+- the odds index
+- the odds stream
+- MongoDB, when available
+
+It then records its status in Redis, which /bets/refresher reports as
+health and lag.
+
+While the refresher is active, requests only read what it published.
+Without Redis there is no election, and requests fall back to fetching
+upstream on a cache miss.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import socket
+import threading
+from typing import Optional, Dict, Any
+
+from flask import Flask
+
+from redis_cache import redis_cache
+from external_api_client import fetch_odds_data
+from odds_index import odds_index
+from odds_stream import odds_stream
+from shared_utils import log
+
+logger = log.get_logger('odds_refresher')
+
+# Refresher configuration
+REFRESH_ENABLED = os.getenv('REFRESH_ENABLED', 'true').lower() == 'true'
+REFRESH_INTERVAL_SECONDS = float(os.getenv('REFRESH_INTERVAL_SECONDS', 45))
+REFRESH_LEASE_SECONDS = float(os.getenv('REFRESH_LEASE_SECONDS', 30))
+REFRESH_TICK_SECONDS = min(REFRESH_INTERVAL_SECONDS, REFRESH_LEASE_SECONDS / 3)
+REFRESH_LEASE_KEY = 'odds_refresher_lease'
+REFRESH_STATUS_KEY = 'odds_refresher_status'
+
+
+class OddsRefresher:
+    """Background refresh loop; one leader per cluster."""
+
+    def __init__(self, cache=redis_cache):
+        self._cache = cache
+        self.worker_id = None
+        self.is_leader = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        """True when the refresher owns upstream polling (enabled and Redis available)."""
+        return REFRESH_ENABLED and self._cache.available
+
+    def start(self, app: Flask):
+        """Start the loop in this worker (call after the gunicorn fork)."""
+        if not self.active:
+            logger.info("Disabled (REFRESH_ENABLED=false or Redis unavailable), "
+                        "odds are fetched on cache misses")
+            return
+        if self._thread is not None:
+            return
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._thread = threading.Thread(target=self._loop, args=(app,), name='odds-refresher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"Started as {self.worker_id}")
+
+    def stop(self):
+        """Stop the loop and hand the lease over immediately if this worker holds it."""
+        self._stop.set()
+        if self.is_leader:
+            self._cache.release_lease(REFRESH_LEASE_KEY, self.worker_id)
+            self.is_leader = False
+
+    def _loop(self, app: Flask):
+        while not self._stop.is_set():
+            try:
+                leader = self._cache.acquire_lease(REFRESH_LEASE_KEY, self.worker_id, REFRESH_LEASE_SECONDS)
+                if leader != self.is_leader:
+                    logger.info(f"{self.worker_id} {'became' if leader else 'is no longer'} leader")
+                    self.is_leader = leader
+                if leader and self._refresh_due():
+                    with app.app_context():
+                        self.refresh()
+            except Exception as e:
+                logger.exception(f"Error in refresh loop: {e}")
+            self._stop.wait(REFRESH_TICK_SECONDS)
+
+    def _refresh_due(self) -> bool:
+        status = self.status_record()
+        last_success = (status or {}).get('last_success_at') or 0
+        return time.time() - last_success >= REFRESH_INTERVAL_SECONDS
+
+    def status_record(self) -> Optional[Dict[str, Any]]:
+        """Status of the last refresh cluster-wide (as written by the leader)."""
+        return self._cache.get_json(REFRESH_STATUS_KEY)
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Fetch the default odds once and publish them everywhere.
+        Must run inside the Flask application context (for the Odds API key).
+
+        Returns:
+            The status record written to Redis
+        """
+        from routes.api_routes import transform_odds_for_frontend_optimized
+
+        start = time.time()
+        status = self.status_record() or {}
+        status.update(leader=self.worker_id, last_attempt_at=start)
+        try:
+            data = fetch_odds_data(sport='upcoming')
+            if not isinstance(data, list):
+                raise RuntimeError("Odds API returned no odds")
+            events = transform_odds_for_frontend_optimized(data)
+            redis_cache.set_cached_odds(events)
+            odds_index.update(events)
+            odds_stream.publish_board(events)
+            status['mongo_error'] = self._store_in_mongo(data)
+            status.update(
+                last_success_at=time.time(),
+                events=len(events),
+                duration_ms=round((time.time() - start) * 1000, 1),
+                error=None
+            )
+            logger.info(f"Refreshed {len(events)} events in {status['duration_ms']:.0f}ms")
+        except Exception as e:
+            status['error'] = str(e)
+            logger.error(f"Refresh failed: {e}")
+        self._cache.set_json(REFRESH_STATUS_KEY, status)
+        return status
+
+    @staticmethod
+    def _store_in_mongo(data) -> Optional[str]:
+        from config import db_handle
+        if db_handle is None:
+            return None
+        try:
+            from respository import BetRepository
+            BetRepository().update_live_odds(data)
+            return None
+        except Exception as e:
+            logger.warning(f"Could not store odds in MongoDB: {e}")
+            return str(e)
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Refresher health as seen from this worker.
+
+        Returns:
+            Dict with active, healthy, lag_seconds (since the last successful
+            refresh), leader, is_leader and the last refresh status
+        """
+        status = self.status_record() or {}
+        last_success = status.get('last_success_at')
+        lag = round(time.time() - last_success, 1) if last_success else None
+        # A healthy cluster refreshes every interval; allow one failover on top
+        max_lag = REFRESH_INTERVAL_SECONDS + REFRESH_LEASE_SECONDS + REFRESH_TICK_SECONDS
+        return {
+            'active': self.active,
+            'healthy': (not self.active) or (lag is not None and lag <= max_lag),
+            'lag_seconds': lag,
+            'max_lag_seconds': max_lag,
+            'leader': self._cache.get_value(REFRESH_LEASE_KEY),
+            'worker_id': self.worker_id,
+            'is_leader': self.is_leader,
+            'last_attempt_at': status.get('last_attempt_at'),
+            'last_success_at': last_success,
+            'events': status.get('events'),
+            'duration_ms': status.get('duration_ms'),
+            'error': status.get('error'),
+            'mongo_error': status.get('mongo_error')
+        }
+
+
+# Global refresher instance (one loop per worker)
+odds_refresher = OddsRefresher()
@@ -0,0 +1,243 @@
+"""
+Server-sent events stream of the odds board.
+
+On connect, a client gets a snapshot of the board. After that it only gets
+the events that changed at each refresh.
+
+Whoever refreshes the odds calls publish_board(). That call:
+- computes the diff against the previous board and serializes it once
+- stores the new board and its version in Redis
+- publishes the diff on a Redis channel
+
+Every worker runs one listener. It forwards each diff, as one pre-encoded
+frame, to all of its connected clients. A worker that misses a version
+(restart, Redis reconnect) resyncs from the stored board. Without Redis
+pub/sub (Upstash REST), workers poll the stored board instead. Without
+Redis at all, each worker only streams the refreshes it did itself.
+
+Each client is a generator waiting on its own bounded queue. Under gunicorn's
+gevent worker (gunicorn.conf.py), an idle connection costs a greenlet and a
+queue, not a thread. A client too slow to drain its queue is disconnected;
+EventSource reconnects and gets a fresh snapshot.
+"""
+
+import os
+import json
+import queue
+import threading
+import time
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from redis_cache import redis_cache
+from shared_utils import metrics, log
+
+logger = log.get_logger('odds_stream')
+
+# Stream configuration
+STREAM_CHANNEL = 'odds_stream'
+STREAM_BOARD_KEY = 'odds_stream_board'
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+STREAM_CLIENT_BUFFER = int(os.getenv('STREAM_CLIENT_BUFFER', 32))
+STREAM_POLL_SECONDS = float(os.getenv('STREAM_POLL_SECONDS', 2))
+
+STREAM_CLIENTS = metrics.gauge('odds_stream_clients', 'Connected /bets/stream clients')
+
+KEEPALIVE_FRAME = b": keepalive\n\n"
+_CLOSE = object()
+
+
+def diff_boards(old: Dict[str, Dict[str, Any]],
+                new: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Events added or changed between two boards (event id -> event), and ids removed.
+    """
+    changed = [event for event_id, event in new.items() if old.get(event_id) != event]
+    removed = [event_id for event_id in old if event_id not in new]
+    return changed, removed
+
+
+def sse_frame(event: str, data: str, event_id: Optional[int] = None) -> bytes:
+    """Encode one server-sent event (data must be a single line, e.g. compact JSON)."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {data}\n\n".encode()
+
+
+class OddsStream:
+    """Per-worker fan-out of board diffs to connected clients."""
+
+    def __init__(self, cache=redis_cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._board: Dict[str, Dict[str, Any]] = {}
+        self._version = 0
+        self._snapshot: Optional[bytes] = None
+        self._listener: Optional[threading.Thread] = None
+
+    # Publishing (the worker that refreshed the odds)
+
+    def publish_board(self, events: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        Publish a freshly fetched board to every worker.
+
+        Returns:
+            The new board version, or None if nothing changed
+        """
+        stored = self._cache.get_json(STREAM_BOARD_KEY)
+        if stored:
+            base, old = stored['version'], {e['id']: e for e in stored['events']}
+        else:
+            with self._lock:
+                base, old = self._version, self._board
+        board = {event['id']: event for event in events}
+        changed, removed = diff_boards(old, board)
+        if stored and not changed and not removed:
+            return None
+        version = base + 1
+        message = json.dumps(
+            {'version': version, 'base': base, 'changed': changed, 'removed': removed},
+            separators=(',', ':')
+        )
+        if (self._cache.set_json(STREAM_BOARD_KEY, {'version': version, 'events': events})
+                and self._cache.publish(STREAM_CHANNEL, message)):
+            return version  # delivered to this worker by its listener
+        self._deliver(message)
+        return version
+
+    # Receiving (every worker)
+
+    def _deliver(self, message: str):
+        update = json.loads(message)
+        with self._lock:
+            in_order = update['base'] == self._version
+            if in_order:
+                board = dict(self._board)
+                for event_id in update['removed']:
+                    board.pop(event_id, None)
+                for event in update['changed']:
+                    board[event['id']] = event
+        if in_order:
+            self._apply(update['version'], board, message)
+        else:
+            self._resync()
+
+    def _resync(self):
+        """Catch up with the stored board, sending clients the difference."""
+        stored = self._cache.get_json(STREAM_BOARD_KEY)
+        if not stored or stored['version'] == self._version:
+            return
+        board = {event['id']: event for event in stored['events']}
+        with self._lock:
+            changed, removed = diff_boards(self._board, board)
+            base = self._version
+        message = json.dumps(
+            {'version': stored['version'], 'base': base, 'changed': changed, 'removed': removed},
+            separators=(',', ':')
+        )
+        self._apply(stored['version'], board, message)
+
+    def _apply(self, version: int, board: Dict[str, Dict[str, Any]], message: str):
+        frame = sse_frame('diff', message, version)
+        with self._lock:
+            self._board = board
+            self._version = version
+            self._snapshot = None
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(frame)
+            except queue.Full:
+                self._disconnect(client)
+
+    def _disconnect(self, client: queue.Queue):
+        with self._lock:
+            self._clients.discard(client)
+        with client.mutex:
+            client.queue.clear()
+        client.put_nowait(_CLOSE)
+
+    def _listen(self):
+        while True:
+            pubsub = self._cache.pubsub()
+            if pubsub is None:
+                if not self._cache.available:
+                    return
+                # Upstash REST has no pub/sub: poll the stored board
+                self._resync()
+                time.sleep(STREAM_POLL_SECONDS)
+                continue
+            try:
+                pubsub.subscribe(STREAM_CHANNEL)
+                self._resync()
+                while True:
+                    item = pubsub.get_message(timeout=1.0)
+                    if item and item['type'] == 'message':
+                        self._deliver(item['data'])
+            except Exception as e:
+                logger.warning(f"Listener error, resubscribing: {e}")
+                time.sleep(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def _ensure_listening(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name='odds-stream', daemon=True)
+            self._listener.start()
+        self._resync()
+
+    # Clients
+
+    def _snapshot_frame(self) -> bytes:
+        # Serialized once per version, shared by every client connecting to it
+        if self._snapshot is None:
+            self._snapshot = sse_frame(
+                'snapshot', json.dumps(list(self._board.values()), separators=(',', ':')), self._version
+            )
+        return self._snapshot
+
+    def stream(self, last_event_id: Optional[str] = None) -> Iterator[bytes]:
+        """
+        Frames for one client: a snapshot (skipped if the client already has
+        the current version), then diffs and keepalive comments.
+        """
+        self._ensure_listening()
+        client: queue.Queue = queue.Queue(maxsize=STREAM_CLIENT_BUFFER)
+        with self._lock:
+            self._clients.add(client)
+            first = b"" if last_event_id == str(self._version) else self._snapshot_frame()
+        STREAM_CLIENTS.inc()
+        try:
+            yield b"retry: 3000\n\n" + first
+            while True:
+                try:
+                    frame = client.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    frame = KEEPALIVE_FRAME
+                if frame is _CLOSE:
+                    return
+                yield frame
+        finally:
+            STREAM_CLIENTS.dec()
+            with self._lock:
+                self._clients.discard(client)
+
+    def last_board(self) -> Optional[List[Dict[str, Any]]]:
+        """The last published board (Redis, else this worker's copy), or None if none yet."""
+        stored = self._cache.get_json(STREAM_BOARD_KEY)
+        if stored:
+            return stored['events']
+        with self._lock:
+            return list(self._board.values()) if self._version else None
+
+    def client_count(self) -> int:
+        """Clients connected to this worker."""
+        return len(self._clients)
+
+
+# Global stream instance
+odds_stream = OddsStream()
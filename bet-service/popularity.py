@@ -0,0 +1,106 @@
+"""
+Decayed request counts per Odds API cache key.
+
+Every cached odds or events lookup that returned data counts one request for
+its (endpoint, sport, regions, markets) combination. Counts decay with a
+half-life of POPULARITY_HALF_LIFE_SECONDS, so the ranking follows what is
+popular now rather than all time. The cache warmer pre-fetches the top of it.
+
+Decay is forward decay. Instead of shrinking every count as time passes, a
+request at time t adds 2^((t - start) / half-life), which ranks the same. To
+keep the increments bounded, each period of POPULARITY_PERIOD_HALF_LIVES
+half-lives has its own sorted set, and the previous period's set is read
+scaled down by 2^-POPULARITY_PERIOD_HALF_LIVES. Periods follow the clock,
+so workers need no coordination.
+
+Requests are counted in-process. Each worker flushes its counts to Redis in
+one pipeline (see CacheWarmer), so counting a request costs a dict update.
+"""
+
+import os
+import time
+import threading
+from typing import Optional, List, Tuple, Dict
+
+from redis_cache import redis_cache
+
+# Popularity configuration
+POPULARITY_HALF_LIFE_SECONDS = float(os.getenv('POPULARITY_HALF_LIFE_SECONDS', 6 * 3600))
+POPULARITY_FLUSH_SECONDS = float(os.getenv('POPULARITY_FLUSH_SECONDS', 10))
+POPULARITY_PERIOD_HALF_LIVES = 16
+POPULARITY_KEY = 'odds_api_popularity'
+
+
+def member(endpoint: str, sport: str, regions: Optional[str] = None, markets: Optional[str] = None) -> str:
+    """Sorted set member of a combination ('-' for parameters the endpoint does not take)."""
+    return f"{endpoint}|{sport}|{regions or '-'}|{markets or '-'}"
+
+
+def parse_member(value: str) -> Tuple[str, str, Optional[str], Optional[str]]:
+    """(endpoint, sport, regions, markets) of a sorted set member."""
+    endpoint, sport, regions, markets = value.split('|')
+    return endpoint, sport, None if regions == '-' else regions, None if markets == '-' else markets
+
+
+class PopularityTracker:
+    """Forward-decayed request counts in Redis, buffered per worker."""
+
+    def __init__(self, cache=redis_cache, half_life_seconds: float = POPULARITY_HALF_LIFE_SECONDS):
+        self._cache = cache
+        self.half_life = half_life_seconds
+        self.period_seconds = half_life_seconds * POPULARITY_PERIOD_HALF_LIVES
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def record(self, endpoint: str, sport: str, regions: Optional[str] = None, markets: Optional[str] = None):
+        """Count one request for a combination (in-process until the next flush)."""
+        key = member(endpoint, sport, regions, markets)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def _period(self, now: float) -> Tuple[int, float]:
+        index = int(now // self.period_seconds)
+        return index, index * self.period_seconds
+
+    def flush(self) -> int:
+        """
+        Add this worker's counts to Redis. Counts are dropped if Redis is
+        unavailable, rather than piling up.
+
+        Returns:
+            Number of combinations flushed
+        """
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return 0
+        now = time.time()
+        index, start = self._period(now)
+        weight = 2 ** ((now - start) / self.half_life)
+        self._cache.incr_scores(
+            f"{POPULARITY_KEY}:{index}",
+            {key: count * weight for key, count in counts.items()},
+            int(2 * self.period_seconds)
+        )
+        return len(counts)
+
+    def top(self, count: int) -> List[Tuple[str, float]]:
+        """
+        The most requested combinations.
+
+        Returns:
+            List of (member, decayed request count), most requested first
+        """
+        now = time.time()
+        index, start = self._period(now)
+        scores: Dict[str, float] = dict(self._cache.top_scores(f"{POPULARITY_KEY}:{index}", count))
+        previous_scale = 2 ** -POPULARITY_PERIOD_HALF_LIVES
+        for key, score in self._cache.top_scores(f"{POPULARITY_KEY}:{index - 1}", count):
+            scores[key] = scores.get(key, 0.0) + score * previous_scale
+        scale = 2 ** (-(now - start) / self.half_life)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:count]
+        return [(key, round(score * scale, 3)) for key, score in ranked]
+
+
+# Global tracker instance (one buffer per worker)
+popularity = PopularityTracker()
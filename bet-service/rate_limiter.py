@@ -0,0 +1,183 @@
+"""
+Per-client rate limiting of the bets API.
+
+Each (route, client) pair has a token bucket in Redis. The bucket is
+refilled at the route's rate per second up to its burst, and every request
+takes a token. One Lua script call checks and updates the bucket atomically,
+shared by all workers and instances.
+
+A client is its API key when it sends one listed in RATE_LIMIT_API_KEYS
+(X-API-Key header). Otherwise it is its IP address, read from the
+X-Forwarded-For entries added by our own RATE_LIMIT_TRUSTED_PROXIES
+proxies (Cloud Run's front end adds one).
+
+Fast path: while a client's bucket is more than half full, a worker takes
+RATE_LIMIT_LOCAL_BATCH tokens in one call and spends them in-process for up
+to RATE_LIMIT_LOCAL_SECONDS. Clients well under their limit therefore reach
+Redis once per batch of requests. Near the limit, every request takes a
+single token from Redis, so the limit stays exact.
+
+Without Redis, each worker limits on its own bucket (so the effective limit
+is multiplied by the number of workers).
+"""
+
+import os
+import math
+import time
+import hashlib
+import threading
+from typing import Dict, Tuple, Optional, List
+
+from redis_cache import redis_cache
+from shared_utils import metrics, log
+
+logger = log.get_logger('rate_limiter')
+
+# Rate limit configuration: limits are "<tokens per second>:<burst>", 0 disables
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', '20:40')
+RATE_LIMIT_ROUTES = os.getenv(
+    'RATE_LIMIT_ROUTES', '/bets/getodds=5:20,/bets/getevents=5:20,/bets/place=2:10,/bets/status=0'
+)
+RATE_LIMIT_API_KEYS = [k.strip() for k in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if k.strip()]
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 1))
+RATE_LIMIT_LOCAL_BATCH = int(os.getenv('RATE_LIMIT_LOCAL_BATCH', 5))
+RATE_LIMIT_LOCAL_SECONDS = float(os.getenv('RATE_LIMIT_LOCAL_SECONDS', 1.0))
+RATE_LIMIT_LOCAL_MAX_CLIENTS = 10000
+
+RATE_LIMIT_REJECTIONS = metrics.counter(
+    'rate_limit_rejections_total', 'Requests rejected with 429 by the rate limiter', ['route']
+)
+RATE_LIMIT_CHECKS = metrics.counter(
+    'rate_limit_checks_total', 'Rate limit decisions by where they were made (local, redis, fallback)', ['source']
+)
+_CHECKED_LOCAL = RATE_LIMIT_CHECKS.labels('local')
+_CHECKED_REDIS = RATE_LIMIT_CHECKS.labels('redis')
+_CHECKED_FALLBACK = RATE_LIMIT_CHECKS.labels('fallback')
+
+# API keys are only ever written to Redis keys as digests
+_API_KEY_IDS = {key: hashlib.sha256(key.encode()).hexdigest()[:16] for key in RATE_LIMIT_API_KEYS}
+
+
+def parse_limit(value: str) -> Optional[Tuple[float, int]]:
+    """(rate per second, burst) of a "<rate>:<burst>" limit, or None if it is 0 (unlimited)."""
+    rate, _, burst = value.strip().partition(':')
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, int(burst) if burst else max(1, math.ceil(rate))
+
+
+def parse_route_limits(value: str) -> Dict[str, Optional[Tuple[float, int]]]:
+    """Route rule -> limit, from "/bets/a=5:20,/bets/b=0"."""
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            route, limit = item.split('=', 1)
+            limits[route.strip()] = parse_limit(limit)
+    return limits
+
+
+def client_id(headers, remote_addr: Optional[str]) -> str:
+    """The rate-limited identity of a request: "key:<digest>" or "ip:<address>"."""
+    api_key = headers.get('X-API-Key')
+    if api_key and api_key in _API_KEY_IDS:
+        return f"key:{_API_KEY_IDS[api_key]}"
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded: List[str] = [h.strip() for h in headers.get('X-Forwarded-For', '').split(',') if h.strip()]
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return f"ip:{forwarded[-RATE_LIMIT_TRUSTED_PROXIES]}"
+    return f"ip:{remote_addr}"
+
+
+class RateLimiter:
+    """Token buckets per (route, client), in Redis with an in-process fast path."""
+
+    def __init__(self, cache=redis_cache, default: str = RATE_LIMIT_DEFAULT, routes: str = RATE_LIMIT_ROUTES):
+        self._cache = cache
+        self.default = parse_limit(default)
+        self.routes = parse_route_limits(routes)
+        self._lock = threading.Lock()
+        self._leases: Dict[str, list] = {}  # bucket key -> [tokens left, expires at]
+        self._local_buckets: Dict[str, list] = {}  # bucket key -> [tokens, updated at] (no Redis)
+
+    def limit_for(self, route: str) -> Optional[Tuple[float, int]]:
+        return self.routes.get(route, self.default)
+
+    def allow(self, route: str, client: str) -> Tuple[bool, float]:
+        """
+        Take a token for a request of client to route.
+
+        Returns:
+            (allowed, seconds to wait before retrying if not)
+        """
+        limit = self.limit_for(route)
+        if limit is None:
+            return True, 0.0
+        rate, burst = limit
+        key = f"rate_limit:{route}:{client}"
+        now = time.monotonic()
+
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] > 0 and lease[1] > now:
+                lease[0] -= 1
+                _CHECKED_LOCAL.inc()
+                return True, 0.0
+
+        batch = min(RATE_LIMIT_LOCAL_BATCH, burst // 4) if RATE_LIMIT_LOCAL_SECONDS > 0 else 1
+        result = self._cache.take_tokens(key, rate, burst, max(1, batch))
+        if result is None:
+            _CHECKED_FALLBACK.inc()
+            return self._allow_locally(key, rate, burst, now)
+        _CHECKED_REDIS.inc()
+        granted, retry_after = result
+        if granted > 1:
+            with self._lock:
+                if len(self._leases) >= RATE_LIMIT_LOCAL_MAX_CLIENTS:
+                    self._leases = {k: v for k, v in self._leases.items() if v[1] > now and v[0] > 0}
+                self._leases[key] = [granted - 1, now + RATE_LIMIT_LOCAL_SECONDS]
+        return granted > 0, retry_after
+
+    def _allow_locally(self, key: str, rate: float, burst: int, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            bucket = self._local_buckets.get(key)
+            if bucket is None:
+                if len(self._local_buckets) >= RATE_LIMIT_LOCAL_MAX_CLIENTS:
+                    self._local_buckets.clear()
+                bucket = self._local_buckets[key] = [float(burst), now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            return False, (1 - bucket[0]) / rate
+
+
+# Global limiter instance
+rate_limiter = RateLimiter()
+
+
+def init_app(blueprint, limiter: RateLimiter = rate_limiter):
+    """
+    Rate limit every route of a blueprint (or app), answering 429 with a
+    Retry-After header when a client is over its limit.
+    """
+    from flask import request, jsonify
+
+    if not RATE_LIMIT_ENABLED:
+        logger.info("Rate limiting disabled (RATE_LIMIT_ENABLED=false)")
+        return
+
+    @blueprint.before_request
+    def _rate_limit():
+        if request.url_rule is None:
+            return None
+        route = request.url_rule.rule
+        allowed, retry_after = limiter.allow(route, client_id(request.headers, request.remote_addr))
+        if allowed:
+            return None
+        RATE_LIMIT_REJECTIONS.labels(route).inc()
+        response = jsonify({"error": "Rate limit exceeded", "retry_after": round(retry_after, 3)})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, 429
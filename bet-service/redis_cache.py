@@ -1,8 +1,13 @@
 import os
-import json
+import time
+import threading
 import redis
+import cache_codec
+from shared_utils import metrics, profiling, log
 from datetime import datetime, timedelta
-from typing import Optional, Any
+from typing import Optional, Any, Dict
+
+logger = log.get_logger('redis_cache')
 
 # Redis configuration
 # Supports Upstash REST API (with token), traditional Redis URL, or local Redis
@@ -17,17 +22,125 @@ REDIS_DB = int(os.getenv('REDIS_DB', 0))
 # Cache settings
 CACHE_EXPIRY_SECONDS = 60  # 1 minute cache expiry
 
+# Metrics
+_ODDS_CACHE_HIT = metrics.CACHE_REQUESTS.labels('odds', 'hit')
+_ODDS_CACHE_MISS = metrics.CACHE_REQUESTS.labels('odds', 'miss')
+_ODDS_CACHE_ERROR = metrics.CACHE_REQUESTS.labels('odds', 'error')
+_REDIS_MGET = metrics.DEPENDENCY_DURATION.labels('redis', 'mget', 'ok')
+_REDIS_HMGET = metrics.DEPENDENCY_DURATION.labels('redis', 'hmget', 'ok')
+_REDIS_TOKEN_BUCKET = metrics.DEPENDENCY_DURATION.labels('redis', 'token_bucket', 'ok')
+
+# Lease scripts: only the current owner may extend or release a lease
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Token bucket (hash of tokens and last refill ms, on the Redis clock).
+# Grants ARGV[3] tokens if the bucket stays at least half full after that,
+# else 1 token if available, else none.
+# Returns {tokens granted, ms until one token is available}.
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local batch = tonumber(ARGV[3])
+local t = redis.call('time')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = 0
+if batch > 1 and tokens - batch >= burst / 2 then
+    granted = batch
+elseif tokens >= 1 then
+    granted = 1
+end
+tokens = tokens - granted
+redis.call('hset', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('pexpire', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+if granted > 0 then
+    return {granted, 0}
+end
+return {0, math.ceil((1 - tokens) * 1000 / rate)}
+"""
+
+def odds_manifest_key(cache_key: str) -> str:
+    """Redis key of an odds board's manifest (its sports and event order)"""
+    return f"{cache_key}:manifest"
+
+
+def odds_shard_key(cache_key: str, sport: str) -> str:
+    """Redis key of one sport's events on an odds board"""
+    return f"{cache_key}:{sport}"
+
+
+def _merge_shards(manifest: dict, data: Dict[str, list]) -> list:
+    """Events of the sports in data, in board order"""
+    if len(data) == 1:
+        return next(iter(data.values()))
+    iterators = [iter(data[sport]) if sport in data else None for sport in manifest['sports']]
+    return [next(iterators[index]) for index in manifest['order'] if iterators[index] is not None]
+
+
 class RedisCache:
     """
     Redis cache manager with time-based invalidation.
     Supports Upstash REST API (production), traditional Redis, and local Redis (development).
+
+    Connects on first use in each process rather than at import, so a
+    preloaded gunicorn master never shares a connection with its workers.
+
+    Odds and JSON values are stored encoded by cache_codec. With redis-py they
+    go through a second client that returns bytes; the main client decodes
+    responses to str for everything else.
     """
     
     def __init__(self):
-        self.client = None
-        self.available = False
+        self._client = None
+        self._binary_client = None
+        self._available = False
+        self._scripts = {}
+        self._board_sports: Dict[str, list] = {}  # board key -> sports of its last manifest read
         self.is_upstash_rest = False
-        self._initialize()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _after_fork(self):
+        self._client = None
+        self._binary_client = None
+        self._available = False
+        self._scripts = {}
+        self._initialized = False
+        self._init_lock = threading.Lock()
+    
+    def _ensure_initialized(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._initialize()
+                    self._initialized = True
+    
+    @property
+    def available(self) -> bool:
+        """True if Redis answered the connection ping (connects on first use)"""
+        self._ensure_initialized()
+        return self._available
+    
+    @property
+    def client(self):
+        self._ensure_initialized()
+        return self._client
     
     def _initialize(self):
         """Initialize Redis connection (Upstash REST API, Redis URL, or local)"""
@@ -35,116 +148,160 @@ class RedisCache:
             # Priority 1: Use Upstash REST API (serverless-friendly, no persistent connections)
             if UPSTASH_REDIS_REST_URL and UPSTASH_REDIS_REST_TOKEN:
                 from upstash_redis import Redis as UpstashRedis
-                print(f"[redis_cache] Connecting to Upstash REST API")
-                self.client = UpstashRedis(
+                logger.info("Connecting to Upstash REST API")
+                self._client = UpstashRedis(
                     url=UPSTASH_REDIS_REST_URL,
                     token=UPSTASH_REDIS_REST_TOKEN
                 )
                 self.is_upstash_rest = True
                 # Test connection
-                self.client.ping()
-                self.available = True
-                print(f"[redis_cache] ✅ Upstash REST connected successfully")
+                self._client.ping()
+                self._available = True
+                logger.info("Upstash REST connected successfully")
                 
             # Priority 2: Use REDIS_URL if provided (traditional Redis URL)
             elif REDIS_URL:
-                print(f"[redis_cache] Connecting to Redis via URL")
-                self.client = redis.from_url(
-                    REDIS_URL,
-                    decode_responses=True,
+                logger.info("Connecting to Redis via URL")
+                options = dict(
                     socket_connect_timeout=5,
                     socket_timeout=5,
                     ssl_cert_reqs=None  # Required for SSL connections
                 )
+                self._client = redis.from_url(REDIS_URL, decode_responses=True, **options)
+                self._binary_client = redis.from_url(REDIS_URL, decode_responses=False, **options)
                 self.is_upstash_rest = False
                 # Test connection
-                self.client.ping()
-                self.available = True
-                print(f"[redis_cache] ✅ Redis connected successfully")
+                self._client.ping()
+                self._available = True
+                logger.info("Redis connected successfully")
                 
             # Priority 3: Use individual parameters (local Redis)
             else:
-                print(f"[redis_cache] Connecting to local Redis at {REDIS_HOST}:{REDIS_PORT}")
-                self.client = redis.Redis(
+                logger.info(f"Connecting to local Redis at {REDIS_HOST}:{REDIS_PORT}")
+                options = dict(
                     host=REDIS_HOST,
                     port=REDIS_PORT,
                     password=REDIS_PASSWORD,
                     db=REDIS_DB,
-                    decode_responses=True,
                     socket_connect_timeout=2,
                     socket_timeout=2
                 )
+                self._client = redis.Redis(decode_responses=True, **options)
+                self._binary_client = redis.Redis(decode_responses=False, **options)
                 self.is_upstash_rest = False
                 # Test connection
-                self.client.ping()
-                self.available = True
-                print(f"[redis_cache] ✅ Local Redis connected successfully")
+                self._client.ping()
+                self._available = True
+                logger.info("Local Redis connected successfully")
                 
         except Exception as e:
-            print(f"[redis_cache] ❌ Redis not available: {e}")
-            print(f"[redis_cache] Caching will be disabled")
-            self.available = False
+            logger.warning(f"Redis not available: {e}")
+            logger.warning("Caching will be disabled")
+            self._available = False
     
-    def get_cached_odds(self, cache_key: str = 'live_odds') -> Optional[dict]:
+    def get_cached_odds(self, cache_key: str = 'live_odds', sports: Optional[list] = None) -> Optional[dict]:
         """
         Get cached odds if available. Redis TTL handles expiration automatically.
         Works with both Upstash REST API and traditional Redis.
-        
+
+        The board is sharded per sport (see set_cached_odds). The manifest and
+        the shards are read with one MGET: the shards requested, or for the
+        whole board the sports of the last manifest this worker read.
+
+        Args:
+            cache_key: Name of the board (prefix of its keys)
+            sports: sport_keys to return (default: the whole board)
+
         Returns:
             dict with 'data' and 'cached_at' keys, or None if not available
         """
         if not self.available:
+            _ODDS_CACHE_MISS.inc()
             return None
-        
+
         try:
-            cached_data = self.client.get(cache_key)
-            if cached_data:
-                # Upstash REST returns string directly, traditional Redis may too
-                if isinstance(cached_data, str):
-                    parsed_data = json.loads(cached_data)
-                else:
-                    parsed_data = cached_data
-                # Redis TTL handles expiration, so if we got data it's valid
-                return parsed_data
-            return None
+            wanted = list(dict.fromkeys(sports)) if sports is not None else self._board_sports.get(cache_key, [])
+            values = self._mget([odds_manifest_key(cache_key)] + [odds_shard_key(cache_key, sport) for sport in wanted])
+            if values[0] is None:
+                _ODDS_CACHE_MISS.inc()
+                return None
+            with profiling.span('serialization'):
+                manifest = cache_codec.decode(values[0])
+                self._board_sports[cache_key] = manifest['sports']
+                needed = manifest['sports'] if sports is None else [s for s in wanted if s in manifest['sports']]
+                shards = {sport: value for sport, value in zip(wanted, values[1:]) if sport in needed}
+                missing = [sport for sport in needed if sport not in shards]
+                if missing:
+                    # The board's sports changed since this worker last read it
+                    shards.update(zip(missing, self._mget([odds_shard_key(cache_key, s) for s in missing])))
+                data = {}
+                for sport, value in shards.items():
+                    shard = cache_codec.decode(value) if value is not None else None
+                    if shard is None or shard['cached_at'] != manifest['cached_at']:
+                        # Expired, or written by another refresh (Upstash without MULTI)
+                        _ODDS_CACHE_MISS.inc()
+                        return None
+                    data[sport] = shard['data']
+            _ODDS_CACHE_HIT.inc()
+            return {'data': _merge_shards(manifest, data), 'cached_at': manifest['cached_at']}
         except Exception as e:
-            print(f"[redis_cache] Error retrieving cache: {e}")
+            _ODDS_CACHE_ERROR.inc()
+            logger.error(f"Error retrieving cache: {e}")
             return None
-    
+
     def set_cached_odds(self, data: Any, cache_key: str = 'live_odds') -> bool:
         """
-        Cache the odds data with timestamp.
+        Cache the odds data with timestamp, sharded per sport.
         Works with both Upstash REST API and traditional Redis.
-        
+
+        Each sport's events are stored under "<cache_key>:<sport_key>". The
+        manifest under "<cache_key>:manifest" lists the sports and the events' order on
+        the board. Everything is written in one MULTI/EXEC, so readers see
+        either the previous board or this one.
+
         Args:
-            data: The odds data to cache
+            data: The odds data to cache (events with a 'sport_key')
             cache_key: Redis key to use
-            
+
         Returns:
             True if successful, False otherwise
         """
         if not self.available:
             return False
-        
+
         try:
-            cache_data = {
-                'data': data,
-                'cached_at': datetime.utcnow().isoformat()
-            }
-            
-            # Set with expiry (TTL)
-            # Both Upstash REST and traditional Redis support setex
-            self.client.setex(
-                cache_key,
-                CACHE_EXPIRY_SECONDS + 5,  # Add 5 seconds buffer
-                json.dumps(cache_data)
-            )
-            print(f"[redis_cache] Cached odds at {cache_data['cached_at']}")
+            cached_at = datetime.utcnow().isoformat()
+            indexes: Dict[str, int] = {}
+            shards = []
+            order = []
+            for event in data:
+                sport = event.get('sport_key', '')
+                if sport not in indexes:
+                    indexes[sport] = len(shards)
+                    shards.append([])
+                shards[indexes[sport]].append(event)
+                order.append(indexes[sport])
+            manifest = {'sports': list(indexes), 'order': order, 'cached_at': cached_at}
+
+            ttl_seconds = CACHE_EXPIRY_SECONDS + 5  # Add 5 seconds buffer
+            if self.is_upstash_rest:
+                pipe = self.client.multi()
+            else:
+                pipe = self._binary_client.pipeline(transaction=True)
+            for sport, events in zip(indexes, shards):
+                pipe.setex(odds_shard_key(cache_key, sport), ttl_seconds,
+                           self._encode({'data': events, 'cached_at': cached_at}))
+            pipe.setex(odds_manifest_key(cache_key), ttl_seconds, self._encode(manifest))
+            if self.is_upstash_rest:
+                pipe.exec()
+            else:
+                pipe.execute()
+            logger.info(f"Cached odds at {cached_at} ({len(data)} events, {len(shards)} sports)")
             return True
         except Exception as e:
-            print(f"[redis_cache] Error setting cache: {e}")
+            logger.error(f"Error setting cache: {e}")
             return False
-    
+
     def should_refresh_cache(self, cache_key: str = 'live_odds') -> bool:
         """
         Check if cache should be refreshed based on time.
@@ -156,11 +313,11 @@ class RedisCache:
             return True
         
         try:
-            cached_data = self.client.get(cache_key)
+            cached_data = self._get_raw(odds_manifest_key(cache_key))
             if not cached_data:
                 return True
             
-            parsed_data = json.loads(cached_data)
+            parsed_data = cache_codec.decode(cached_data)
             cached_at = datetime.fromisoformat(parsed_data['cached_at'])
             
             # Check if more than 1 minute has passed
@@ -168,24 +325,287 @@ class RedisCache:
             should_refresh = time_diff >= timedelta(seconds=CACHE_EXPIRY_SECONDS)
             
             if should_refresh:
-                print(f"[redis_cache] Cache needs refresh (last cached: {cached_at}, age: {time_diff.seconds}s)")
+                logger.debug(f"Cache needs refresh (last cached: {cached_at}, age: {time_diff.seconds}s)")
             
             return should_refresh
         except Exception as e:
-            print(f"[redis_cache] Error checking cache freshness: {e}")
+            logger.error(f"Error checking cache freshness: {e}")
+            return True
+    
+    def set_hash(self, key: str, mapping: dict, ttl_seconds: int) -> bool:
+        """
+        Replace a hash with the given field -> string mapping and set its TTL.
+        Works with both Upstash REST API and traditional Redis.
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.available:
+            return False
+        
+        try:
+            if self.is_upstash_rest:
+                self.client.delete(key)
+                if mapping:
+                    self.client.hset(key, values=mapping)
+                    self.client.expire(key, ttl_seconds)
+            else:
+                # MULTI/EXEC so readers never see a half-written hash
+                pipe = self.client.pipeline(transaction=True)
+                pipe.delete(key)
+                if mapping:
+                    pipe.hset(key, mapping=mapping)
+                    pipe.expire(key, ttl_seconds)
+                pipe.execute()
             return True
+        except Exception as e:
+            logger.error(f"Error setting hash {key}: {e}")
+            return False
+    
+    def get_hash_fields(self, key: str, fields: list) -> Optional[list]:
+        """
+        Get several fields of a hash in one round trip (HMGET).
+        
+        Returns:
+            List of values (None for missing fields), or None if Redis is unavailable
+        """
+        if not self.available or not fields:
+            return None
+        
+        try:
+            start = time.perf_counter()
+            values = self.client.hmget(key, *fields)
+            _REDIS_HMGET.observe(time.perf_counter() - start)
+            return values
+        except Exception as e:
+            logger.error(f"Error reading hash {key}: {e}")
+            return None
     
+    def incr_scores(self, key: str, increments: dict, ttl_seconds: int) -> bool:
+        """
+        Add to the scores of members of a sorted set (ZINCRBY) and set its TTL.
+        Works with both Upstash REST API and traditional Redis.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.available or not increments:
+            return False
+
+        try:
+            if self.is_upstash_rest:
+                for member, amount in increments.items():
+                    self.client.zincrby(key, amount, member)
+                self.client.expire(key, ttl_seconds)
+            else:
+                pipe = self.client.pipeline(transaction=False)
+                for member, amount in increments.items():
+                    pipe.zincrby(key, amount, member)
+                pipe.expire(key, ttl_seconds)
+                pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error incrementing scores in {key}: {e}")
+            return False
+
+    def top_scores(self, key: str, count: int) -> list:
+        """
+        The count highest-scored members of a sorted set.
+
+        Returns:
+            List of (member, score), highest first (empty if Redis is unavailable)
+        """
+        if not self.available or count <= 0:
+            return []
+
+        try:
+            if self.is_upstash_rest:
+                pairs = self.client.zrange(key, 0, count - 1, rev=True, withscores=True)
+            else:
+                pairs = self.client.zrevrange(key, 0, count - 1, withscores=True)
+            return [(member, float(score)) for member, score in pairs]
+        except Exception as e:
+            logger.error(f"Error reading top scores of {key}: {e}")
+            return []
+
+    def exists(self, key: str) -> bool:
+        """True if the key exists (False if Redis is unavailable)"""
+        if not self.available:
+            return False
+
+        try:
+            return bool(self.client.exists(key))
+        except Exception as e:
+            logger.error(f"Error checking {key}: {e}")
+            return False
+
+    def get_json(self, key: str) -> Optional[Any]:
+        """Get a JSON value, or None if missing or Redis is unavailable"""
+        if not self.available:
+            return None
+
+        try:
+            value = self._get_raw(key)
+            if value is None:
+                return None
+            return cache_codec.decode(value) if isinstance(value, (str, bytes)) else value
+        except Exception as e:
+            logger.error(f"Error reading {key}: {e}")
+            return None
+
+    def set_json(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> bool:
+        """Store a JSON-compatible value (without expiry unless ttl_seconds is given)"""
+        if not self.available:
+            return False
+
+        try:
+            self._set_raw(key, self._encode(value), ttl_seconds)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing {key}: {e}")
+            return False
+
+    def _encode(self, value: Any):
+        # The Upstash REST API only carries text
+        return cache_codec.encode_text(value) if self.is_upstash_rest else cache_codec.encode(value)
+
+    def _mget(self, keys: list) -> list:
+        if not keys:
+            return []
+        start = time.perf_counter()
+        client = self._binary_client or self.client
+        values = client.mget(*keys) if self.is_upstash_rest else client.mget(keys)
+        _REDIS_MGET.observe(time.perf_counter() - start)
+        return values
+
+    def _get_raw(self, key: str):
+        return (self._binary_client or self.client).get(key)
+
+    def _set_raw(self, key: str, value, ttl_seconds: Optional[int] = None):
+        client = self._binary_client or self.client
+        if ttl_seconds:
+            client.setex(key, ttl_seconds, value)
+        else:
+            client.set(key, value)
+
+    def publish(self, channel: str, message: str) -> bool:
+        """
+        Publish a message to a pub/sub channel.
+        Not supported over the Upstash REST API.
+
+        Returns:
+            True if published, False otherwise
+        """
+        if not self.available or self.is_upstash_rest:
+            return False
+
+        try:
+            self.client.publish(channel, message)
+            return True
+        except Exception as e:
+            logger.error(f"Error publishing to {channel}: {e}")
+            return False
+
+    def pubsub(self):
+        """
+        A new pub/sub connection, or None if Redis is unavailable or
+        reached over the Upstash REST API (which has no pub/sub).
+        """
+        if not self.available or self.is_upstash_rest:
+            return None
+        return self.client.pubsub(ignore_subscribe_messages=True)
+
+    def acquire_lease(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Take a lease (SET NX with expiry) or extend it if owner already holds it.
+
+        Returns:
+            True if owner holds the lease afterwards
+        """
+        if not self.available:
+            return False
+
+        try:
+            ttl_ms = int(ttl_seconds * 1000)
+            if self.client.set(key, owner, nx=True, px=ttl_ms):
+                return True
+            return bool(self._eval(_RENEW_LEASE_SCRIPT, [key], [owner, ttl_ms]))
+        except Exception as e:
+            logger.error(f"Error acquiring lease {key}: {e}")
+            return False
+
+    def release_lease(self, key: str, owner: str) -> bool:
+        """Release a lease if owner still holds it"""
+        if not self.available:
+            return False
+
+        try:
+            return bool(self._eval(_RELEASE_LEASE_SCRIPT, [key], [owner]))
+        except Exception as e:
+            logger.error(f"Error releasing lease {key}: {e}")
+            return False
+
+    def get_value(self, key: str) -> Optional[str]:
+        """Get a plain string value, or None if missing or Redis is unavailable"""
+        if not self.available:
+            return None
+
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            logger.error(f"Error reading {key}: {e}")
+            return None
+
+    def take_tokens(self, key: str, rate: float, burst: int, batch: int = 1) -> Optional[tuple]:
+        """
+        Take tokens from a token bucket refilled at rate per second up to burst.
+        batch tokens are taken if the bucket stays at least half full after
+        that, else a single one.
+
+        Returns:
+            (tokens granted, seconds until a token is available if none were),
+            or None if Redis is unavailable
+        """
+        if not self.available:
+            return None
+
+        try:
+            start = time.perf_counter()
+            granted, retry_ms = self._eval(_TOKEN_BUCKET_SCRIPT, [key], [rate, burst, batch])
+            _REDIS_TOKEN_BUCKET.observe(time.perf_counter() - start)
+            return int(granted), int(retry_ms) / 1000
+        except Exception as e:
+            logger.error(f"Error taking tokens from {key}: {e}")
+            return None
+
+    def _eval(self, script: str, keys: list, args: list):
+        if self.is_upstash_rest:
+            return self.client.eval(script, keys=keys, args=args)
+        # EVALSHA, loading the script on first use (or after a Redis restart)
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = self.client.register_script(script)
+        return registered(keys=keys, args=args)
+
     def clear_cache(self, cache_key: str = 'live_odds') -> bool:
-        """Clear the cache for a specific key"""
+        """
+        Clear an odds board: its manifest, the sport shards it lists, and the
+        single key boards were stored under before they were sharded.
+        """
         if not self.available:
             return False
         
         try:
-            self.client.delete(cache_key)
-            print(f"[redis_cache] Cache cleared for key: {cache_key}")
+            keys = [odds_manifest_key(cache_key), cache_key]
+            stored = self._get_raw(odds_manifest_key(cache_key))
+            if stored is not None:
+                keys += [odds_shard_key(cache_key, sport) for sport in cache_codec.decode(stored)['sports']]
+            self.client.delete(*keys)
+            self._board_sports.pop(cache_key, None)
+            logger.info(f"Cache cleared for board: {cache_key} ({len(keys)} keys)")
             return True
         except Exception as e:
-            print(f"[redis_cache] Error clearing cache: {e}")
+            logger.error(f"Error clearing cache: {e}")
             return False
 
 # Global cache instance
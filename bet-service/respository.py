@@ -1,4 +1,5 @@
-from config import db_handle
+from config import get_db_handle
+from shared_utils import metrics, log
 from schemas import (
     simplify_odds_event, 
     odds_event_to_dict, 
@@ -10,8 +11,11 @@ from schemas import (
     SimplifiedOdds
 )
 
+logger = log.get_logger('respository')
+
 class BetRepository:
     def __init__(self):
+        db_handle = get_db_handle()
         if db_handle is None:
             raise RuntimeError("MongoDB connection not available. Check MONGO_CONNECTION_STRING environment variable.")
         self.sports_collection = db_handle["sports"]
@@ -19,13 +23,15 @@ class BetRepository:
         # Store simplified odds for faster retrieval
         self.simplified_odds_collection = db_handle["simplified_odds"]
 
+    @metrics.timed(metrics.DEPENDENCY_DURATION, 'mongo', 'update_sports')
     def update_sports(self, sports):
         """Update available sports list"""
-        print("updating available sports")
+        logger.info("updating available sports")
         self.sports_collection.drop()
         res = self.sports_collection.insert_many(sports)
         return res
 
+    @metrics.timed(metrics.DEPENDENCY_DURATION, 'mongo', 'get_live_odds')
     def get_live_odds(self, simplified: bool = True) -> list:
         """
         Get live odds from database.
@@ -36,7 +42,7 @@ class BetRepository:
         Returns:
             List of odds dictionaries (ready for JSON serialization)
         """
-        print("getting live odds")
+        logger.info("getting live odds", extra=log.SAMPLED)
         if simplified:
             results = list(self.simplified_odds_collection.find({}))
             # Use schema utility to prepare for JSON (handles ObjectId, etc.)
@@ -45,6 +51,7 @@ class BetRepository:
             results = list(self.odds_collection.find({}))
             return [prepare_for_json(doc) for doc in results]
     
+    @metrics.timed(metrics.DEPENDENCY_DURATION, 'mongo', 'get_live_odds_as_objects')
     def get_live_odds_as_objects(self):
         """
         Get live odds as SimplifiedOdds objects (for type safety and validation).
@@ -60,10 +67,11 @@ class BetRepository:
                 odds_obj = dict_to_simplified_odds(doc)
                 odds_objects.append(odds_obj)
             except Exception as e:
-                print(f"Error converting to SimplifiedOdds: {e}")
+                logger.error(f"Error converting to SimplifiedOdds: {e}")
                 continue
         return odds_objects
     
+    @metrics.timed(metrics.DEPENDENCY_DURATION, 'mongo', 'update_live_odds')
     def update_live_odds(self, odds_data: list):
         """
         Update live odds in database.
@@ -76,7 +84,7 @@ class BetRepository:
         Returns:
             Number of simplified odds stored
         """
-        print("updating live odds")
+        logger.info("updating live odds")
         
         # Validate and store full format
         self.odds_collection.drop()
@@ -85,7 +93,7 @@ class BetRepository:
             if validate_odds_event(event):
                 full_odds.append(odds_event_to_dict(event))
             else:
-                print(f"Skipping invalid odds event: {event.get('id', 'unknown')}")
+                logger.warning(f"Skipping invalid odds event: {event.get('id', 'unknown')}")
         
         if full_odds:
             self.odds_collection.insert_many(full_odds)
@@ -103,9 +111,9 @@ class BetRepository:
                 if validate_simplified_odds(simplified_dict):
                     simplified_odds.append(simplified_dict)
                 else:
-                    print(f"Skipping invalid simplified odds: {simplified.event_id}")
+                    logger.warning(f"Skipping invalid simplified odds: {simplified.event_id}")
             except (KeyError, IndexError) as e:
-                print(f"Error simplifying odds event {event.get('id', 'unknown')}: {e}")
+                logger.error(f"Error simplifying odds event {event.get('id', 'unknown')}: {e}")
                 continue
         
         if simplified_odds:
@@ -1,13 +1,53 @@
-from flask import Blueprint, jsonify, current_app, request
+from flask import Blueprint, jsonify, current_app, request, Response
+import uuid
 import requests
-from external_api_client import fetch_odds_data, fetch_events_data
+from external_api_client import fetch_odds_data, odds_api_breaker
 import shared_utils
-from shared_utils import constants
+from shared_utils import constants, log, profiling
 from respository import BetRepository
 from schemas import SimplifiedOdds, validate_simplified_odds, prepare_for_json, simplify_odds_event, simplified_odds_to_dict
 from redis_cache import redis_cache
+from odds_index import odds_index
+from odds_stream import odds_stream
+from odds_refresher import odds_refresher
+from odds_api_cache import odds_api_cache
+from bet_store import bet_store
+from bet_service import place_slip, BetRejected, SlipConflict
+from user_service_client import UserServiceError
+from settlement import run_settlement, settle_manual_results, EventsNotCompleted
+from circuit_breaker import CircuitOpenError
+import rate_limiter
+
+logger = log.get_logger('api_routes')
 
 api_bp = Blueprint('api_bp', __name__, url_prefix='/bets')
+rate_limiter.init_app(api_bp)
+
+def _stale_response(data, cached_at=None):
+    """
+    A last-known-good response served while the Odds API is unavailable,
+    flagged with X-Stale (and X-Cached-At when known).
+    """
+    response = jsonify(data)
+    response.headers['X-Stale'] = 'true'
+    if cached_at:
+        response.headers['X-Cached-At'] = cached_at
+    return response, 200
+
+def _filter_sports(events, sports=None):
+    """Events of the given sport_keys (all events if sports is None)."""
+    if sports is None:
+        return events
+    return [event for event in events if event.get('sport_key') in sports]
+
+def _entry_response(entry, wrap=False):
+    """Response for an odds_api_cache entry (data optionally wrapped in a list)."""
+    if 'error' in entry:
+        return jsonify(entry['error']), entry['status']
+    data = [entry['data']] if wrap else entry['data']
+    if entry.get('stale'):
+        return _stale_response(data, entry['cached_at'])
+    return jsonify(data), 200
 
 @api_bp.route('/status', methods=['GET'])
 def api_status():
@@ -20,10 +60,116 @@ def api_status():
 
 @api_bp.route('/', methods=['GET'])
 def list_bets():
-    """Placeholder endpoint for managing bet resources."""
-    return jsonify([
-        {"id": 1, "props": ["fight_1", "over_2.5"], "amount": 100, "odds": 1.5},
-    ]), 200
+    """
+    List a user's bets, most recent first.
+    Query params:
+      - user_id (required)
+      - status (optional: pending, won, lost, ...)
+      - limit (default: 50, max: 200)
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id query param is required"}), 400
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        bets = bet_store.get_bets_by_user(user_id, limit=limit, status=request.args.get('status'))
+        return jsonify(bets), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in list_bets: {e}")
+        return jsonify({"error": "Failed to get bets"}), 500
+
+@api_bp.route('/place', methods=['POST'])
+def place_bets():
+    """
+    Place a slip of one or more bets at the current cached odds.
+    Body:
+      - user_id (required)
+      - bets: list of {event_id, selection, price, stake}. selection is
+        "home", "away", the team name or the team id; price is the decimal
+        price the user accepted. A single bet may be given at the top level.
+      - slip_id (optional): retrying with the same slip_id never charges twice;
+        a retry must repeat the original stakes (409 otherwise)
+    Returns 409 with the rejected bets if any price is unavailable, stale or
+    has changed (current_price is included so the client can re-confirm).
+    """
+    data = request.get_json(silent=True) or {}
+    slip_id = str(data.get('slip_id') or uuid.uuid4())
+    try:
+        legs = data['bets'] if 'bets' in data else [data]
+        result = place_slip(data.get('user_id'), legs, slip_id)
+        return jsonify(result), 200 if result['replayed'] else 201
+    except BetRejected as e:
+        return jsonify({"error": str(e), "slip_id": slip_id, "rejected": e.errors}), 409
+    except SlipConflict as e:
+        return jsonify({"error": str(e), "slip_id": slip_id}), 409
+    except UserServiceError as e:
+        return jsonify({"error": str(e), "slip_id": slip_id}), e.status_code
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in place_bets: {e}")
+        return jsonify({"error": f"Failed to place bets: {str(e)}", "slip_id": slip_id}), 500
+
+@api_bp.route('/settle', methods=['POST'])
+def settle():
+    """
+    Settle pending bets now. Requires the X-Admin-Token header (403 otherwise).
+    Body (optional): {"results": {"<event_id>": "home"|"away"|"draw", ...}}
+    settles the given events with these results; every event must be
+    reported as completed by the scores feed (409 otherwise). Without
+    results, finished events are looked up with the Odds API scores endpoint.
+    """
+    if not profiling.is_admin(request.headers):
+        return jsonify({"error": "Admin token required to settle bets"}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        results = data.get('results')
+        if results is not None:
+            if not isinstance(results, dict):
+                return jsonify({"error": "results must map event_id to home, away or draw"}), 400
+            return jsonify(settle_manual_results(results)), 200
+        return jsonify(run_settlement()), 200
+    except EventsNotCompleted as e:
+        return jsonify({"error": str(e), "event_ids": e.event_ids}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in settle: {e}")
+        return jsonify({"error": f"Failed to settle bets: {str(e)}"}), 500
+
+@api_bp.route('/refresher', methods=['GET'])
+def refresher_health():
+    """
+    Health of the background odds refresher: leader, lag since the last
+    successful refresh and its last error. Returns 503 when lagging.
+    """
+    health = odds_refresher.health()
+    return jsonify(health), 200 if health['healthy'] else 503
+
+@api_bp.route('/upstream', methods=['GET'])
+def upstream_health():
+    """
+    State of this worker's Odds API circuit breaker (closed, open or
+    half_open), its recent failures and calls in flight.
+    """
+    return jsonify(odds_api_breaker.snapshot()), 200
+
+@api_bp.route('/stream', methods=['GET'])
+def stream_odds():
+    """
+    Server-sent events stream of the default odds board.
+    Sends a "snapshot" event (list of games, as /getdefaultodds) on connect,
+    then a "diff" event per refresh: {"version", "base", "changed": [games],
+    "removed": [ids]}. Event ids are board versions, so a reconnecting
+    EventSource that is up to date skips the snapshot.
+    """
+    return Response(
+        odds_stream.stream(request.headers.get('Last-Event-ID')),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @api_bp.route('/getodds', methods=['GET'])
 def get_odds():
@@ -46,12 +192,12 @@ def get_odds():
         return jsonify({"error": "Invalid markets provided"}), 400
 
     try:
-        data = fetch_odds_data(sport, regions, markets)
-        if hasattr(data, "status_code"):
-            return data
-        return jsonify(data), 200
+        return _entry_response(odds_api_cache.get_odds(sport, regions, markets))
+    except (CircuitOpenError, requests.RequestException) as e:
+        logger.warning(f"Odds API unavailable in get_odds: {e}")
+        return jsonify({"error": "Odds provider unavailable"}), 503
     except Exception as e:
-        print(f"Error in get_odds: {e}")
+        logger.error(f"Error in get_odds: {e}")
         return jsonify({"error": "Failed to get odds data"}), 500
 
 @api_bp.route('/getliveodds', methods=['GET'])
@@ -67,7 +213,7 @@ def get_live_odds():
             repo = BetRepository()
             db_available = True
         except RuntimeError as e:
-            print(f"MongoDB not available: {e}")
+            logger.warning(f"MongoDB not available: {e}")
             db_available = False
             repo = None
         
@@ -76,13 +222,13 @@ def get_live_odds():
             try:
                 res = repo.get_live_odds(simplified=True)
                 if res:
-                    print('returning cached odds')
+                    logger.info('returning cached odds', extra=log.SAMPLED)
                     return jsonify(prepare_for_json(res)), 200
             except Exception as e:
-                print(f"Error getting cached odds: {e}")
+                logger.error(f"Error getting cached odds: {e}")
         
         # If no cached odds or DB unavailable, fetch new ones from API
-        print('fetching new live odds from external API')
+        logger.info('fetching new live odds from external API')
         data = fetch_odds_data(sport='upcoming')
         
         if not data:
@@ -92,13 +238,13 @@ def get_live_odds():
         if db_available and repo:
             try:
                 stored_count = repo.update_live_odds(data)
-                print(f"Stored {stored_count} simplified odds")
+                logger.info(f"Stored {stored_count} simplified odds")
                 # Return from database after storing
                 res = repo.get_live_odds(simplified=True)
                 if res:
                     return jsonify(prepare_for_json(res)), 200
             except Exception as e:
-                print(f"Error storing odds: {e}")
+                logger.error(f"Error storing odds: {e}")
         
         # If database not available or storage failed, return data directly from API
         # Transform using schemas for consistency
@@ -109,15 +255,13 @@ def get_live_odds():
                 simplified_dict = simplified_odds_to_dict(simplified)
                 simplified_data.append(prepare_for_json(simplified_dict))
             except Exception as e:
-                print(f"Error transforming odds event: {e}")
+                logger.error(f"Error transforming odds event: {e}")
                 continue
         
         return jsonify(simplified_data), 200
         
     except Exception as e:
-        print(f"Error in get_live_odds: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in get_live_odds: {e}")
         return jsonify({"error": f"Failed to get live odds data: {str(e)}"}), 500
 
 @api_bp.route('/getevents', methods=['GET'])
@@ -128,25 +272,24 @@ def get_events():
       - sport (required)
     """
     sport = request.args.get('sport')
-    print('getting events for sport: ', sport)
+    logger.info('getting events for sport', extra={**log.SAMPLED, 'sport': sport})
     if not sport:
         return jsonify({"error": "Missing required query parameter: sport"}), 400
     try:
-        data = fetch_events_data(sport)
-        if hasattr(data, "status_code"):
-            return data
-        return jsonify(data), 200
+        return _entry_response(odds_api_cache.get_events(sport))
+    except (CircuitOpenError, requests.RequestException) as e:
+        logger.warning(f"Odds API unavailable in get_events: {e}")
+        return jsonify({"error": "Odds provider unavailable"}), 503
     except Exception as e:
-        print(f"Error in get_events: {e}")
+        logger.error(f"Error in get_events: {e}")
         return jsonify({"error": "Failed to get events data"}), 500
 
 @api_bp.route('/getdefaultevents', methods=['GET'])
 def get_default_events():
     """Gets default events for mma"""
-    print('getting default events')
+    logger.info('getting default events', extra=log.SAMPLED)
     try:
-        data = fetch_events_data("mma_mixed_martial_arts")
-        return jsonify([data]), 200
+        return _entry_response(odds_api_cache.get_events("mma_mixed_martial_arts"), wrap=True)
     except:
         return jsonify({"error": "Failed to get default events"}), 500
 
@@ -162,34 +305,59 @@ def get_default_odds():
     4. Cache in Redis and return
     
     MongoDB storage removed for better performance.
+
+    Query params:
+      - sport (optional): comma-separated sport_keys to return. Only their
+        shards of the cached board are read.
     """
     try:
+        sports = [s.strip() for s in request.args.get('sport', '').split(',') if s.strip()] or None
+
         # Check Redis cache first
-        cached_result = redis_cache.get_cached_odds()
+        cached_result = redis_cache.get_cached_odds(sports=sports)
         if cached_result:
-            print('[getdefaultodds] Cache hit - returning from Redis')
+            logger.info('Cache hit - returning from Redis', extra=log.SAMPLED)
             return jsonify(cached_result['data']), 200
         
-        print('[getdefaultodds] Cache miss - fetching fresh data')
+        if odds_refresher.active:
+            # Read-only: the refresher leader owns upstream polling, so serve
+            # the last published board until its next refresh lands
+            board = odds_stream.last_board()
+            if board is None:
+                return jsonify({"error": "Odds not available yet"}), 503
+            return _stale_response(_filter_sports(board, sports))
+        
+        logger.info('Cache miss - fetching fresh data')
         
         # Fetch fresh data from external API
-        data = fetch_odds_data(sport='upcoming')
-        if not data:
-            return jsonify({"error": "No odds data available"}), 500
+        try:
+            data = fetch_odds_data(sport='upcoming')
+        except (CircuitOpenError, requests.RequestException) as e:
+            logger.warning(f"Odds API unavailable in get_default_odds: {e}")
+            data = None
+        if not isinstance(data, list):
+            # Upstream down or erroring: the last published board (kept
+            # without expiry) is the last known good snapshot
+            board = odds_stream.last_board()
+            if board is not None:
+                return _stale_response(_filter_sports(board, sports))
+            if isinstance(data, tuple):
+                return data
+            return jsonify({"error": "Odds provider unavailable"}), 503
         
         # Transform data once (optimized single-pass transformation)
         transformed_data = transform_odds_for_frontend_optimized(data)
         
         # Cache in Redis
         redis_cache.set_cached_odds(transformed_data)
-        print(f'[getdefaultodds] Cached {len(transformed_data)} events')
+        odds_index.update(transformed_data)
+        odds_stream.publish_board(transformed_data)
+        logger.info(f'Cached {len(transformed_data)} events')
         
-        return jsonify(transformed_data), 200
+        return jsonify(_filter_sports(transformed_data, sports)), 200
         
     except Exception as e:
-        print(f"Error in get_default_odds: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in get_default_odds: {e}")
         return jsonify({"error": f"Failed to get odds data: {str(e)}"}), 500
 
 def transform_odds_for_frontend_optimized(raw_events):
@@ -248,6 +416,7 @@ def transform_odds_for_frontend_optimized(raw_events):
             # Build frontend game object
             transformed_game = {
                 'id': event_id,
+                'sport_key': sport_key,
                 'sport_name': sport_key.replace('_', ' ').title(),
                 'sport_title': sport_title,
                 'home_team': home_team,
@@ -264,7 +433,7 @@ def transform_odds_for_frontend_optimized(raw_events):
             transformed.append(transformed_game)
             
         except Exception as e:
-            print(f"Error transforming event: {e}")
+            logger.error(f"Error transforming event: {e}")
             continue
     
     return transformed
\ No newline at end of file
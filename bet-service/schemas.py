@@ -7,6 +7,8 @@ from typing import List, Optional, Dict, Any
 from dataclasses import dataclass, asdict
 from datetime import datetime
 
+from shared_utils import profiling
+
 
 # ============================================================================
 # CORE DATA MODELS
@@ -64,6 +66,26 @@ class SimplifiedOdds:
     last_update: str
 
 
+@dataclass
+class Bet:
+    """A single bet (one leg of a slip) placed at a quoted price"""
+    bet_id: str
+    slip_id: str
+    user_id: str
+    event_id: str
+    sport_key: str
+    selection: str  # team name
+    side: str  # 'home' or 'away'
+    price: float  # decimal odds
+    stake: float
+    potential_payout: float  # stake * price
+    commence_time: str
+    placed_at: str
+    status: str = 'pending'  # 'pending_debit' (stake not debited yet), 'pending', 'won', 'lost'
+    payout: Optional[float] = None
+    settled_at: Optional[str] = None
+
+
 # ============================================================================
 # TRANSFORMATION FUNCTIONS
 # ============================================================================
@@ -148,6 +170,16 @@ def dict_to_simplified_odds(data: Dict[str, Any]) -> SimplifiedOdds:
     return SimplifiedOdds(**data)
 
 
+def bet_to_dict(bet: Bet) -> Dict[str, Any]:
+    """Convert Bet to dictionary for storage/JSON"""
+    return asdict(bet)
+
+
+def dict_to_bet(data: Dict[str, Any]) -> Bet:
+    """Convert dictionary to Bet object (ignores storage-only fields such as _id)"""
+    return Bet(**{k: v for k, v in data.items() if k in Bet.__dataclass_fields__})
+
+
 # ============================================================================
 # VALIDATION FUNCTIONS
 # ============================================================================
@@ -211,16 +243,21 @@ def prepare_for_json(data: Any) -> Any:
     Returns:
         JSON-serializable data structure
     """
+    with profiling.span('serialization'):
+        return _prepare_value(data)
+
+
+def _prepare_value(data: Any) -> Any:
     if isinstance(data, dict):
         result = {}
         for key, value in data.items():
             if key == '_id':
                 result[key] = str(value)
             else:
-                result[key] = prepare_for_json(value)
+                result[key] = _prepare_value(value)
         return result
     elif isinstance(data, list):
-        return [prepare_for_json(item) for item in data]
+        return [_prepare_value(item) for item in data]
     elif isinstance(data, datetime):
         return data.isoformat()
     else:
@@ -0,0 +1,335 @@
+"""
+Bet settlement.
+
+For every sport that has pending bets on started events, the Odds API scores
+endpoint is asked which events have finished. For each finished event:
+- the pending bets are read through the (event_id, status) index
+- payouts are computed in bulk
+- the payouts are pushed to the user-service in batches over the pooled client
+
+Bets are marked settled in the bet store only after the user-service
+confirms them.
+
+One worker per store settles periodically (see SettlementWorker): one per
+cluster with MongoDB, one per host with the SQLite file each instance keeps.
+
+Reruns are safe. The wallet ignores (bet_id, outcome) pairs it has already
+applied, and the bet store only updates bets that are still pending. A run
+interrupted between the two steps resends the batch next time.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+
+import requests
+from flask import Flask
+
+from bet_store import bet_store
+from redis_cache import redis_cache
+from circuit_breaker import CircuitOpenError
+from external_api_client import fetch_scores_data
+from user_service_client import user_service, UserServiceError
+from bet_service import resolve_unconfirmed_bets
+from shared_utils import log
+
+logger = log.get_logger('settlement')
+
+# Settlement configuration
+SETTLEMENT_BATCH_SIZE = int(os.getenv('SETTLEMENT_BATCH_SIZE', 500))
+SETTLEMENT_CONCURRENCY = int(os.getenv('SETTLEMENT_CONCURRENCY', 1))
+SETTLEMENT_INTERVAL_SECONDS = float(os.getenv('SETTLEMENT_INTERVAL_SECONDS', 300))
+SETTLEMENT_SCORES_DAYS = int(os.getenv('SETTLEMENT_SCORES_DAYS', 3))
+SETTLEMENT_LEASE_SECONDS = float(os.getenv('SETTLEMENT_LEASE_SECONDS', 60))
+SETTLEMENT_TICK_SECONDS = max(1.0, min(SETTLEMENT_INTERVAL_SECONDS, SETTLEMENT_LEASE_SECONDS / 3))
+SETTLEMENT_LEASE_KEY = 'settlement_lease'
+SETTLEMENT_STATUS_KEY = 'settlement_status'
+
+EVENT_RESULTS = ('home', 'away', 'draw')
+
+
+class EventsNotCompleted(Exception):
+    """Results given for events the scores feed does not report as completed."""
+
+    def __init__(self, event_ids: List[str]):
+        super().__init__(f"Events not completed according to the scores feed: {', '.join(event_ids)}")
+        self.event_ids = event_ids
+
+
+def event_result(score_event: Dict[str, Any]) -> Optional[str]:
+    """
+    Result of an event from the scores endpoint.
+
+    Returns:
+        'home', 'away' or 'draw', or None if the event is not final
+    """
+    if not score_event.get('completed'):
+        return None
+    scores = {s.get('name'): s.get('score') for s in score_event.get('scores') or []}
+    try:
+        home = float(scores[score_event['home_team']])
+        away = float(scores[score_event['away_team']])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if home > away:
+        return 'home'
+    if away > home:
+        return 'away'
+    return 'draw'
+
+
+def bet_settlement(bet: Dict[str, Any], result: str, settled_at: str) -> Dict[str, Any]:
+    """
+    Settlement of a pending bet given its event's result.
+    Only home/away selections are offered, so a draw loses both of them.
+    """
+    won = bet['side'] == result
+    return {
+        'bet_id': bet['bet_id'],
+        'user_id': bet['user_id'],
+        'stake': bet['stake'],
+        'status': 'won' if won else 'lost',
+        'payout': bet['potential_payout'] if won else 0.0,
+        'settled_at': settled_at
+    }
+
+
+def _push_batch(batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Apply a batch to the wallets, then mark the confirmed bets settled. Returns (settled, failed)."""
+    try:
+        results = user_service.settle_bets([
+            {
+                'user_id': s['user_id'],
+                'bet_id': s['bet_id'],
+                'outcome': s['status'],
+                'amount': s['payout'] if s['status'] == 'won' else s['stake']
+            }
+            for s in batch
+        ])
+    except UserServiceError as e:
+        logger.error(f"Batch of {len(batch)} bets not applied: {e}")
+        return 0, len(batch)
+    confirmed = [s for s, r in zip(batch, results) if r.get('status') == 'settled']
+    for s, r in zip(batch, results):
+        if r.get('status') == 'conflict':
+            # The wallet holds the other outcome: left pending for review
+            logger.error(f"Bet {s['bet_id']} settled as {s['status']} here but not in the wallet: {r.get('error')}")
+        elif r.get('status') != 'settled':
+            logger.warning(f"Bet {s['bet_id']} not settled: {r.get('error')}")
+    bet_store.mark_settled(confirmed)
+    return len(confirmed), len(batch) - len(confirmed)
+
+
+def _validate_results(results: Dict[str, str]):
+    for event_id, result in results.items():
+        if result not in EVENT_RESULTS:
+            raise ValueError(f"Result of {event_id} must be one of {', '.join(EVENT_RESULTS)}")
+
+
+def settle_events(results: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Settle the pending bets of finished events.
+
+    Args:
+        results: event_id -> 'home', 'away' or 'draw'
+
+    Returns:
+        Summary dict with events, bets, settled, failed, won and lost counts
+    """
+    _validate_results(results)
+
+    settled_at = datetime.utcnow().isoformat()
+    settlements = [
+        bet_settlement(bet, result, settled_at)
+        for event_id, result in results.items()
+        for bet in bet_store.get_pending_bets(event_id)
+    ]
+    batches = [
+        settlements[i:i + SETTLEMENT_BATCH_SIZE]
+        for i in range(0, len(settlements), SETTLEMENT_BATCH_SIZE)
+    ]
+    settled = failed = 0
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(SETTLEMENT_CONCURRENCY, len(batches)))) as pool:
+            for batch_settled, batch_failed in pool.map(_push_batch, batches):
+                settled += batch_settled
+                failed += batch_failed
+    won = sum(1 for s in settlements if s['status'] == 'won')
+    return {
+        'events': len(results),
+        'bets': len(settlements),
+        'settled': settled,
+        'failed': failed,
+        'won': won,
+        'lost': len(settlements) - won
+    }
+
+
+def _started_pending_events() -> Dict[str, List[str]]:
+    now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    return bet_store.get_pending_events(now)
+
+
+def completed_events(pending: Dict[str, List[str]]) -> Dict[str, Optional[str]]:
+    """
+    The events among pending (sport_key -> event_ids) that the scores feed
+    reports as completed. Sports whose scores cannot be fetched are skipped.
+
+    Returns:
+        event_id -> result ('home', 'away' or 'draw', None if the scores are unusable)
+    """
+    completed: Dict[str, Optional[str]] = {}
+    for sport_key, event_ids in pending.items():
+        try:
+            scores = fetch_scores_data(sport_key, SETTLEMENT_SCORES_DAYS)
+        except (CircuitOpenError, requests.RequestException) as e:
+            logger.warning(f"Could not fetch scores for {sport_key}: {e}")
+            continue
+        if not isinstance(scores, list):
+            logger.warning(f"Could not fetch scores for {sport_key}")
+            continue
+        wanted = set(event_ids)
+        for score_event in scores:
+            if score_event.get('id') in wanted and score_event.get('completed'):
+                completed[score_event['id']] = event_result(score_event)
+    return completed
+
+
+def run_settlement() -> Dict[str, Any]:
+    """
+    Settle every finished event that has pending bets.
+    Must run inside the Flask application context (for the Odds API key).
+
+    Returns:
+        Summary dict (see settle_events) plus the number of sports checked
+    """
+    start = time.perf_counter()
+    pending = _started_pending_events()
+    results = {event_id: result for event_id, result in completed_events(pending).items() if result}
+    summary = settle_events(results)
+    summary['sports'] = len(pending)
+    if summary['bets']:
+        logger.info(f"Settled {summary['settled']}/{summary['bets']} bets on "
+                    f"{summary['events']} events in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return summary
+
+
+def settle_manual_results(results: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Settle events with results given by an admin (e.g. to correct a score).
+    Every event must have started, have pending bets and be reported as
+    completed by the scores feed.
+    Must run inside the Flask application context (for the Odds API key).
+
+    Returns:
+        Summary dict (see settle_events)
+
+    Raises:
+        ValueError: If a result is not home, away or draw
+        EventsNotCompleted: If any event is not confirmed as completed
+    """
+    _validate_results(results)
+    pending = {
+        sport_key: [event_id for event_id in event_ids if event_id in results]
+        for sport_key, event_ids in _started_pending_events().items()
+    }
+    completed = completed_events({sport_key: ids for sport_key, ids in pending.items() if ids})
+    unconfirmed = sorted(event_id for event_id in results if event_id not in completed)
+    if unconfirmed:
+        raise EventsNotCompleted(unconfirmed)
+    logger.info(f"Settling {len(results)} events with manual results", extra={'results': results})
+    return settle_events(results)
+
+
+class SettlementWorker:
+    """
+    Periodic settlement, run by one leader per bet store.
+
+    Like the odds refresher, every worker runs the loop, but only the holder
+    of a Redis lease settles. A shared store (MongoDB) has one lease for the
+    cluster. A SQLite store is only seen by the workers of its host, so each
+    host elects its own settler for its own file; a cluster-wide leader would
+    never settle the bets of the other instances. A run starts when the last
+    run on the same store started SETTLEMENT_INTERVAL_SECONDS ago or more, so
+    a new leader does not repeat its predecessor's run. Without Redis there
+    is no election, and each worker settles on its own (reruns are safe,
+    only wasteful). Each run first resolves the bets an interrupted placement
+    left pending_debit (see bet_service.resolve_unconfirmed_bets).
+    """
+
+    def __init__(self, cache=redis_cache, store=bet_store):
+        self._cache = cache
+        self._store = store
+        self.lease_key = SETTLEMENT_LEASE_KEY
+        self.status_key = SETTLEMENT_STATUS_KEY
+        self.worker_id = None
+        self.is_leader = False
+        self._last_started_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, app: Flask):
+        """Start the loop in this worker (call after the gunicorn fork)."""
+        if SETTLEMENT_INTERVAL_SECONDS <= 0:
+            logger.info("Periodic settlement disabled")
+            return
+        if self._thread is not None:
+            return
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if not self._store.shared:
+            scope = socket.gethostname()
+            self.lease_key = f"{SETTLEMENT_LEASE_KEY}:{scope}"
+            self.status_key = f"{SETTLEMENT_STATUS_KEY}:{scope}"
+        self._thread = threading.Thread(target=self._loop, args=(app,), name='settlement', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"Settling finished events every {SETTLEMENT_INTERVAL_SECONDS:.0f}s")
+
+    def stop(self):
+        """Stop the loop and hand the lease over immediately if this worker holds it."""
+        self._stop.set()
+        if self.is_leader:
+            self._cache.release_lease(self.lease_key, self.worker_id)
+            self.is_leader = False
+
+    def _loop(self, app: Flask):
+        while not self._stop.wait(SETTLEMENT_TICK_SECONDS):
+            try:
+                if self._cache.available:
+                    leader = self._cache.acquire_lease(self.lease_key, self.worker_id,
+                                                       SETTLEMENT_LEASE_SECONDS)
+                    if leader != self.is_leader:
+                        logger.info(f"{self.worker_id} {'became' if leader else 'is no longer'} the settler")
+                        self.is_leader = leader
+                    if not leader:
+                        continue
+                if self._run_due():
+                    self._record_start()
+                    with app.app_context():
+                        # Confirmed bets on finished events settle in the same run
+                        resolve_unconfirmed_bets()
+                        run_settlement()
+            except Exception as e:
+                logger.exception(f"Error in settlement run: {e}")
+
+    def _run_due(self) -> bool:
+        last_started = self._last_started_at
+        if self._cache.available:
+            status = self._cache.get_json(self.status_key) or {}
+            last_started = status.get('last_started_at') or 0
+        return time.time() - last_started >= SETTLEMENT_INTERVAL_SECONDS
+
+    def _record_start(self):
+        self._last_started_at = time.time()
+        self._cache.set_json(self.status_key,
+                             {'worker': self.worker_id, 'last_started_at': self._last_started_at})
+
+
+# Global settlement loop (one per worker, one settling leader per bet store)
+settlement_worker = SettlementWorker()
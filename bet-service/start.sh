@@ -12,17 +12,8 @@ echo "Python version: $(python3 --version 2>&1 || python --version 2>&1)"
 echo "Gunicorn: $(which gunicorn || echo 'NOT FOUND')"
 echo ""
 
-# Test if we can import the app before starting Gunicorn
-echo "Testing app import..."
-if python3 -c "import app; print('[start] ✓ App imported successfully')" 2>&1; then
-    echo "[start] App import test PASSED"
-else
-    echo "[start] ✗ App import test FAILED"
-    echo "[start] Full error output:"
-    python3 -c "import app" 2>&1 || true
-    echo "[start] Exiting due to import failure"
-    exit 1
-fi
+# No separate import check: gunicorn preloads the app (gunicorn.conf.py), so
+# an import error is reported by the master, which then exits
 
 echo ""
 echo "=========================================="
@@ -30,10 +21,9 @@ echo "Starting Gunicorn on 0.0.0.0:${PORT}"
 echo "=========================================="
 
 # Start Gunicorn - use exec to replace shell process
+# (worker class, count and timeout are set in gunicorn.conf.py)
 exec gunicorn \
     --bind "0.0.0.0:${PORT}" \
-    --workers 2 \
-    --timeout 120 \
     --access-logfile - \
     --error-logfile - \
     --log-level info \
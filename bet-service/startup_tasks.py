@@ -3,29 +3,43 @@ import time
 from flask import Flask
 
 from respository import BetRepository
-from external_api_client import fetch_sports_data, fetch_odds_data
+from external_api_client import fetch_sports_data
+from settlement import settlement_worker
+from odds_refresher import odds_refresher
+from cache_warmer import cache_warmer
+from shared_utils import log
+
+logger = log.get_logger('startup')
+
+_started = False
 
 
 def run_on_startup(app: Flask):
     """
     Run startup tasks in a background thread using the Flask application context.
+    Runs once per process; call it after the fork when the app is preloaded.
     """
+    global _started
+    if _started:
+        return
+    _started = True
+
     def _startup_tasks():
         try:
             with app.app_context():
-                print("[startup] Starting background initialization tasks...")
+                logger.info("Starting background initialization tasks...")
                 time.sleep(2)  # Give app time to fully start
 
                 # Check if MongoDB is available before trying to use repository
                 from config import db_handle
                 if db_handle is None:
-                    print("[startup] MongoDB not available, skipping database initialization")
+                    logger.info("MongoDB not available, skipping database initialization")
                     return
 
                 try:
                     repo = BetRepository()
                 except RuntimeError as e:
-                    print(f"[startup] Cannot initialize repository: {e}")
+                    logger.warning(f"Cannot initialize repository: {e}")
                     return
 
                 # Fetch and update sports data
@@ -33,30 +47,28 @@ def run_on_startup(app: Flask):
                     sports_data = fetch_sports_data()
                     if sports_data:
                         updated_sports = repo.update_sports(sports_data)
-                        print(f"[startup] Updated sports: {len(updated_sports.inserted_ids) if updated_sports else 0} sports")
+                        logger.info(f"Updated sports: {len(updated_sports.inserted_ids) if updated_sports else 0} sports")
                 except Exception as e:
-                    print(f"[startup] Warning: Could not update sports data: {e}")
+                    logger.warning(f"Could not update sports data: {e}")
 
-                # Check if odds data is empty and fetch if needed
-                try:
-                    live_odds = repo.get_live_odds()
-                    if not live_odds:
-                        print("[startup] No live odds found, fetching default odds")
-                        default_odds = fetch_odds_data(sport='upcoming')
-                        if default_odds:
-                            stored_count = repo.update_live_odds(default_odds)
-                            print(f"[startup] Stored {stored_count} odds events")
-                except Exception as e:
-                    print(f"[startup] Warning: Could not initialize odds data: {e}")
+                # Odds are warmed by the cache warmer (most requested sports
+                # first), and kept in MongoDB by the refresher or on demand
 
-                print("[startup] Background initialization tasks completed")
+                logger.info("Background initialization tasks completed")
         except Exception as e:
-            print(f"[startup] Error in startup tasks: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Error in startup tasks: {e}", exc_info=True)
             # Don't raise - allow app to continue running
 
     # Run in background thread so it doesn't block app startup
     thread = threading.Thread(target=_startup_tasks, daemon=True)
     thread.start()
-    print("[startup] Startup tasks initiated in background")
\ No newline at end of file
+    logger.info("Startup tasks initiated in background")
+
+    # Keep odds fresh from a single elected worker cluster-wide
+    odds_refresher.start(app)
+
+    # Pre-fetch the most requested sports, now and after evictions
+    cache_warmer.start(app)
+
+    # Settle finished events periodically (independent of MongoDB)
+    settlement_worker.start(app)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+Startup timing report.
+
+Phases of the app import are marked as they finish, and logged together
+once the import is done. Each worker then logs:
+- when it is ready (the app loaded and startup tasks started)
+- when it served its first request
+
+Times are measured from the start of the process, read from /proc. Under a
+preloaded gunicorn that is the master's start, so a worker's times are the
+full cold start of the container.
+"""
+
+import os
+import time
+from typing import Optional, List, Tuple
+
+from shared_utils import log
+
+logger = log.get_logger('startup_timing')
+
+_marks: List[Tuple[str, float]] = []
+_worker_boot: Optional[float] = None
+_first_request_logged = False
+
+
+def _process_start() -> float:
+    """Wall-clock time this process started (falls back to now off Linux)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_START = _process_start()
+_last_mark = PROCESS_START
+
+
+def since_start_ms(start: Optional[float] = None) -> float:
+    return round((time.time() - (start or PROCESS_START)) * 1000, 1)
+
+
+def mark(phase: str):
+    """Record that a startup phase finished (duration since the previous mark)."""
+    global _last_mark
+    now = time.time()
+    _marks.append((phase, round((now - _last_mark) * 1000, 1)))
+    _last_mark = now
+
+
+def report_import():
+    """Log the import phases and the total time since the process started."""
+    logger.info(
+        f"App imported {since_start_ms()}ms after process start",
+        extra={'phases_ms': dict(_marks), 'since_process_start_ms': since_start_ms()}
+    )
+
+
+def worker_ready():
+    """Log that this gunicorn worker has loaded the app (called post-fork)."""
+    global _worker_boot
+    _worker_boot = _process_start()
+    logger.info(
+        f"Worker ready {since_start_ms(_worker_boot)}ms after fork, "
+        f"{since_start_ms()}ms after master start",
+        extra={'since_fork_ms': since_start_ms(_worker_boot), 'since_process_start_ms': since_start_ms()}
+    )
+
+
+def init_app(app):
+    """Log the first request each process serves."""
+
+    @app.after_request
+    def _log_first_request(response):
+        global _first_request_logged
+        if not _first_request_logged:
+            _first_request_logged = True
+            extra = {'since_process_start_ms': since_start_ms()}
+            if _worker_boot is not None:
+                extra['since_fork_ms'] = since_start_ms(_worker_boot)
+            logger.info(f"First request served {extra['since_process_start_ms']}ms after process start",
+                        extra=extra)
+        return response
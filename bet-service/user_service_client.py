@@ -0,0 +1,130 @@
+"""
+HTTP client for the user-service wallet API.
+
+One requests.Session per worker process keeps a pool of keep-alive
+connections, so a bet placement costs one request on an already open
+connection instead of a new TCP (and TLS) handshake per call.
+"""
+
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, List, Dict, Any, Set
+
+from shared_utils import metrics
+
+# User-service configuration
+USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://localhost:8081').rstrip('/')
+USER_SERVICE_POOL_SIZE = int(os.getenv('USER_SERVICE_POOL_SIZE', 20))
+USER_SERVICE_CONNECT_TIMEOUT = float(os.getenv('USER_SERVICE_CONNECT_TIMEOUT', 2.0))
+USER_SERVICE_READ_TIMEOUT = float(os.getenv('USER_SERVICE_READ_TIMEOUT', 5.0))
+
+
+class UserServiceError(Exception):
+    """Error response (or no response) from the user-service."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UserServiceClient:
+    """
+    Pooled client for the user-service.
+
+    Wallet calls are idempotent per bet_id, so failed connections and 502-504
+    responses are retried.
+    """
+
+    def __init__(self, base_url: str = USER_SERVICE_URL, pool_size: int = USER_SERVICE_POOL_SIZE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        retries = Retry(
+            total=2,
+            backoff_factor=0.05,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,  # retry POSTs too (idempotent by bet_id)
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (USER_SERVICE_CONNECT_TIMEOUT, USER_SERVICE_READ_TIMEOUT)
+
+    def _post(self, operation: str, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return self._request('POST', operation, path, json=payload)
+
+    def _get(self, operation: str, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return self._request('GET', operation, path, params=params)
+
+    def _request(self, method: str, operation: str, path: str, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            metrics.DEPENDENCY_DURATION.labels('user_service', operation, 'error').observe(
+                time.perf_counter() - start
+            )
+            raise UserServiceError(f"user-service unavailable: {e}")
+        metrics.DEPENDENCY_DURATION.labels('user_service', operation, str(resp.status_code)).observe(
+            time.perf_counter() - start
+        )
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        if resp.status_code >= 400:
+            # Client errors (e.g. insufficient balance) are passed through as-is
+            status = resp.status_code if resp.status_code < 500 else 502
+            error = body.get('error') if isinstance(body, dict) else None
+            raise UserServiceError(error or f"user-service returned {resp.status_code}", status)
+        return body
+
+    def place_bets(self, user_id: str, bets: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Debit the stakes of a slip in one atomic wallet update.
+
+        Args:
+            user_id: Firebase user ID
+            bets: List of dicts with bet_id and bet_amount
+
+        Returns:
+            The updated wallet dict
+        """
+        return self._post('place_bets', f"/api/wallet/{user_id}/bets", {"bets": bets})
+
+    def placed_bet_ids(self, user_id: str, bet_ids: List[str]) -> Set[str]:
+        """
+        Find which bets the wallet has already debited, without debiting.
+
+        Args:
+            user_id: Firebase user ID
+            bet_ids: Bets to look up (one request each)
+
+        Returns:
+            The bet_ids with a bet_placed transaction
+        """
+        return {
+            bet_id for bet_id in bet_ids
+            if self._get('placed_bet', f"/api/wallet/{user_id}/transactions",
+                         {'type': 'bet_placed', 'bet_id': bet_id, 'limit': 1})
+        }
+
+    def settle_bets(self, settlements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Credit or close many bets in one request.
+
+        Args:
+            settlements: List of dicts with user_id, bet_id, outcome ('won' or
+                'lost') and amount (payout for wins, stake for losses)
+
+        Returns:
+            One result dict per settlement, in order (status 'settled' or 'error')
+        """
+        return self._post('settle_bets', "/api/wallet/settle", {"bets": settlements})['results']
+
+
+# Global client instance (one connection pool per worker)
+user_service = UserServiceClient()
@@ -1,5 +1,5 @@
-VALID_MARKETS=['us', 'us2', 'us', 'us_dfs', 'us_ex', 'uk', 'eu', 'au']
-VALID_REGIONS=['h2h', 'spreads', 'totals', 'outrights', 'team_totals', 'alternate_team_totals']
+VALID_REGIONS=['us', 'us2', 'us_dfs', 'us_ex', 'uk', 'eu', 'au']
+VALID_MARKETS=['h2h', 'spreads', 'totals', 'outrights', 'team_totals', 'alternate_team_totals']
 
 #  will need to add some sort of abstraction. from the fe we won't want
 # the user to send these maybe they would just use us and that would use all
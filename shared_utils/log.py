@@ -0,0 +1,265 @@
+"""
+Structured logging shared by the services.
+
+Loggers from get_logger() write JSON lines to stdout, one object per record:
+timestamp, severity, service, pid, logger, message, plus request_id and any
+`extra` fields. (Cloud Logging reads severity and message from such lines.)
+
+Records are never written in the calling thread:
+- the caller only puts them on a bounded queue
+- one background thread per process formats and writes them, in batches
+- when the queue is full, records are dropped and counted rather than
+  blocking the request
+
+High-volume messages can be sampled. Log them with extra=SAMPLED (or
+extra={**SAMPLED, ...}). Only a fraction LOG_SAMPLE_RATE of them is kept,
+and each kept record carries sample_rate so counts can be scaled back up.
+
+init_app() gives every request an id. It is taken from an incoming
+X-Request-ID header or generated, added to every record logged while
+serving the request, and returned in the X-Request-ID response header.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from shared_utils import metrics
+
+# Logging configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()  # json or text
+
+# Pass as extra= to mark a high-volume record for sampling
+SAMPLED = {'sampled': True}
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    'log_records_dropped_total', 'Log records dropped (queue full or sampled out)', ['reason']
+)
+_DROPPED_FULL = LOG_RECORDS_DROPPED.labels('queue_full')
+_DROPPED_SAMPLED = LOG_RECORDS_DROPPED.labels('sampled')
+
+# Attributes of every LogRecord; anything else on a record came from extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_local = threading.local()
+_root = logging.getLogger('neuralbets')
+_service = os.getenv('LOG_SERVICE', 'app')
+
+
+def request_id() -> Optional[str]:
+    """Id of the request being served by this thread (greenlet under gevent), if any."""
+    return getattr(_local, 'request_id', None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record (tracebacks are rendered by QueueHandler)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'severity': record.levelname,
+            'service': _service,
+            'pid': os.getpid(),
+            'logger': record.name.rpartition('.')[2],
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != 'sampled':
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable lines for local development (LOG_FORMAT=text)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        rid = getattr(record, 'request_id', None)
+        line = (f"{datetime.fromtimestamp(record.created).strftime('%H:%M:%S.%f')[:-3]} "
+                f"{record.levelname:<7} [{record.name.rpartition('.')[2]}]"
+                f"{f' ({rid})' if rid else ''} {record.getMessage()}")
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class _Writer(threading.Thread):
+    """Drains the queue and writes formatted records to stdout in batches."""
+
+    def __init__(self, records: queue.SimpleQueue, formatter: logging.Formatter):
+        super().__init__(name='log-writer', daemon=True)
+        self.records = records
+        self.formatter = formatter
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            try:
+                while len(batch) < 512:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            for record in batch:
+                if record is None:
+                    self._write(lines)
+                    return
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception as e:
+                    lines.append(json.dumps({'severity': 'ERROR', 'message': f"Unformattable log record: {e}"}))
+            self._write(lines)
+
+    @staticmethod
+    def _write(lines):
+        if lines:
+            try:
+                sys.stdout.write('\n'.join(lines) + '\n')
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records to this process's writer thread.
+    The writer is started on first use in each process, so loggers
+    configured before the gunicorn fork keep working in the workers.
+    """
+
+    def __init__(self, formatter: logging.Formatter, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__()
+        self._formatter = formatter
+        self._maxsize = maxsize
+        self._records: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[_Writer] = None
+        self._start_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        with self._start_lock:
+            if self._records is not None:
+                return
+            records = queue.SimpleQueue()
+            self._writer = _Writer(records, self._formatter)
+            self._writer.start()
+            self._records = records
+
+    def _after_fork(self):
+        # Records queued before the fork are the parent's to write. Under a
+        # gevent-patched parent the writer is a greenlet that was copied into
+        # this process too: empty its queue so it stays parked on it. (Stopping
+        # it would run Thread cleanup for a thread this process never had.)
+        records = self._records
+        if records is not None:
+            try:
+                while True:
+                    records.get_nowait()
+            except queue.Empty:
+                pass
+        self._records = None
+        self._writer = None
+        self._start_lock = threading.Lock()
+
+    def handle(self, record: logging.LogRecord):
+        # emit() only appends to a thread-safe queue, so skip the handler lock
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        if getattr(record, 'sampled', False):
+            if random.random() >= LOG_SAMPLE_RATE:
+                _DROPPED_SAMPLED.inc()
+                return
+            record.sample_rate = LOG_SAMPLE_RATE
+        rid = getattr(_local, 'request_id', None)
+        if rid is not None:
+            record.request_id = rid
+        # Resolve the message and traceback now: args may change after we return
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self._records is None:
+            self._start()
+        if self._records.qsize() >= self._maxsize:
+            _DROPPED_FULL.inc()
+            return
+        self._records.put(record)
+
+    def close(self):
+        """Write out what is queued (called at exit)."""
+        if self._writer is not None:
+            self._records.put(None)
+            self._writer.join(timeout=2)
+        super().close()
+
+
+def _configure():
+    # Skip the multiprocessing lookup made for every record (processName is
+    # unused). Thread and process ids stay on: gunicorn's log format uses them.
+    logging.logMultiprocessing = False
+    formatter = TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter()
+    handler = QueueHandler(formatter)
+    _root.handlers[:] = [handler]
+    _root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _root.propagate = False
+    atexit.register(handler.close)
+
+
+_configure()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module, e.g. get_logger('redis_cache')."""
+    return _root.getChild(name)
+
+
+def configure(service: str):
+    """Set the service name written on every record."""
+    global _service
+    _service = service
+
+
+def init_app(app, service: str):
+    """
+    Tag every record logged during a request with its request id.
+
+    Args:
+        app: Flask application
+        service: Service name written on every record
+    """
+    from flask import request
+
+    configure(service)
+
+    @app.before_request
+    def _log_request_start():
+        rid = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        _local.request_id = rid[:64]
+
+    @app.after_request
+    def _log_request_id(response):
+        rid = getattr(_local, 'request_id', None)
+        if rid is not None:
+            response.headers['X-Request-ID'] = rid
+        return response
+
+    @app.teardown_request
+    def _log_request_end(exc):
+        _local.request_id = None
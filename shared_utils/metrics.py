@@ -0,0 +1,500 @@
+"""
+Low-overhead metrics shared by the services, exposed in Prometheus text format.
+
+How values are recorded:
+- Each process records into its own memory-mapped file in METRICS_DIR.
+- Recording is a few in-place float additions, with no locks and no I/O.
+- Each file has exactly one writer process. Under sync and gevent workers
+  the additions are never interleaved. Under threaded workers, two threads
+  updating the same series at the same instant can rarely lose an update.
+
+How /metrics is served:
+- It sums the files of every worker of the service.
+- Files left by exited workers are folded into an archive file, so counters
+  never go backwards.
+- Gauges only count live processes.
+
+Histograms use fixed log-linear buckets, two per power of two from 100us to
+about 74s. A bucket index is computed in O(1) from the value's logarithm.
+"""
+
+import os
+import json
+import math
+import mmap
+import time
+import glob
+import struct
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple, Callable
+
+# Metrics configuration
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/neuralbets_metrics')
+METRICS_FILE_BYTES = int(os.getenv('METRICS_FILE_BYTES', 1 << 20))
+
+# Histogram buckets: upper bounds BUCKET_MIN * 2 ** (i / BUCKETS_PER_OCTAVE)
+BUCKET_MIN = 0.0001
+BUCKETS_PER_OCTAVE = 2
+BUCKET_COUNT = 40
+BUCKET_BOUNDS = [BUCKET_MIN * 2 ** (i / BUCKETS_PER_OCTAVE) for i in range(BUCKET_COUNT)]
+
+# Called with (span name, seconds) on every observation of a histogram declared
+# with a span_label. Set by shared_utils.profiling to build request span breakdowns.
+span_recorder: Optional[Callable[[str, float], None]] = None
+
+_HEADER = struct.Struct('<Q')
+_ENTRY = struct.Struct('<II')
+
+
+def bucket_index(value: float) -> int:
+    """Index of the first bucket whose bound is >= value (BUCKET_COUNT = +Inf)."""
+    if value <= BUCKET_MIN:
+        return 0
+    index = math.ceil(BUCKETS_PER_OCTAVE * math.log2(value / BUCKET_MIN) - 1e-9)
+    return index if index < BUCKET_COUNT else BUCKET_COUNT
+
+
+class _ValuesFile:
+    """
+    Append-only key -> float[] store in a memory-mapped file.
+    Entry: <u32 key length> <u32 value count> <key, padded to 8 bytes> <doubles>.
+    The header holds the bytes used, updated after each entry is complete.
+    """
+
+    def __init__(self, path: str, size: int = METRICS_FILE_BYTES):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+        self.values = memoryview(self._mm).cast('d')
+        self.offsets: Dict[str, int] = {}
+        self._used = _HEADER.unpack_from(self._mm, 0)[0] or _HEADER.size
+        for key, index, _count in _read_entries(self._mm, self._used):
+            self.offsets[key] = index
+
+    def slot(self, key: str, count: int) -> Optional[int]:
+        """Index of the first value of a key in self.values (allocated if new)."""
+        index = self.offsets.get(key)
+        if index is not None:
+            return index
+        raw = key.encode()
+        padded = (len(raw) + 7) // 8 * 8
+        end = self._used + _ENTRY.size + padded + 8 * count
+        if end > len(self._mm):
+            return None
+        _ENTRY.pack_into(self._mm, self._used, len(raw), count)
+        self._mm[self._used + _ENTRY.size:self._used + _ENTRY.size + len(raw)] = raw
+        index = (self._used + _ENTRY.size + padded) // 8
+        self._used = end
+        _HEADER.pack_into(self._mm, 0, end)
+        self.offsets[key] = index
+        return index
+
+    def close(self):
+        self.values.release()
+        self._mm.close()
+        os.close(self._fd)
+
+
+def _read_entries(buf, used: int):
+    offset = _HEADER.size
+    while offset + _ENTRY.size <= used:
+        key_len, count = _ENTRY.unpack_from(buf, offset)
+        key_start = offset + _ENTRY.size
+        values_start = key_start + (key_len + 7) // 8 * 8
+        yield bytes(buf[key_start:key_start + key_len]).decode(), values_start // 8, count
+        offset = values_start + 8 * count
+
+
+def _read_file(path: str) -> Dict[str, List[float]]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return {}
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    values = memoryview(data[:used - used % 8]).cast('d')
+    return {key: list(values[index:index + count]) for key, index, count in _read_entries(data, used)}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class MetricsRegistry:
+    """Metric definitions plus this process's values file."""
+
+    def __init__(self):
+        self.service = os.getenv('METRICS_SERVICE', 'app')
+        self.metrics: Dict[str, '_Metric'] = {}
+        self._file: Optional[_ValuesFile] = None
+        self._lock = threading.Lock()
+        self._full_warned = False
+        self.generation = 0  # bumped after fork, when every series must find its slot again
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The child must not write into its parent's file
+        self._file = None
+        self._lock = threading.Lock()
+        self.generation += 1
+
+    def configure(self, service: str):
+        """Set the service name that prefixes this process's metrics files."""
+        self.service = service
+
+    def _path(self, pid) -> str:
+        return os.path.join(METRICS_DIR, f"{self.service}_{pid}.db")
+
+    def values_file(self) -> _ValuesFile:
+        values_file = self._file
+        if values_file is not None:
+            return values_file
+        with self._lock:
+            if self._file is None:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                self._archive_dead_files()
+                self._file = _ValuesFile(self._path(os.getpid()))
+            return self._file
+
+    def slot(self, key: str, count: int) -> Optional[int]:
+        index = self.values_file().slot(key, count)
+        if index is None and not self._full_warned:
+            self._full_warned = True
+            from shared_utils import log  # log records its drops in these metrics
+            log.get_logger('metrics').warning(
+                "Metrics file full, new series are dropped (raise METRICS_FILE_BYTES)"
+            )
+        return index
+
+    def _archive_dead_files(self):
+        """Fold the counters and histograms of exited processes into the archive file."""
+        import fcntl
+        archive_path = self._path('archive')
+        with open(archive_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = None
+            for path in glob.glob(self._path('*')):
+                pid = os.path.basename(path)[len(self.service) + 1:-3]
+                if not pid.isdigit() or _pid_alive(int(pid)):
+                    continue
+                archive = archive or _ValuesFile(archive_path)
+                for key, values in _read_file(path).items():
+                    if key.startswith('g|'):
+                        continue
+                    index = archive.slot(key, len(values))
+                    if index is None:
+                        continue
+                    for i, value in enumerate(values):
+                        archive.values[index + i] += value
+                os.remove(path)
+            if archive is not None:
+                archive.close()
+
+    def register(self, metric: '_Metric') -> '_Metric':
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self) -> Dict[str, List[float]]:
+        """Values summed over every process of the service (gauges: live processes only)."""
+        totals: Dict[str, List[float]] = {}
+        for path in glob.glob(self._path('*')):
+            pid = os.path.basename(path)[len(self.service) + 1:-3]
+            live = pid.isdigit() and _pid_alive(int(pid))
+            if not pid.isdigit() and pid != 'archive':
+                continue
+            for key, values in _read_file(path).items():
+                if key.startswith('g|') and not live:
+                    continue
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return totals
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        series: Dict[str, List[Tuple[tuple, List[float]]]] = {}
+        for key, values in self.collect().items():
+            _kind, name, labels = key.split('|', 2)
+            series.setdefault(name, []).append((tuple(json.loads(labels)), values))
+        lines = []
+        for name in sorted(series):
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for label_values, values in sorted(series[name]):
+                lines.extend(metric.render(label_values, values))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) and abs(value) < 1e15 else repr(value)
+
+
+class _Series:
+    """
+    One label combination of a metric, bound to its slot in the values file.
+    Hot paths should keep a series from Metric.labels() instead of passing labels per call.
+    """
+
+    __slots__ = ('_metric', '_key', '_slot', '_generation', '_span')
+
+    def __init__(self, metric: '_Metric', label_values: tuple):
+        self._metric = metric
+        self._key = f"{metric.prefix}|{metric.name}|{json.dumps([str(v) for v in label_values])}"
+        self._slot = None
+        self._generation = -1
+        span_index = metric.span_index
+        self._span = str(label_values[span_index]) if span_index is not None else None
+
+    def _values(self):
+        registry = self._metric._registry
+        if self._generation != registry.generation:
+            # First use in this process (or after a fork): find our slot
+            self._slot = registry.slot(self._key, self._metric.width)
+            self._generation = registry.generation
+        return registry._file.values if self._slot is not None else None
+
+    def inc(self, amount: float = 1.0):
+        """Add to a counter or gauge."""
+        if METRICS_ENABLED:
+            values = self._values()
+            if values is not None:
+                values[self._slot] += amount
+
+    def dec(self, amount: float = 1.0):
+        """Subtract from a gauge."""
+        self.inc(-amount)
+
+    def set(self, value: float):
+        """Set a gauge."""
+        if METRICS_ENABLED:
+            values = self._values()
+            if values is not None:
+                values[self._slot] = value
+
+    def observe(self, value: float):
+        """Record a histogram observation (seconds)."""
+        if METRICS_ENABLED:
+            values = self._values()
+            if values is not None:
+                slot = self._slot
+                values[slot] += 1
+                values[slot + 1] += value
+                values[slot + 2 + bucket_index(value)] += 1
+        if self._span is not None and span_recorder is not None:
+            span_recorder(self._span, value)
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class _Metric:
+    kind = ''
+    prefix = ''
+    width = 1
+
+    def __init__(self, name: str, documentation: str, labelnames: Optional[List[str]] = None,
+                 registry: Optional[MetricsRegistry] = None, span_label: Optional[str] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames or ())
+        # Observations are also reported to span_recorder, named by this label's value
+        self.span_index = self.labelnames.index(span_label) if span_label else None
+        self._registry = registry or default_registry
+        self._series: Dict[tuple, _Series] = {}
+        self._registry.register(self)
+
+    def labels(self, *label_values) -> _Series:
+        """The series for these label values, in labelnames order."""
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = _Series(self, label_values)
+        return series
+
+    def _labelled(self, labels: Dict[str, object]) -> _Series:
+        return self.labels(*[labels.get(n, '') for n in self.labelnames])
+
+    def render(self, label_values, values) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, label_values)} {_format_value(values[0])}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter."""
+    kind = 'counter'
+    prefix = 'c'
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._labelled(labels).inc(amount)
+
+
+class Gauge(_Metric):
+    """Current value, summed over live processes."""
+    kind = 'gauge'
+    prefix = 'g'
+
+    def set(self, value: float, **labels):
+        self._labelled(labels).set(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._labelled(labels).inc(amount)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self._labelled(labels).inc(-amount)
+
+
+class Histogram(_Metric):
+    """Latency histogram with fixed log-linear buckets (values in seconds)."""
+    kind = 'histogram'
+    prefix = 'h'
+    width = BUCKET_COUNT + 3  # count, sum, buckets..., +Inf
+
+    def observe(self, value: float, **labels):
+        self._labelled(labels).observe(value)
+
+    def time(self, **labels):
+        """Observe the duration of a with-block."""
+        return self._labelled(labels).time()
+
+    def render(self, label_values, values) -> List[str]:
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(BUCKET_BOUNDS, values[2:2 + BUCKET_COUNT]):
+            cumulative += count
+            le = f'le="{bound:.6g}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, label_values, le)} "
+                         f"{_format_value(cumulative)}")
+        le_inf = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, label_values, le_inf)} "
+                     f"{_format_value(values[0])}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, label_values)} {values[1]!r}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, label_values)} "
+                     f"{_format_value(values[0])}")
+        return lines
+
+
+# Process-wide registry
+default_registry = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Optional[List[str]] = None) -> Counter:
+    return Counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Optional[List[str]] = None) -> Gauge:
+    return Gauge(name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Optional[List[str]] = None,
+              span_label: Optional[str] = None) -> Histogram:
+    return Histogram(name, documentation, labelnames, span_label=span_label)
+
+
+def timed(metric: Histogram, *label_values):
+    """
+    Decorator observing a function's duration in a histogram whose last label
+    is 'outcome' ('ok', or 'error' if the function raised).
+    """
+    ok = metric.labels(*label_values, 'ok')
+    error = metric.labels(*label_values, 'error')
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                error.observe(time.perf_counter() - start)
+                raise
+            ok.observe(time.perf_counter() - start)
+            return result
+        return wrapper
+    return decorator
+
+
+# Standard metrics shared by the services
+HTTP_REQUEST_DURATION = histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ['route', 'method', 'status']
+)
+DEPENDENCY_DURATION = histogram(
+    'dependency_duration_seconds',
+    'Latency of calls to Redis, MongoDB, the Odds API and other services',
+    ['dependency', 'operation', 'outcome'],
+    span_label='dependency'
+)
+CACHE_REQUESTS = counter(
+    'cache_requests_total', 'Cache lookups by result (hit, miss or error)', ['cache', 'result']
+)
+
+
+def init_app(app, service: str):
+    """
+    Record the latency of every request per route and serve /metrics.
+
+    Args:
+        app: Flask application
+        service: Service name (separates the metrics files of services sharing a host)
+    """
+    from flask import request, g, Response
+
+    default_registry.configure(service)
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_DURATION.labels(rule, request.method, response.status_code).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    @app.teardown_request
+    def _metrics_record_error(exc):
+        # Unhandled exceptions skip after_request
+        start = g.pop('_metrics_start', None)
+        if start is not None and exc is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_DURATION.labels(rule, request.method, 500).observe(time.perf_counter() - start)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Prometheus metrics of all workers of this service."""
+        return Response(default_registry.render(), mimetype='text/plain; version=0.0.4')
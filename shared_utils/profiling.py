@@ -0,0 +1,343 @@
+"""
+On-demand request profiling for the Flask services.
+
+A request is profiled when:
+- it carries an X-Profile header equal to PROFILING_ADMIN_TOKEN, or
+- it is picked by PROFILING_SAMPLE_RATE (a fraction of all requests).
+
+Each profile records:
+- a cProfile of the request. Only one cProfile runs per process at a time;
+  requests that overlap it get spans only.
+- a timeline of spans, each one a timed call to a dependency or a
+  serialization step:
+  - spans come from the dependency histograms in shared_utils.metrics
+    (mongo, redis, odds_api, user_service, wallet operations)
+  - and from explicit span() blocks (serialization)
+- the time of each span kind, excluding nested spans, plus the time not
+  covered by any span.
+
+Profiles are stored in a ring buffer of files in PROFILING_DIR, shared by
+all the workers on a host. Only the newest PROFILING_MAX_PROFILES are kept.
+Admin endpoints, guarded by the X-Admin-Token header, list profiles and
+download them. The .prof files open with pstats or snakeviz.
+
+A request that is not profiled pays one random() call and a header lookup.
+"""
+
+import os
+import glob
+import hmac
+import json
+import time
+import uuid
+import pstats
+import random
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from shared_utils import metrics, log
+
+logger = log.get_logger('profiling')
+
+# Profiling configuration
+PROFILING_ADMIN_TOKEN = os.getenv('PROFILING_ADMIN_TOKEN', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/neuralbets_profiles')
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 50))
+PROFILING_TOP_FUNCTIONS = int(os.getenv('PROFILING_TOP_FUNCTIONS', 30))
+PROFILING_MAX_TIMELINE = 200
+
+_local = threading.local()
+_cprofile_lock = threading.Lock()
+_NO_SPAN = nullcontext()
+
+
+class RequestProfile:
+    """Spans (and optionally a cProfile) of one request."""
+
+    def __init__(self, trigger: str, use_cprofile: bool):
+        self.id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        self.trigger = trigger
+        self.started_at = datetime.utcnow().isoformat()
+        self.start = time.perf_counter()
+        self.spans: List[tuple] = []  # (name, start, end) in perf_counter seconds
+        self.profiler = cProfile.Profile() if use_cprofile else None
+
+    def record(self, name: str, seconds: float):
+        end = time.perf_counter()
+        self.spans.append((name, end - seconds, end))
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """
+        Time per span name, excluding time spent in spans nested inside it.
+
+        Returns:
+            span name -> {'ms', 'count'}
+        """
+        # Children are reported when they end, so order by start (outermost first)
+        ordered = sorted(self.spans, key=lambda s: (s[1], -s[2]))
+        nested = [0.0] * len(ordered)
+        stack: List[int] = []
+        for i, (_name, start, end) in enumerate(ordered):
+            while stack and ordered[stack[-1]][2] < end - 1e-6:
+                stack.pop()
+            if stack:
+                nested[stack[-1]] += end - start
+            stack.append(i)
+        totals: Dict[str, Dict[str, float]] = {}
+        for (name, start, end), inner in zip(ordered, nested):
+            total = totals.setdefault(name, {'ms': 0.0, 'count': 0})
+            total['ms'] += max(0.0, end - start - inner) * 1000
+            total['count'] += 1
+        for total in totals.values():
+            total['ms'] = round(total['ms'], 3)
+        return totals
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        spans = self.breakdown()
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'started_at': self.started_at,
+            'pid': os.getpid(),
+            'profiler': 'cprofile' if self.profiler else 'spans',
+            'duration_ms': round(duration * 1000, 3),
+            'spans': spans,
+            'unaccounted_ms': round(max(0.0, duration * 1000 - sum(s['ms'] for s in spans.values())), 3),
+            'timeline': [
+                {'name': name, 'start_ms': round((start - self.start) * 1000, 3),
+                 'duration_ms': round((end - start) * 1000, 3)}
+                for name, start, end in self.spans[:PROFILING_MAX_TIMELINE]
+            ]
+        }
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """The profile of the request running in this thread (greenlet under gevent), if any."""
+    return getattr(_local, 'profile', None)
+
+
+def _record_span(name: str, seconds: float):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.record(name, seconds)
+
+
+@contextmanager
+def _timed_span(profile: RequestProfile, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record(name, time.perf_counter() - start)
+
+
+def span(name: str):
+    """
+    Context manager adding a span to the current request's profile.
+    A no-op (shared null context) when the request is not profiled.
+    """
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NO_SPAN
+    return _timed_span(profile, name)
+
+
+def top_functions(profiler: cProfile.Profile, limit: int = PROFILING_TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+    """The functions with the most cumulative time in a cProfile."""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{os.path.basename(filename)}:{line}({name})" if line else name,
+            'calls': primitive_calls if primitive_calls == calls else f"{calls}/{primitive_calls}",
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3)
+        }
+        for (filename, line, name), (primitive_calls, calls, tottime, cumtime, _callers) in rows
+    ]
+
+
+class ProfileStore:
+    """Ring buffer of profiles on disk (<id>.json summary, <id>.prof cProfile stats)."""
+
+    def __init__(self, directory: str, max_profiles: int = PROFILING_MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def _path(self, profile_id: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{ext}")
+
+    def save(self, summary: Dict[str, Any], profiler: Optional[cProfile.Profile]):
+        os.makedirs(self.directory, exist_ok=True)
+        if profiler is not None:
+            profiler.dump_stats(self._path(summary['id'], 'prof'))
+        tmp = self._path(summary['id'], 'json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp, self._path(summary['id'], 'json'))
+        self._prune()
+
+    def _prune(self):
+        # Ids start with a nanosecond timestamp, so name order is age order
+        for path in sorted(glob.glob(self._path('*', 'json')))[:-self.max_profiles]:
+            for stale in (path, path[:-len('json')] + 'prof'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries, newest first, without timelines and function tables."""
+        profiles = []
+        for path in sorted(glob.glob(self._path('*', 'json')), reverse=True):
+            try:
+                with open(path) as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                continue  # pruned by another worker meanwhile
+            summary.pop('timeline', None)
+            summary.pop('top_functions', None)
+            profiles.append(summary)
+        return profiles
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stats_path(self, profile_id: str) -> Optional[str]:
+        path = self._path(profile_id, 'prof')
+        return path if os.path.exists(path) else None
+
+
+def _valid_profile_id(profile_id: str) -> bool:
+    return all(c.isdigit() or c in '-abcdef' for c in profile_id) and 0 < len(profile_id) <= 40
+
+
+def is_admin(headers, header: str = 'X-Admin-Token') -> bool:
+    """True if the request header carries PROFILING_ADMIN_TOKEN (also guards other admin-only endpoints)."""
+    value = headers.get(header)
+    return bool(PROFILING_ADMIN_TOKEN and value
+                and hmac.compare_digest(value, PROFILING_ADMIN_TOKEN))
+
+
+def init_app(app, service: str):
+    """
+    Profile sampled or admin-requested requests and serve /admin/profiles.
+
+    Args:
+        app: Flask application
+        service: Service name (each service keeps its own ring buffer)
+    """
+    from flask import request, g, jsonify, send_file
+
+    store = ProfileStore(os.path.join(PROFILING_DIR, service))
+    metrics.span_recorder = _record_span
+
+    # jsonify() serialization shows up as a span
+    class SpannedJSONProvider(type(app.json)):
+        def dumps(self, obj, **kwargs):
+            with span('serialization'):
+                return super().dumps(obj, **kwargs)
+
+    app.json = SpannedJSONProvider(app)
+
+    def _is_admin(header: str) -> bool:
+        return is_admin(request.headers, header)
+
+    @app.before_request
+    def _profile_start():
+        if PROFILING_SAMPLE_RATE and random.random() < PROFILING_SAMPLE_RATE:
+            trigger = 'sample'
+        elif 'X-Profile' in request.headers and _is_admin('X-Profile'):
+            trigger = 'header'
+        else:
+            return
+        if request.path.startswith('/admin/profiles'):
+            return
+        use_cprofile = _cprofile_lock.acquire(blocking=False)
+        profile = RequestProfile(trigger, use_cprofile)
+        _local.profile = profile
+        g._profile = profile
+        if profile.profiler is not None:
+            try:
+                profile.profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) owns this thread
+                profile.profiler = None
+                _cprofile_lock.release()
+
+    def _finish(profile: RequestProfile, status: int) -> Dict[str, Any]:
+        duration = time.perf_counter() - profile.start
+        _local.profile = None
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            _cprofile_lock.release()
+        summary = profile.summary(duration)
+        summary.update(
+            service=service,
+            method=request.method,
+            path=request.full_path.rstrip('?'),
+            route=request.url_rule.rule if request.url_rule is not None else None,
+            status=status
+        )
+        if profile.profiler is not None:
+            summary['top_functions'] = top_functions(profile.profiler)
+        try:
+            store.save(summary, profile.profiler)
+        except OSError as e:
+            logger.warning(f"Could not store profile {profile.id}: {e}")
+        return summary
+
+    @app.after_request
+    def _profile_stop(response):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            summary = _finish(profile, response.status_code)
+            response.headers['X-Profile-Id'] = profile.id
+            response.headers['Server-Timing'] = ', '.join(
+                [f"{name};dur={s['ms']}" for name, s in summary['spans'].items()]
+                + [f"total;dur={summary['duration_ms']}"]
+            )
+        return response
+
+    @app.teardown_request
+    def _profile_stop_error(exc):
+        # Unhandled exceptions skip after_request
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            _finish(profile, 500)
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def list_profiles():
+        """Stored profiles of this service, newest first."""
+        if not _is_admin('X-Admin-Token'):
+            return jsonify({"error": "Admin token required"}), 403
+        return jsonify(store.list()), 200
+
+    @app.route('/admin/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        """One profile: span breakdown, timeline and top functions."""
+        if not _is_admin('X-Admin-Token'):
+            return jsonify({"error": "Admin token required"}), 403
+        summary = store.get(profile_id) if _valid_profile_id(profile_id) else None
+        if summary is None:
+            return jsonify({"error": f"Profile {profile_id} not found"}), 404
+        return jsonify(summary), 200
+
+    @app.route('/admin/profiles/<profile_id>/download', methods=['GET'])
+    def download_profile(profile_id):
+        """The cProfile stats of a profile (pstats format)."""
+        if not _is_admin('X-Admin-Token'):
+            return jsonify({"error": "Admin token required"}), 403
+        path = store.stats_path(profile_id) if _valid_profile_id(profile_id) else None
+        if path is None:
+            return jsonify({"error": f"No cProfile stats for profile {profile_id}"}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{service}-{profile_id}.prof")
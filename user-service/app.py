@@ -2,14 +2,27 @@ from flask import Flask, jsonify
 from flask.cli import load_dotenv
 from flask_cors import CORS
 from routes.api_routes import api_bp
+from shared_utils import metrics, profiling, log
 
 load_dotenv()
 
 app = Flask(__name__)
 
+# Per-route latency histograms and /metrics (aggregated over gunicorn workers)
+metrics.init_app(app, 'user-service')
+
+# Sampled / admin-requested request profiles with per-span breakdowns
+profiling.init_app(app, 'user-service')
+
+# Request ids on every log record
+log.init_app(app, 'user-service')
+
 # Enable CORS for all routes
 CORS(app, resources={
-    r"/api/*": {"origins": ["http://localhost:3000", "http://localhost:3001", "https://neuralbets.vercel.app"]},
+    r"/api/*": {
+        "origins": ["http://localhost:3000", "http://localhost:3001", "https://neuralbets.vercel.app"],
+        "expose_headers": ["X-Next-Cursor", "X-Prev-Cursor"]
+    },
     r"/health": {"origins": "*"}
 })
 
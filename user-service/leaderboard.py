@@ -0,0 +1,374 @@
+"""
+Challenge leaderboards.
+
+Wallets are ranked per challenge type by balance, ROI (profit relative to the
+starting balance) or progress from the starting balance toward target_balance.
+Scores are updated incrementally on every wallet mutation and kept in sorted
+structures, so top-K and rank-of-user queries are O(log n). Updates are pushed
+after the wallet write commits, so they can arrive out of order: each backend
+keeps the event_seq of the scores it holds per user and ignores an update
+that is not newer.
+
+    - RedisLeaderboard: one sorted set per (challenge_type, metric), shared by
+      every worker and instance (used when REDIS_URL or REDIS_HOST is set)
+    - MemoryLeaderboard: indexable skip lists in process, resynced from the
+      wallet store by a background thread to pick up other workers' writes
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Optional, List, Dict, Any, Tuple, Callable, Iterable
+
+from wallet_schemas import ChallengeType
+from shared_utils import log
+
+logger = log.get_logger('leaderboard')
+
+# Redis configuration (same variables as the bet-service cache)
+REDIS_URL = os.getenv('REDIS_URL', None)
+REDIS_HOST = os.getenv('REDIS_HOST', None)
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+
+# Leaderboard settings
+LEADERBOARD_KEY_PREFIX = 'leaderboard'
+LEADERBOARD_RESYNC_SECONDS = float(os.getenv('LEADERBOARD_RESYNC_SECONDS', 5.0))
+LEADERBOARD_METRICS = ('balance', 'roi', 'progress')
+
+# Compare-and-set of a user's scores on their event_seq.
+# KEYS[1]: hash user_id -> event_seq, KEYS[2..]: boards
+# ARGV[1]: user_id, ARGV[2]: event_seq, ARGV[3..]: score per board
+# A board missing the user (evicted or flushed) takes the scores even when
+# they are not newer: no newer update reached it.
+_UPDATE_SCRIPT = """
+local seq = tonumber(ARGV[2])
+local newer = seq > tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or -1)
+if newer then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+local applied = 0
+for i = 2, #KEYS do
+    if newer or not redis.call('ZSCORE', KEYS[i], ARGV[1]) then
+        redis.call('ZADD', KEYS[i], ARGV[i + 1], ARGV[1])
+        applied = 1
+    end
+end
+return applied
+"""
+
+
+def leaderboard_scores(wallet: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Compute the ranking scores of a wallet.
+    Progress is only defined for challenges with a target balance.
+    """
+    balance = wallet['balance']
+    starting = wallet['starting_balance']
+    target = wallet.get('target_balance')
+    scores = {
+        'balance': balance,
+        'roi': (balance - starting) / starting if starting else 0.0,
+    }
+    if target and target > starting:
+        scores['progress'] = (balance - starting) / (target - starting)
+    return scores
+
+
+class _SkipNode:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional['_SkipNode']] = [None] * level
+        # width[i] = number of positions advanced by following next[i]
+        self.width: List[int] = [0] * level
+
+
+class IndexableSkipList:
+    """
+    Sorted collection of unique keys with O(log n) insert, remove,
+    rank-of-key and select-by-rank (ranks are 1-based).
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.head = _SkipNode(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    def _find_update(self, key, inclusive: bool):
+        update = [self.head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        x = self.head
+        for i in reversed(range(self.level)):
+            rank[i] = rank[i + 1] if i < self.level - 1 else 0
+            while x.next[i] is not None and (x.next[i].key < key or (inclusive and x.next[i].key == key)):
+                rank[i] += x.width[i]
+                x = x.next[i]
+            update[i] = x
+        return update, rank
+
+    def insert(self, key):
+        """Insert a key (must not already be present)."""
+        update, rank = self._find_update(key, inclusive=False)
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.width[i] = self.size
+            self.level = level
+        node = _SkipNode(key, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key) -> bool:
+        """Remove a key. Returns False if it was not present."""
+        update, _ = self._find_update(key, inclusive=False)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self.level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+        self.size -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """1-based position of a key, or None if absent."""
+        x = self.head
+        rank = 0
+        for i in reversed(range(self.level)):
+            while x.next[i] is not None and x.next[i].key <= key:
+                rank += x.width[i]
+                x = x.next[i]
+            if x is not self.head and x.key == key:
+                return rank
+        return None
+
+    def slice(self, start: int, count: int) -> List[Any]:
+        """Keys at 0-based positions [start, start + count)."""
+        if start < 0 or count <= 0 or start >= self.size:
+            return []
+        x = self.head
+        traversed = 0
+        target = start + 1
+        for i in reversed(range(self.level)):
+            while x.next[i] is not None and traversed + x.width[i] <= target:
+                traversed += x.width[i]
+                x = x.next[i]
+        keys = []
+        while x is not None and len(keys) < count:
+            keys.append(x.key)
+            x = x.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Interface for leaderboard backends."""
+
+    def update(self, wallet: Dict[str, Any]):
+        """Record the scores of a wallet, unless newer ones (by event_seq) are recorded."""
+        raise NotImplementedError
+
+    def top(self, challenge_type: str, metric: str, limit: int) -> List[Tuple[str, float]]:
+        """Highest-ranked (user_id, score) pairs."""
+        raise NotImplementedError
+
+    def rank(self, challenge_type: str, metric: str, user_id: str) -> Optional[Tuple[int, float]]:
+        """(1-based rank, score) of a user, or None if not ranked."""
+        raise NotImplementedError
+
+    def seed(self, wallets: Iterable[Dict[str, Any]]):
+        """Load scores for existing wallets."""
+        for wallet in wallets:
+            self.update(wallet)
+
+
+class MemoryLeaderboard(Leaderboard):
+    """
+    In-process skip lists keyed by (-score, user_id).
+
+    Args:
+        load_wallets: Optional callable returning every wallet in the store;
+            used to resync when change_token reports writes from other processes
+        change_token: See WalletStore.change_token. If the store supports it,
+            a background thread checks it every LEADERBOARD_RESYNC_SECONDS
+    """
+
+    def __init__(self, load_wallets: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None,
+                 change_token: Optional[Callable[[], Any]] = None):
+        self._load_wallets = load_wallets
+        self._change_token = change_token
+        self._boards: Dict[Tuple[str, str], IndexableSkipList] = {}
+        self._scores: Dict[Tuple[str, str], Dict[str, float]] = {}
+        # user_id -> event_seq of the scores held
+        self._seqs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if load_wallets is not None and change_token is not None and change_token() is not None:
+            threading.Thread(target=self._resync_loop, name='leaderboard-resync', daemon=True).start()
+
+    def _update_locked(self, wallet: Dict[str, Any]):
+        user_id = wallet['user_id']
+        seq = wallet.get('event_seq', 0)
+        if seq <= self._seqs.get(user_id, -1):
+            return
+        self._seqs[user_id] = seq
+        for metric, score in leaderboard_scores(wallet).items():
+            board_key = (wallet['challenge_type'], metric)
+            board = self._boards.setdefault(board_key, IndexableSkipList())
+            scores = self._scores.setdefault(board_key, {})
+            previous = scores.get(user_id)
+            if previous == score:
+                continue
+            if previous is not None:
+                board.remove((-previous, user_id))
+            board.insert((-score, user_id))
+            scores[user_id] = score
+
+    def update(self, wallet: Dict[str, Any]):
+        with self._lock:
+            self._update_locked(wallet)
+
+    def seed(self, wallets: Iterable[Dict[str, Any]]):
+        with self._lock:
+            self._boards.clear()
+            self._scores.clear()
+            self._seqs.clear()
+            for wallet in wallets:
+                self._update_locked(wallet)
+
+    def _resync_loop(self):
+        # Updates are compare-and-set on event_seq, so the boards are patched
+        # in place: wallets that did not change cost one dict lookup each.
+        # Tokens are only comparable within a thread (SQLite data_version is
+        # per connection), so the first pass always runs
+        token = None
+        while True:
+            time.sleep(LEADERBOARD_RESYNC_SECONDS)
+            try:
+                current = self._change_token()
+                if current == token:
+                    continue
+                token = current
+                for wallet in self._load_wallets():
+                    self.update(wallet)
+            except Exception as e:
+                logger.warning(f"Leaderboard resync failed: {e}")
+
+    def top(self, challenge_type: str, metric: str, limit: int) -> List[Tuple[str, float]]:
+        with self._lock:
+            board = self._boards.get((challenge_type, metric))
+            if board is None:
+                return []
+            return [(user_id, -neg_score) for neg_score, user_id in board.slice(0, limit)]
+
+    def rank(self, challenge_type: str, metric: str, user_id: str) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            score = self._scores.get((challenge_type, metric), {}).get(user_id)
+            if score is None:
+                return None
+            return self._boards[(challenge_type, metric)].rank((-score, user_id)), score
+
+
+class RedisLeaderboard(Leaderboard):
+    """Redis sorted sets, one per (challenge_type, metric)."""
+
+    SEQ_KEY = f"{LEADERBOARD_KEY_PREFIX}:seq"
+
+    def __init__(self, client):
+        self.client = client
+        self._update_script = client.register_script(_UPDATE_SCRIPT)
+
+    @staticmethod
+    def _key(challenge_type: str, metric: str) -> str:
+        return f"{LEADERBOARD_KEY_PREFIX}:{challenge_type}:{metric}"
+
+    def update(self, wallet: Dict[str, Any]):
+        scores = leaderboard_scores(wallet)
+        self._update_script(
+            keys=[self.SEQ_KEY] + [self._key(wallet['challenge_type'], metric) for metric in scores],
+            args=[wallet['user_id'], wallet.get('event_seq', 0)] + list(scores.values())
+        )
+
+    def seed(self, wallets: Iterable[Dict[str, Any]]):
+        # Load the store only when the boards are gone (new or flushed Redis).
+        # Processes starting together may both load it: updates are
+        # compare-and-set on event_seq, so that is harmless
+        keys = [self._key(challenge_type.value, metric)
+                for challenge_type in ChallengeType for metric in LEADERBOARD_METRICS]
+        if self.client.exists(*keys):
+            return
+        for wallet in wallets:
+            self.update(wallet)
+
+    def top(self, challenge_type: str, metric: str, limit: int) -> List[Tuple[str, float]]:
+        if limit <= 0:
+            return []
+        entries = self.client.zrevrange(self._key(challenge_type, metric), 0, limit - 1, withscores=True)
+        return [(user_id, float(score)) for user_id, score in entries]
+
+    def rank(self, challenge_type: str, metric: str, user_id: str) -> Optional[Tuple[int, float]]:
+        key = self._key(challenge_type, metric)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        rank, score = pipe.execute()
+        if rank is None:
+            return None
+        return rank + 1, float(score)
+
+
+def create_leaderboard(load_wallets: Callable[[], Iterable[Dict[str, Any]]],
+                       change_token: Optional[Callable[[], Any]] = None) -> Leaderboard:
+    """
+    Build the leaderboard backend. Uses Redis when configured, otherwise an
+    in-process leaderboard resynced from the wallet store.
+    """
+    leaderboard: Leaderboard
+    try:
+        if not (REDIS_URL or REDIS_HOST):
+            raise RuntimeError("REDIS_URL/REDIS_HOST not set")
+        import redis
+        if REDIS_URL:
+            client = redis.from_url(REDIS_URL, decode_responses=True,
+                                    socket_connect_timeout=2, socket_timeout=2)
+        else:
+            client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD,
+                                 db=REDIS_DB, decode_responses=True,
+                                 socket_connect_timeout=2, socket_timeout=2)
+        client.ping()
+        leaderboard = RedisLeaderboard(client)
+    except Exception as e:
+        logger.warning(f"Redis not available ({e}), using in-process leaderboard")
+        leaderboard = MemoryLeaderboard(load_wallets, change_token)
+    try:
+        leaderboard.seed(load_wallets())
+    except Exception as e:
+        logger.warning(f"Could not seed leaderboard: {e}")
+    return leaderboard
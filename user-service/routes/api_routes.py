@@ -1,13 +1,44 @@
+from datetime import datetime, timezone
+from typing import Optional
 from flask import Blueprint, jsonify, request
+from shared_utils import profiling
 from wallet_repository import (
     get_wallet_by_user_id, create_wallet, update_wallet_balance,
-    record_bet_placed, record_bet_won, record_bet_lost,
-    get_transactions_by_user_id, reset_wallet
+    record_bet_placed, record_bets_placed, record_bet_won, record_bet_lost,
+    get_transactions_by_user_id, reset_wallet, settle_bets, get_leaderboard,
+    rebuild_wallet, SettlementConflict, BetConflict
+)
+from wallet_schemas import (
+    wallet_to_dict, get_all_challenge_configs,
+    TransactionQuery, encode_transaction_cursor, decode_transaction_cursor
 )
-from wallet_schemas import wallet_to_dict, transaction_to_dict, get_all_challenge_configs
 
 api_bp = Blueprint('api_bp', __name__, url_prefix='/api')
 
+MAX_TRANSACTIONS_PAGE = 500
+
+
+def _timestamp_arg(name: str) -> Optional[str]:
+    """
+    Read an ISO 8601 query parameter as stored in created_at: UTC, naive,
+    datetime.isoformat(). Offsets ('Z', '+02:00') are converted to UTC and a
+    naive value is taken as UTC.
+
+    Raises:
+        ValueError: If the parameter is not an ISO 8601 date or timestamp
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected an ISO 8601 timestamp")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+
 @api_bp.route('/status', methods=['GET'])
 def api_status():
     """Returns the status of the sub-API service."""
@@ -66,7 +97,7 @@ def create_user_wallet():
 
 @api_bp.route('/wallet/<user_id>/bet', methods=['POST'])
 def place_bet(user_id: str):
-    """Record a bet placement and deduct from balance."""
+    """Record a bet placement and deduct from balance (409 if bet_id was placed with another stake)."""
     try:
         data = request.get_json()
         bet_amount = data.get('bet_amount')
@@ -77,6 +108,32 @@ def place_bet(user_id: str):
         
         wallet = record_bet_placed(user_id, float(bet_amount), bet_id)
         return jsonify(wallet_to_dict(wallet)), 200
+    except BetConflict as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/wallet/<user_id>/bets', methods=['POST'])
+def place_bets(user_id: str):
+    """
+    Record a slip of bets in one atomic update.
+    Body: {"bets": [{"bet_id": ..., "bet_amount": ...}, ...]}
+    409 if a bet_id was already placed with another stake.
+    """
+    try:
+        data = request.get_json() or {}
+        bets = data.get('bets')
+        
+        if not isinstance(bets, list) or not bets:
+            return jsonify({"error": "bets must be a non-empty list"}), 400
+        
+        wallet = record_bets_placed(user_id, bets)
+        return jsonify(wallet_to_dict(wallet)), 200
+    except BetConflict as e:
+        return jsonify({"error": str(e)}), 409
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -85,7 +142,7 @@ def place_bet(user_id: str):
 
 @api_bp.route('/wallet/<user_id>/win', methods=['POST'])
 def win_bet(user_id: str):
-    """Record a winning bet and add payout to balance."""
+    """Record a winning bet and add payout to balance (409 if it was settled as lost)."""
     try:
         data = request.get_json()
         payout = data.get('payout')
@@ -96,6 +153,8 @@ def win_bet(user_id: str):
         
         wallet = record_bet_won(user_id, float(payout), bet_id)
         return jsonify(wallet_to_dict(wallet)), 200
+    except SettlementConflict as e:
+        return jsonify({"error": str(e)}), 409
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -104,7 +163,7 @@ def win_bet(user_id: str):
 
 @api_bp.route('/wallet/<user_id>/lose', methods=['POST'])
 def lose_bet(user_id: str):
-    """Record a losing bet."""
+    """Record a losing bet (409 if it was settled as won)."""
     try:
         data = request.get_json()
         amount_lost = data.get('amount_lost')
@@ -115,19 +174,79 @@ def lose_bet(user_id: str):
         
         wallet = record_bet_lost(user_id, float(amount_lost), bet_id)
         return jsonify(wallet_to_dict(wallet)), 200
+    except SettlementConflict as e:
+        return jsonify({"error": str(e)}), 409
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@api_bp.route('/wallet/settle', methods=['POST'])
+def settle_wallet_bets():
+    """
+    Settle many bets in one request.
+    Body: {"bets": [{"user_id", "bet_id", "outcome": "won"|"lost", "amount"}, ...]}
+    Returns one result per bet, in request order. A bet already settled with
+    the other outcome gets status "conflict" and is left as it was.
+    """
+    try:
+        data = request.get_json()
+        bets = data.get('bets') if isinstance(data, dict) else None
+        
+        if not isinstance(bets, list) or not bets:
+            return jsonify({"error": "bets must be a non-empty list"}), 400
+        if not all(isinstance(b, dict) for b in bets):
+            return jsonify({"error": "each bet must be an object"}), 400
+        
+        results = settle_bets(bets)
+        settled = sum(1 for r in results if r['status'] == 'settled')
+        return jsonify({
+            "settled": settled,
+            "failed": len(results) - settled,
+            "results": results
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @api_bp.route('/wallet/<user_id>/transactions', methods=['GET'])
 def get_transactions(user_id: str):
-    """Get transaction history for a user."""
+    """
+    Get transaction history for a user, most recent first.
+    Query params:
+      - limit (default: 50, max: 500)
+      - before / after: cursor from a previous page's X-Next-Cursor / X-Prev-Cursor header
+      - type, bet_id: exact-match filters
+      - start, end: ISO timestamps (UTC unless they carry an offset), start <= created_at < end
+    """
     try:
-        limit = request.args.get('limit', 50, type=int)
-        transactions = get_transactions_by_user_id(user_id, limit)
-        return jsonify([transaction_to_dict(t) for t in transactions]), 200
+        limit = min(request.args.get('limit', 50, type=int), MAX_TRANSACTIONS_PAGE)
+        before = request.args.get('before')
+        after = request.args.get('after')
+        if before and after:
+            return jsonify({"error": "Use either before or after, not both"}), 400
+        
+        query = TransactionQuery(
+            limit=limit,
+            before=decode_transaction_cursor(before) if before else None,
+            after=decode_transaction_cursor(after) if after else None,
+            type=request.args.get('type'),
+            bet_id=request.args.get('bet_id'),
+            start=_timestamp_arg('start'),
+            end=_timestamp_arg('end')
+        )
+        transactions = get_transactions_by_user_id(user_id, query=query)
+        
+        response = jsonify(transactions)
+        if transactions:
+            # Older page continues below the last item, newer page above the first
+            if len(transactions) == limit or after:
+                response.headers['X-Next-Cursor'] = encode_transaction_cursor(transactions[-1])
+            response.headers['X-Prev-Cursor'] = encode_transaction_cursor(transactions[0])
+        return response, 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -144,6 +263,40 @@ def reset_user_wallet(user_id: str):
         return jsonify({"error": str(e)}), 500
 
 
+@api_bp.route('/wallet/<user_id>/rebuild', methods=['POST'])
+def rebuild_user_wallet(user_id: str):
+    """Recompute a wallet from its transaction log. Requires the X-Admin-Token header (403 otherwise)."""
+    if not profiling.is_admin(request.headers):
+        return jsonify({"error": "Admin token required to rebuild a wallet"}), 403
+    try:
+        wallet = rebuild_wallet(user_id)
+        return jsonify(wallet_to_dict(wallet)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/leaderboard/<challenge_type>', methods=['GET'])
+def get_challenge_leaderboard(challenge_type: str):
+    """
+    Get the leaderboard for a challenge type.
+    Query params:
+      - metric: balance (default), roi or progress
+      - limit (default: 10, max: 100)
+      - user_id: include this user's rank and score
+    """
+    try:
+        metric = request.args.get('metric', 'balance')
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        user_id = request.args.get('user_id')
+        return jsonify(get_leaderboard(challenge_type, metric, limit, user_id)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @api_bp.route('/challenges', methods=['GET'])
 def get_challenges():
     """Get all available challenge configurations."""
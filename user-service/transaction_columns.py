@@ -0,0 +1,250 @@
+"""
+Columnar in-memory transaction log.
+
+Used by MemoryWalletStore instead of one dict per transaction. Every field is
+held in a typed array (one row per transaction):
+
+    - transaction ids and bet ids as 16 raw UUID bytes
+    - user ids and types interned to small integers
+    - created_at as integer microseconds since the epoch
+    - amounts as float64
+    - descriptions derived from the other fields on read (see
+      wallet_schemas.describe_transaction); only the ones that cannot be
+      derived are kept
+
+Rows are materialized back into transaction dicts only when a page is read.
+"""
+
+import math
+import uuid
+import bisect
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple, Iterable
+from wallet_schemas import TransactionQuery, describe_transaction
+
+EPOCH = datetime(1970, 1, 1)
+NO_UUID = bytes(16)
+
+
+def timestamp_to_micros(value: str) -> int:
+    """Convert a UTC ISO timestamp (as produced by datetime.isoformat) to epoch microseconds."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+
+def pack_uuid(value: Optional[str]) -> Optional[bytes]:
+    """16-byte form of a canonical UUID string, or None if it is not one."""
+    if not value or len(value) != 36:
+        return None
+    try:
+        packed = uuid.UUID(value)
+    except ValueError:
+        return None
+    return packed.bytes if str(packed) == value else None
+
+
+def unpack_uuid(packed: bytes) -> str:
+    """Canonical string form of 16 UUID bytes (faster than str(uuid.UUID(bytes=...)))."""
+    h = packed.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def micros_to_timestamp(micros: int) -> str:
+    """Inverse of timestamp_to_micros."""
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+class _Interner:
+    """Bidirectional string <-> small integer mapping."""
+
+    def __init__(self, reserved: Iterable[Optional[str]] = ()):
+        self.values: List[Optional[str]] = list(reserved)
+        self.index: Dict[Optional[str], int] = {v: i for i, v in enumerate(self.values)}
+
+    def intern(self, value: Optional[str]) -> int:
+        i = self.index.get(value)
+        if i is None:
+            i = len(self.values)
+            self.values.append(value)
+            self.index[value] = i
+        return i
+
+
+class TransactionColumns:
+    """
+    Append-only columnar store of transactions with a per-user index ordered
+    by (created_at, transaction_id), the order used for pagination.
+    """
+
+    def __init__(self):
+        self._users = _Interner()
+        self._types = _Interner()
+        self.transaction_id = bytearray()
+        self.bet_id = bytearray()  # all zero = no bet (or see _raw_bet_ids)
+        self.user = array('I')
+        self.type = array('B')
+        self.created_at = array('q')
+        self.seq = array('I')
+        self.amount = array('d')
+        self.balance_before = array('d')
+        self.balance_after = array('d')
+        self.stake = array('d')  # NaN = no stake
+        # Rows whose description or ids cannot be derived/packed
+        self._descriptions: Dict[int, str] = {}
+        self._raw_ids: Dict[int, str] = {}
+        self._raw_bet_ids: Dict[int, str] = {}
+        # user index -> rows ordered by (created_at, transaction_id)
+        self._user_rows: Dict[int, array] = {}
+        self._last_seq: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.seq)
+
+    def _transaction_id(self, row: int) -> str:
+        raw = self._raw_ids.get(row)
+        if raw is not None:
+            return raw
+        return unpack_uuid(self.transaction_id[row * 16:row * 16 + 16])
+
+    def _bet_id(self, row: int) -> Optional[str]:
+        packed = self.bet_id[row * 16:row * 16 + 16]
+        if packed == NO_UUID:
+            return self._raw_bet_ids.get(row)
+        return unpack_uuid(packed)
+
+    def _sort_key(self, row: int) -> Tuple[int, str]:
+        return self.created_at[row], self._transaction_id(row)
+
+    def append(self, transaction: Dict[str, Any]) -> int:
+        """Store a transaction dict. Returns its row number."""
+        created_at = timestamp_to_micros(transaction['created_at'])
+        stake = transaction.get('stake')
+        transaction_id = pack_uuid(transaction['transaction_id'])
+        bet_id = pack_uuid(transaction.get('bet_id'))
+        with self._lock:
+            row = len(self.seq)
+            self.transaction_id += transaction_id or NO_UUID
+            if transaction_id is None:
+                self._raw_ids[row] = transaction['transaction_id']
+            self.bet_id += bet_id or NO_UUID
+            if bet_id is None and transaction.get('bet_id') is not None:
+                self._raw_bet_ids[row] = transaction['bet_id']
+            user = self._users.intern(transaction['user_id'])
+            self.user.append(user)
+            self.type.append(self._types.intern(transaction['type']))
+            self.created_at.append(created_at)
+            self.amount.append(transaction['amount'])
+            self.balance_before.append(transaction['balance_before'])
+            self.balance_after.append(transaction['balance_after'])
+            self.stake.append(math.nan if stake is None else stake)
+            self.seq.append(transaction.get('seq', 0))
+            derived = describe_transaction(
+                transaction['type'], transaction['amount'], stake, transaction['balance_after']
+            )
+            if derived != transaction['description']:
+                self._descriptions[row] = transaction['description']
+            rows = self._user_rows.setdefault(user, array('I'))
+            self._last_seq[user] = max(self._last_seq.get(user, 0), self.seq[row])
+
+        # Per-user index: appends are in time order except for same-instant ties
+        key = (created_at, transaction['transaction_id'])
+        if not rows or key >= self._sort_key(rows[-1]):
+            rows.append(row)
+        else:
+            rows.insert(bisect.bisect(rows, key, key=self._sort_key), row)
+        return row
+
+    def materialize(self, row: int) -> Dict[str, Any]:
+        """Build the transaction dict for a row."""
+        type = self._types.values[self.type[row]]
+        stake = self.stake[row]
+        stake = None if math.isnan(stake) else stake
+        amount = self.amount[row]
+        balance_after = self.balance_after[row]
+        description = self._descriptions.get(row)
+        if description is None:
+            description = describe_transaction(type, amount, stake, balance_after)
+        return {
+            'transaction_id': self._transaction_id(row),
+            'user_id': self._users.values[self.user[row]],
+            'type': type,
+            'amount': amount,
+            'balance_before': self.balance_before[row],
+            'balance_after': balance_after,
+            'bet_id': self._bet_id(row),
+            'description': description,
+            'created_at': micros_to_timestamp(self.created_at[row]),
+            'seq': self.seq[row],
+            'stake': stake,
+        }
+
+    def user_ids(self) -> List[str]:
+        """Every user with at least one transaction."""
+        return [self._users.values[user] for user in list(self._user_rows)]
+
+    def last_seq(self, user_id: str) -> int:
+        """Highest seq recorded for a user (0 if none)."""
+        return self._last_seq.get(self._users.index.get(user_id), 0)
+
+    def transactions_after(self, user_id: str, seq: int) -> List[Dict[str, Any]]:
+        """A user's transactions with seq greater than the given one."""
+        rows = self._user_rows.get(self._users.index.get(user_id))
+        tail = []
+        # Time order follows seq order (up to same-instant ties), so the tail
+        # is at the end of the index
+        for row in reversed(rows or ()):
+            if self.seq[row] > seq:
+                tail.append(self.materialize(row))
+            elif not tail or self.created_at[row] < timestamp_to_micros(tail[-1]['created_at']):
+                break
+        return tail
+
+    def query(self, user_id: str, query: TransactionQuery) -> List[Dict[str, Any]]:
+        """One page of a user's transactions, most recent first (see WalletStore.query_transactions)."""
+        rows = self._user_rows.get(self._users.index.get(user_id))
+        if query.limit <= 0 or not rows:
+            return []
+        # Filters are compared on the interned/numeric columns
+        type = None
+        if query.type is not None:
+            type = self._types.index.get(query.type)
+            if type is None:
+                return []
+        bet = pack_uuid(query.bet_id)
+
+        # Narrow to the [lo, hi) window allowed by cursors and date range
+        lo, hi = 0, len(rows)
+        if query.before is not None:
+            position = (timestamp_to_micros(query.before[0]), query.before[1])
+            hi = bisect.bisect_left(rows, position, key=self._sort_key)
+        if query.end is not None:
+            hi = min(hi, bisect.bisect_left(rows, (timestamp_to_micros(query.end), ''), key=self._sort_key))
+        if query.after is not None:
+            position = (timestamp_to_micros(query.after[0]), query.after[1])
+            lo = bisect.bisect_right(rows, position, key=self._sort_key)
+        if query.start is not None:
+            lo = max(lo, bisect.bisect_left(rows, (timestamp_to_micros(query.start), ''), key=self._sort_key))
+
+        page = []
+        # "after" pages are the ones just newer than the cursor, so walk upwards
+        indexes = range(lo, hi) if query.after is not None else range(hi - 1, lo - 1, -1)
+        for index in indexes:
+            row = rows[index]
+            if type is not None and self.type[row] != type:
+                continue
+            if query.bet_id is not None:
+                if bet is not None and self.bet_id[row * 16:row * 16 + 16] != bet:
+                    continue
+                if bet is None and self._raw_bet_ids.get(row) != query.bet_id:
+                    continue
+            page.append(self.materialize(row))
+            if len(page) == query.limit:
+                break
+        if query.after is not None:
+            page.reverse()
+        return page
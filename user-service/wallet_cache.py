@@ -0,0 +1,89 @@
+"""
+In-process cache for hot wallets.
+
+Reads of frequently accessed wallets are served from memory. Entries are
+invalidated on local writes, expire after WALLET_CACHE_TTL_SECONDS, and the
+whole cache is dropped when the store reports a write from another process.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+
+from shared_utils import metrics
+
+# Cache settings
+WALLET_CACHE_TTL_SECONDS = float(os.getenv('WALLET_CACHE_TTL_SECONDS', 2.0))
+WALLET_CACHE_MAX_ENTRIES = int(os.getenv('WALLET_CACHE_MAX_ENTRIES', 10000))
+
+_CACHE_HIT = metrics.CACHE_REQUESTS.labels('wallet', 'hit')
+_CACHE_MISS = metrics.CACHE_REQUESTS.labels('wallet', 'miss')
+
+
+class WalletCache:
+    """
+    LRU cache of wallet dicts keyed by user_id with TTL expiry.
+
+    Args:
+        change_token: Optional callable returning a value that changes when
+            another process writes to the backing store (see WalletStore.change_token)
+    """
+
+    def __init__(self, change_token: Optional[Callable[[], Any]] = None,
+                 ttl: float = WALLET_CACHE_TTL_SECONDS,
+                 max_entries: int = WALLET_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._change_token = change_token
+        self._token = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_token(self):
+        if self._change_token is None:
+            return
+        token = self._change_token()
+        if token != self._token:
+            self._entries.clear()
+            self._token = token
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached wallet dict, or None on miss/expiry."""
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            self._check_token()
+            entry = self._entries.get(user_id)
+            if entry is None:
+                _CACHE_MISS.inc()
+                return None
+            expires_at, wallet = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                _CACHE_MISS.inc()
+                return None
+            self._entries.move_to_end(user_id)
+            _CACHE_HIT.inc()
+            return dict(wallet)
+
+    def put(self, user_id: str, wallet: Dict[str, Any]):
+        """Cache a wallet dict read from or just written to the store."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, dict(wallet))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        """Drop a single wallet from the cache."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop every cached wallet."""
+        with self._lock:
+            self._entries.clear()
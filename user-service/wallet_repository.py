@@ -3,22 +3,200 @@ Repository layer for wallet operations.
 Handles all database interactions for wallets and transactions.
 """
 
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Tuple
 from datetime import datetime
 from dataclasses import asdict
 import uuid
 from wallet_schemas import (
     Wallet, Transaction, wallet_to_dict, dict_to_wallet,
-    transaction_to_dict, dict_to_transaction, create_new_wallet, CHALLENGE_CONFIGS
+    transaction_to_dict, create_new_wallet, CHALLENGE_CONFIGS,
+    TransactionQuery, apply_transaction, describe_transaction
 )
+from wallet_store import create_wallet_store, idempotency_type, SETTLEMENT_TYPES
+from wallet_cache import WalletCache
+from leaderboard import create_leaderboard, LEADERBOARD_METRICS
+from shared_utils import metrics, log
 
+logger = log.get_logger('wallet_repository')
 
-# In-memory storage for development (replace with actual database in production)
-# This simulates Firebase Firestore or MongoDB
-wallets_db: Dict[str, Dict[str, Any]] = {}
-transactions_db: Dict[str, Dict[str, Any]] = {}
 
+WALLET_OPERATION_DURATION = metrics.histogram(
+    'wallet_operation_duration_seconds', 'Latency of wallet operations', ['operation', 'outcome'],
+    span_label='operation'
+)
+
+
+# Shared storage backend (SQLite/MongoDB) so every worker sees the same wallets
+wallet_store = create_wallet_store()
+try:
+    # Bring any wallet rows that fell behind the transaction log up to date
+    wallet_store.recover()
+except Exception as e:
+    logger.warning(f"Wallet recovery failed: {e}")
+wallet_cache = WalletCache(change_token=wallet_store.change_token)
+leaderboard = create_leaderboard(wallet_store.iter_wallets, wallet_store.change_token)
+
+
+def _load_wallet_data(user_id: str) -> Optional[Dict[str, Any]]:
+    """Read a wallet dict through the hot-wallet cache."""
+    wallet_data = wallet_cache.get(user_id)
+    if wallet_data is None:
+        wallet_data = wallet_store.get_wallet(user_id)
+        if wallet_data:
+            wallet_cache.put(user_id, wallet_data)
+    return wallet_data
+
+
+def _update_leaderboard(wallet_data: Dict[str, Any]):
+    """Push a wallet's new scores to the leaderboard without failing the write."""
+    try:
+        leaderboard.update(wallet_data)
+    except Exception as e:
+        logger.warning(f"Leaderboard update failed: {e}")
+
+
+class SettlementConflict(ValueError):
+    """A bet was already settled with the other outcome."""
+
+
+class BetConflict(ValueError):
+    """A bet_id was already placed with a different stake."""
+
+
+def _check_placed_stake(record: Dict[str, Any], bet_id: str, amount: float):
+    """Raise BetConflict if a placed bet's stake differs from amount."""
+    if abs((record['transaction'].get('stake') or 0) - amount) > 0.005:
+        raise BetConflict(f"Bet {bet_id} was already placed with a different stake")
+
+
+def _lookup_processed(lookup, bet_id: str, transaction_type: str,
+                      stake: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Idempotency record of a bet transaction already committed, or None.
+    
+    Raises:
+        SettlementConflict: If the bet was settled with the other outcome
+        BetConflict: If a stake is given and the bet was placed with another
+    """
+    record = lookup(bet_id, idempotency_type(transaction_type))
+    if record is None and transaction_type in SETTLEMENT_TYPES:
+        # Keys written before wins and losses shared one key carry the
+        # transaction type; they expire after WALLET_IDEMPOTENCY_TTL_SECONDS
+        record = lookup(bet_id, 'bet_won') or lookup(bet_id, 'bet_lost')
+    if record and record['transaction']['type'] != transaction_type:
+        raise SettlementConflict(
+            f"Bet {bet_id} was already settled as {record['transaction']['type']}"
+        )
+    if record and stake is not None:
+        _check_placed_stake(record, bet_id, stake)
+    return record
+
+
+def _mutate_wallet(user_id: str, mutation: Callable[[Wallet], Optional[Transaction]],
+                   idempotency_key: Optional[Tuple[str, str]] = None,
+                   stake: Optional[float] = None) -> Wallet:
+    """
+    Apply a mutation to a wallet atomically.
+    
+    The store runs the mutation under a per-user lock/transaction, so the
+    balance checks inside it cannot race, and commits the wallet update
+    together with the transaction record the mutation returns.
+    
+    Args:
+        user_id: Firebase user ID
+        mutation: Function that updates the Wallet in place and returns the
+            Transaction to record (or None)
+        idempotency_key: Optional (bet_id, transaction type). If it was already
+            processed, the wallet is left untouched and the wallet as returned
+            by the original request is returned again.
+        stake: Stake the processed bet must have been placed with
+    
+    Returns:
+        Updated Wallet object
+    
+    Raises:
+        SettlementConflict: If a win is recorded for a lost bet or vice versa
+        BetConflict: If the processed bet was placed with another stake
+    """
+    replayed = {}
+
+    def apply(wallet_data: Dict[str, Any], lookup):
+        if idempotency_key:
+            record = _lookup_processed(lookup, *idempotency_key, stake=stake)
+            if record:
+                replayed['wallet'] = record['wallet']
+                return None, []
+        wallet = dict_to_wallet(wallet_data)
+        transaction = mutation(wallet)
+        return wallet_to_dict(wallet), [transaction_to_dict(transaction)] if transaction else []
+
+    wallet_cache.invalidate(user_id)
+    wallet_data = wallet_store.mutate_wallet(user_id, apply)
+    wallet_cache.put(user_id, wallet_data)
+    _update_leaderboard(wallet_data)
+    return dict_to_wallet(replayed.get('wallet', wallet_data))
 
+
+def _record_event(wallet: Wallet, type: str, amount: float, bet_id: Optional[str],
+                  description: Optional[str] = None, stake: Optional[float] = None,
+                  balance_after: Optional[float] = None) -> Transaction:
+    """
+    Create the next transaction for a wallet and project it onto the wallet.
+    
+    Args:
+        wallet: Wallet to update in place
+        type: Transaction type
+        amount: Change in balance
+        bet_id: Bet identifier, if any
+        description: Human-readable description (defaults to the standard
+            one for the type, see describe_transaction)
+        stake: Amount wagered (bet_placed / bet_lost)
+        balance_after: Exact resulting balance when it is set rather than
+            adjusted (defaults to balance + amount)
+    
+    Returns:
+        The recorded Transaction
+    """
+    balance_after = wallet.balance + amount if balance_after is None else balance_after
+    if description is None:
+        description = describe_transaction(type, amount, stake, balance_after)
+    transaction = Transaction(
+        transaction_id=str(uuid.uuid4()),
+        user_id=wallet.user_id,
+        type=type,
+        amount=amount,
+        balance_before=wallet.balance,
+        balance_after=balance_after,
+        bet_id=bet_id,
+        description=description,
+        created_at=datetime.utcnow().isoformat(),
+        seq=wallet.event_seq + 1,
+        stake=stake
+    )
+    apply_transaction(wallet, transaction)
+    return transaction
+
+
+def _apply_bet_won(wallet: Wallet, payout: float, bet_id: str) -> Transaction:
+    """Add a payout to the wallet and return the bet_won transaction."""
+    return _record_event(wallet, 'bet_won', payout, bet_id)
+
+
+def _apply_bet_lost(wallet: Wallet, amount_lost: float, bet_id: str) -> Transaction:
+    """Record a lost stake on the wallet and return the bet_lost transaction."""
+    return _record_event(
+        wallet, 'bet_lost', 0.0, bet_id, stake=amount_lost
+    )
+
+
+# Settlement outcome -> (transaction type, function applying it to a wallet)
+SETTLEMENT_OUTCOMES = {
+    'won': ('bet_won', _apply_bet_won),
+    'lost': ('bet_lost', _apply_bet_lost),
+}
+
+
+@metrics.timed(WALLET_OPERATION_DURATION, 'get_wallet_by_user_id')
 def get_wallet_by_user_id(user_id: str) -> Optional[Wallet]:
     """
     Retrieve wallet for a specific user.
@@ -29,12 +207,13 @@ def get_wallet_by_user_id(user_id: str) -> Optional[Wallet]:
     Returns:
         Wallet object if found, None otherwise
     """
-    wallet_data = wallets_db.get(user_id)
+    wallet_data = _load_wallet_data(user_id)
     if wallet_data:
         return dict_to_wallet(wallet_data)
     return None
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'create_wallet')
 def create_wallet(user_id: str, challenge_type: str, custom_balance: Optional[float] = None) -> Wallet:
     """
     Create a new wallet for a user.
@@ -53,26 +232,20 @@ def create_wallet(user_id: str, challenge_type: str, custom_balance: Optional[fl
         raise ValueError("Wallet already exists for this user")
     
     wallet = create_new_wallet(user_id, challenge_type, custom_balance)
-    wallets_db[user_id] = wallet_to_dict(wallet)
     
-    # Create initial transaction
-    transaction_id = str(uuid.uuid4())
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        user_id=user_id,
-        type='challenge_start',
-        amount=wallet.starting_balance,
-        balance_before=0.0,
-        balance_after=wallet.starting_balance,
-        bet_id=None,
-        description=f"Started {CHALLENGE_CONFIGS[challenge_type].display_name}",
-        created_at=datetime.utcnow().isoformat()
+    # Initial transaction: the wallet starts empty and is funded by event #1
+    wallet.balance = 0.0
+    transaction = _record_event(
+        wallet, 'challenge_start', wallet.starting_balance, None,
+        f"Started {CHALLENGE_CONFIGS[challenge_type].display_name}"
     )
-    transactions_db[transaction_id] = transaction_to_dict(transaction)
+    wallet_store.insert_wallet(wallet_to_dict(wallet), transaction_to_dict(transaction))
+    _update_leaderboard(wallet_to_dict(wallet))
     
     return wallet
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'update_wallet_balance')
 def update_wallet_balance(user_id: str, new_balance: float) -> Wallet:
     """
     Update wallet balance.
@@ -84,17 +257,16 @@ def update_wallet_balance(user_id: str, new_balance: float) -> Wallet:
     Returns:
         Updated Wallet object
     """
-    wallet_data = wallets_db.get(user_id)
-    if not wallet_data:
-        raise ValueError("Wallet not found")
-    
-    wallet_data['balance'] = new_balance
-    wallet_data['updated_at'] = datetime.utcnow().isoformat()
-    wallets_db[user_id] = wallet_data
+    def apply(wallet: Wallet) -> Transaction:
+        return _record_event(
+            wallet, 'balance_adjustment', new_balance - wallet.balance, None,
+            balance_after=new_balance
+        )
     
-    return dict_to_wallet(wallet_data)
+    return _mutate_wallet(user_id, apply)
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'record_bet_placed')
 def record_bet_placed(user_id: str, bet_amount: float, bet_id: str) -> Wallet:
     """
     Record a bet placement and deduct from balance.
@@ -106,43 +278,79 @@ def record_bet_placed(user_id: str, bet_amount: float, bet_id: str) -> Wallet:
     
     Returns:
         Updated Wallet object
-    """
-    wallet_data = wallets_db.get(user_id)
-    if not wallet_data:
-        raise ValueError("Wallet not found")
     
-    wallet = dict_to_wallet(wallet_data)
-    
-    if wallet.balance < bet_amount:
-        raise ValueError("Insufficient balance")
+    Raises:
+        BetConflict: If bet_id was already placed with a different stake
+    """
+    def apply(wallet: Wallet) -> Transaction:
+        if wallet.balance < bet_amount:
+            raise ValueError("Insufficient balance")
+        
+        return _record_event(
+            wallet, 'bet_placed', -bet_amount, bet_id, stake=bet_amount
+        )
+    
+    return _mutate_wallet(user_id, apply, idempotency_key=(bet_id, 'bet_placed'), stake=bet_amount)
+
+
+@metrics.timed(WALLET_OPERATION_DURATION, 'record_bets_placed')
+def record_bets_placed(user_id: str, bets: List[Dict[str, Any]]) -> Wallet:
+    """
+    Record every bet of a slip in one atomic wallet update.
     
-    # Update wallet
-    balance_before = wallet.balance
-    wallet.balance -= bet_amount
-    wallet.total_wagered += bet_amount
-    wallet.bets_placed += 1
-    wallet.updated_at = datetime.utcnow().isoformat()
+    Either all new bets are placed or none are. Bets whose bet_id was already
+    placed are skipped, so a retried slip is not charged twice. A retry with a
+    different stake for a placed bet_id is refused.
     
-    wallets_db[user_id] = wallet_to_dict(wallet)
+    Args:
+        user_id: Firebase user ID
+        bets: List of dicts with bet_id and bet_amount
     
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        user_id=user_id,
-        type='bet_placed',
-        amount=-bet_amount,
-        balance_before=balance_before,
-        balance_after=wallet.balance,
-        bet_id=bet_id,
-        description=f"Placed bet of ${bet_amount:.2f}",
-        created_at=datetime.utcnow().isoformat()
-    )
-    transactions_db[transaction_id] = transaction_to_dict(transaction)
+    Returns:
+        Updated Wallet object
     
-    return wallet
+    Raises:
+        BetConflict: If a bet_id was already placed with a different stake
+    """
+    legs = []
+    for bet in bets:
+        try:
+            amount = float(bet.get('bet_amount') or 0)
+        except (TypeError, ValueError):
+            amount = 0.0
+        if not bet.get('bet_id') or amount <= 0:
+            raise ValueError("Each bet needs a bet_id and a positive bet_amount")
+        legs.append((bet['bet_id'], amount))
+    if len({bet_id for bet_id, _ in legs}) != len(legs):
+        raise ValueError("Duplicate bet_id in slip")
+    
+    def apply(wallet_data: Dict[str, Any], lookup):
+        new_legs = []
+        for bet_id, amount in legs:
+            record = lookup(bet_id, 'bet_placed')
+            if record is None:
+                new_legs.append((bet_id, amount))
+            else:
+                _check_placed_stake(record, bet_id, amount)
+        if not new_legs:
+            return None, []
+        wallet = dict_to_wallet(wallet_data)
+        if wallet.balance < sum(amount for _, amount in new_legs):
+            raise ValueError("Insufficient balance")
+        transactions = [
+            transaction_to_dict(_record_event(wallet, 'bet_placed', -amount, bet_id, stake=amount))
+            for bet_id, amount in new_legs
+        ]
+        return wallet_to_dict(wallet), transactions
+    
+    wallet_cache.invalidate(user_id)
+    wallet_data = wallet_store.mutate_wallet(user_id, apply)
+    wallet_cache.put(user_id, wallet_data)
+    _update_leaderboard(wallet_data)
+    return dict_to_wallet(wallet_data)
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'record_bet_won')
 def record_bet_won(user_id: str, payout: float, bet_id: str) -> Wallet:
     """
     Record a winning bet and add payout to balance.
@@ -155,38 +363,14 @@ def record_bet_won(user_id: str, payout: float, bet_id: str) -> Wallet:
     Returns:
         Updated Wallet object
     """
-    wallet_data = wallets_db.get(user_id)
-    if not wallet_data:
-        raise ValueError("Wallet not found")
-    
-    wallet = dict_to_wallet(wallet_data)
-    
-    balance_before = wallet.balance
-    wallet.balance += payout
-    wallet.total_won += payout
-    wallet.bets_won += 1
-    wallet.updated_at = datetime.utcnow().isoformat()
-    
-    wallets_db[user_id] = wallet_to_dict(wallet)
-    
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        user_id=user_id,
-        type='bet_won',
-        amount=payout,
-        balance_before=balance_before,
-        balance_after=wallet.balance,
-        bet_id=bet_id,
-        description=f"Bet won: +${payout:.2f}",
-        created_at=datetime.utcnow().isoformat()
+    return _mutate_wallet(
+        user_id,
+        lambda wallet: _apply_bet_won(wallet, payout, bet_id),
+        idempotency_key=(bet_id, 'bet_won')
     )
-    transactions_db[transaction_id] = transaction_to_dict(transaction)
-    
-    return wallet
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'record_bet_lost')
 def record_bet_lost(user_id: str, amount_lost: float, bet_id: str) -> Wallet:
     """
     Record a losing bet (balance already deducted on placement).
@@ -199,58 +383,137 @@ def record_bet_lost(user_id: str, amount_lost: float, bet_id: str) -> Wallet:
     Returns:
         Updated Wallet object
     """
-    wallet_data = wallets_db.get(user_id)
-    if not wallet_data:
-        raise ValueError("Wallet not found")
-    
-    wallet = dict_to_wallet(wallet_data)
+    return _mutate_wallet(
+        user_id,
+        lambda wallet: _apply_bet_lost(wallet, amount_lost, bet_id),
+        idempotency_key=(bet_id, 'bet_lost')
+    )
+
+
+@metrics.timed(WALLET_OPERATION_DURATION, 'settle_bets')
+def settle_bets(settlements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Settle many bets in one pass.
     
-    wallet.total_lost += amount_lost
-    wallet.bets_lost += 1
-    wallet.updated_at = datetime.utcnow().isoformat()
+    Items are grouped by user and each user's items are applied in a single
+    atomic mutation, so a wallet is read and written once per batch instead
+    of once per bet. Bets that were already settled with the same outcome
+    are not applied again; their original result is returned with
+    "duplicate": true. Bets already settled with the other outcome are
+    returned with status "conflict".
     
-    wallets_db[user_id] = wallet_to_dict(wallet)
+    Args:
+        settlements: List of dicts with user_id, bet_id, outcome ('won' or 'lost')
+            and amount (payout for wins, stake for losses)
     
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        user_id=user_id,
-        type='bet_lost',
-        amount=0.0,
-        balance_before=wallet.balance,
-        balance_after=wallet.balance,
-        bet_id=bet_id,
-        description=f"Bet lost: -${amount_lost:.2f}",
-        created_at=datetime.utcnow().isoformat()
+    Returns:
+        One result dict per input item, in input order
+    """
+    results: List[Dict[str, Any]] = []
+    by_user: Dict[str, List[int]] = {}
+    
+    for index, item in enumerate(settlements):
+        result = {
+            "user_id": item.get('user_id'),
+            "bet_id": item.get('bet_id'),
+            "outcome": item.get('outcome'),
+            "status": "error"
+        }
+        results.append(result)
+        try:
+            amount = float(item.get('amount') or 0)
+        except (TypeError, ValueError):
+            amount = 0.0
+        if not result['user_id'] or not result['bet_id']:
+            result['error'] = "user_id and bet_id are required"
+        elif result['outcome'] not in SETTLEMENT_OUTCOMES:
+            result['error'] = f"outcome must be one of {', '.join(SETTLEMENT_OUTCOMES)}"
+        elif amount <= 0:
+            result['error'] = "amount must be a positive number"
+        else:
+            result['amount'] = amount
+            by_user.setdefault(result['user_id'], []).append(index)
+    
+    def user_mutation(indexes: List[int]):
+        def apply(wallet_data: Dict[str, Any], lookup):
+            wallet = dict_to_wallet(wallet_data)
+            transactions = []
+            applied: Dict[str, Dict[str, Any]] = {}
+            for index in indexes:
+                result = results[index]
+                transaction_type, apply_outcome = SETTLEMENT_OUTCOMES[result['outcome']]
+                original = applied.get(result['bet_id'])
+                try:
+                    if original and original['transaction']['type'] != transaction_type:
+                        raise SettlementConflict(
+                            f"Bet {result['bet_id']} was already settled as {original['transaction']['type']}"
+                        )
+                    original = original or _lookup_processed(lookup, result['bet_id'], transaction_type)
+                except SettlementConflict as e:
+                    result['status'] = "conflict"
+                    result['error'] = str(e)
+                    continue
+                if original:
+                    result['duplicate'] = True
+                    result['balance_after'] = original['transaction']['balance_after']
+                    continue
+                transaction = transaction_to_dict(
+                    apply_outcome(wallet, result['amount'], result['bet_id'])
+                )
+                transactions.append(transaction)
+                applied[result['bet_id']] = {'transaction': transaction}
+                result['balance_after'] = transaction['balance_after']
+            if not transactions:
+                return None, []
+            return wallet_to_dict(wallet), transactions
+        return apply
+    
+    for user_id in by_user:
+        wallet_cache.invalidate(user_id)
+    outcomes = wallet_store.mutate_wallets(
+        {user_id: user_mutation(indexes) for user_id, indexes in by_user.items()}
     )
-    transactions_db[transaction_id] = transaction_to_dict(transaction)
     
-    return wallet
+    for user_id, indexes in by_user.items():
+        outcome = outcomes[user_id]
+        for index in indexes:
+            result = results[index]
+            del result['amount']
+            if isinstance(outcome, Exception):
+                result['status'] = "error"
+                result['error'] = str(outcome)
+                result.pop('balance_after', None)
+                result.pop('duplicate', None)
+            elif result['status'] != "conflict":
+                result['status'] = "settled"
+        if not isinstance(outcome, Exception):
+            wallet_cache.put(user_id, outcome)
+            _update_leaderboard(outcome)
+    
+    return results
 
 
-def get_transactions_by_user_id(user_id: str, limit: int = 50) -> List[Transaction]:
+@metrics.timed(WALLET_OPERATION_DURATION, 'get_transactions_by_user_id')
+def get_transactions_by_user_id(user_id: str, limit: int = 50,
+                                query: Optional[TransactionQuery] = None) -> List[Dict[str, Any]]:
     """
-    Get transaction history for a user.
+    Get transaction history for a user, most recent first.
     
     Args:
         user_id: Firebase user ID
         limit: Maximum number of transactions to return
+        query: Optional page request (cursors, type/bet_id filters, date range);
+            its limit takes precedence over the limit argument
     
     Returns:
-        List of Transaction objects
+        List of transaction dicts (only the page is materialized, ready for JSON)
     """
-    user_transactions = [
-        dict_to_transaction(t) for t in transactions_db.values()
-        if t['user_id'] == user_id
-    ]
-    
-    # Sort by created_at descending (most recent first)
-    user_transactions.sort(key=lambda t: t.created_at, reverse=True)
-    
-    return user_transactions[:limit]
+    # Per-user ordered index: cost depends on page size, not history depth
+    query = query or TransactionQuery(limit=limit)
+    return wallet_store.query_transactions(user_id, query)
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'reset_wallet')
 def reset_wallet(user_id: str) -> Wallet:
     """
     Reset a wallet to its starting balance and clear stats.
@@ -261,40 +524,66 @@ def reset_wallet(user_id: str) -> Wallet:
     Returns:
         Reset Wallet object
     """
-    wallet_data = wallets_db.get(user_id)
-    if not wallet_data:
-        raise ValueError("Wallet not found")
-    
-    wallet = dict_to_wallet(wallet_data)
+    def apply(wallet: Wallet) -> Transaction:
+        return _record_event(
+            wallet, 'wallet_reset', wallet.starting_balance - wallet.balance, None,
+            balance_after=wallet.starting_balance
+        )
     
-    # Reset to starting balance
-    balance_before = wallet.balance
-    wallet.balance = wallet.starting_balance
-    wallet.total_wagered = 0.0
-    wallet.total_won = 0.0
-    wallet.total_lost = 0.0
-    wallet.bets_placed = 0
-    wallet.bets_won = 0
-    wallet.bets_lost = 0
-    wallet.updated_at = datetime.utcnow().isoformat()
-    
-    wallets_db[user_id] = wallet_to_dict(wallet)
+    return _mutate_wallet(user_id, apply)
+
+
+@metrics.timed(WALLET_OPERATION_DURATION, 'rebuild_wallet')
+def rebuild_wallet(user_id: str) -> Wallet:
+    """
+    Recompute a wallet from its latest snapshot and the transactions after it.
     
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    transaction = Transaction(
-        transaction_id=transaction_id,
-        user_id=user_id,
-        type='balance_adjustment',
-        amount=wallet.starting_balance - balance_before,
-        balance_before=balance_before,
-        balance_after=wallet.balance,
-        bet_id=None,
-        description="Wallet reset to starting balance",
-        created_at=datetime.utcnow().isoformat()
-    )
-    transactions_db[transaction_id] = transaction_to_dict(transaction)
+    Args:
+        user_id: Firebase user ID
     
-    return wallet
+    Returns:
+        Rebuilt Wallet object
+    """
+    wallet_data = wallet_store.rebuild_wallet(user_id)
+    if not wallet_data:
+        raise ValueError("Wallet not found")
+    wallet_cache.invalidate(user_id)
+    _update_leaderboard(wallet_data)
+    return dict_to_wallet(wallet_data)
 
 
+@metrics.timed(WALLET_OPERATION_DURATION, 'get_leaderboard')
+def get_leaderboard(challenge_type: str, metric: str = 'balance', limit: int = 10,
+                    user_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get the ranking for a challenge type.
+    
+    Args:
+        challenge_type: Challenge type to rank
+        metric: 'balance', 'roi' or 'progress' (progress needs a target balance)
+        limit: Number of top entries to return
+        user_id: Optional user whose own rank should be included
+    
+    Returns:
+        Dict with the top entries and, if requested, the user's rank
+    """
+    if challenge_type not in CHALLENGE_CONFIGS:
+        raise ValueError(f"Invalid challenge type: {challenge_type}")
+    if metric not in LEADERBOARD_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(LEADERBOARD_METRICS)}")
+    
+    entries = [
+        {"rank": position, "user_id": entry_user_id, "score": score}
+        for position, (entry_user_id, score) in enumerate(
+            leaderboard.top(challenge_type, metric, limit), start=1
+        )
+    ]
+    result: Dict[str, Any] = {
+        "challenge_type": challenge_type,
+        "metric": metric,
+        "entries": entries
+    }
+    if user_id:
+        ranked = leaderboard.rank(challenge_type, metric, user_id)
+        result["user"] = {"user_id": user_id, "rank": ranked[0], "score": ranked[1]} if ranked else None
+    return result
@@ -2,10 +2,11 @@
 Wallet and challenge schemas for user balance management.
 """
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from enum import Enum
+import base64
 
 
 class ChallengeType(str, Enum):
@@ -85,20 +86,54 @@ class Wallet:
     bets_placed: int = 0
     bets_won: int = 0
     bets_lost: int = 0
+    event_seq: int = 0  # seq of the last transaction applied to this wallet
 
 
 @dataclass
 class Transaction:
-    """Record of a wallet transaction"""
+    """
+    Record of a wallet transaction.
+    Transactions are the source of truth: a wallet is the result of applying its
+    transactions in seq order (see apply_transaction).
+    """
     transaction_id: str
     user_id: str
-    type: str  # 'bet_placed', 'bet_won', 'bet_lost', 'challenge_start', 'balance_adjustment'
-    amount: float
+    type: str  # 'bet_placed', 'bet_won', 'bet_lost', 'challenge_start', 'balance_adjustment', 'wallet_reset'
+    amount: float  # change in balance
     balance_before: float
     balance_after: float
     bet_id: Optional[str]
     description: str
     created_at: str
+    seq: int = 0  # per-user event sequence number, starting at 1
+    stake: Optional[float] = None  # amount wagered, for bet_placed and bet_lost
+
+
+@dataclass
+class TransactionQuery:
+    """
+    Page request for a user's transaction history (most recent first).
+    Cursors are (created_at, transaction_id) positions from decode_transaction_cursor.
+    """
+    limit: int = 50
+    before: Optional[Tuple[str, str]] = None  # strictly older than this position
+    after: Optional[Tuple[str, str]] = None   # strictly newer than this position
+    type: Optional[str] = None
+    bet_id: Optional[str] = None
+    start: Optional[str] = None  # created_at >= start (ISO timestamp)
+    end: Optional[str] = None    # created_at < end (ISO timestamp)
+
+    def matches(self, transaction: Dict[str, Any]) -> bool:
+        """Check the non-positional filters (type, bet_id, date range)."""
+        if self.type is not None and transaction['type'] != self.type:
+            return False
+        if self.bet_id is not None and transaction['bet_id'] != self.bet_id:
+            return False
+        if self.start is not None and transaction['created_at'] < self.start:
+            return False
+        if self.end is not None and transaction['created_at'] >= self.end:
+            return False
+        return True
 
 
 def wallet_to_dict(wallet: Wallet) -> Dict[str, Any]:
@@ -121,6 +156,77 @@ def dict_to_transaction(data: Dict[str, Any]) -> Transaction:
     return Transaction(**data)
 
 
+def encode_transaction_cursor(transaction: Dict[str, Any]) -> str:
+    """Encode a transaction's (created_at, transaction_id) position as an opaque cursor"""
+    raw = f"{transaction['created_at']}|{transaction['transaction_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_transaction_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor from encode_transaction_cursor. Raises ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, transaction_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+        return created_at, transaction_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def describe_transaction(type: str, amount: float, stake: Optional[float],
+                         balance_after: float) -> Optional[str]:
+    """
+    Standard description of a transaction, derived from its other fields.
+    
+    Returns:
+        The description, or None for types without a fixed template
+    """
+    if type == 'bet_placed':
+        return f"Placed bet of ${stake or 0.0:.2f}"
+    if type == 'bet_won':
+        return f"Bet won: +${amount:.2f}"
+    if type == 'bet_lost':
+        return f"Bet lost: -${stake or 0.0:.2f}"
+    if type == 'balance_adjustment':
+        return f"Balance set to ${balance_after:.2f}"
+    if type == 'wallet_reset':
+        return "Wallet reset to starting balance"
+    return None
+
+
+def apply_transaction(wallet: Wallet, transaction: Transaction) -> Wallet:
+    """
+    Project a transaction onto a wallet (in place).
+    Replaying a wallet's transactions in seq order from a snapshot rebuilds it.
+    
+    Args:
+        wallet: Wallet state as of transaction.seq - 1
+        transaction: Next transaction for this wallet
+    
+    Returns:
+        The same Wallet, updated
+    """
+    wallet.balance = transaction.balance_after
+    if transaction.type == 'bet_placed':
+        wallet.total_wagered += transaction.stake or 0.0
+        wallet.bets_placed += 1
+    elif transaction.type == 'bet_won':
+        wallet.total_won += transaction.amount
+        wallet.bets_won += 1
+    elif transaction.type == 'bet_lost':
+        wallet.total_lost += transaction.stake or 0.0
+        wallet.bets_lost += 1
+    elif transaction.type == 'wallet_reset':
+        wallet.total_wagered = 0.0
+        wallet.total_won = 0.0
+        wallet.total_lost = 0.0
+        wallet.bets_placed = 0
+        wallet.bets_won = 0
+        wallet.bets_lost = 0
+    wallet.updated_at = transaction.created_at
+    wallet.event_seq = transaction.seq
+    return wallet
+
+
 def create_new_wallet(user_id: str, challenge_type: str, custom_balance: Optional[float] = None) -> Wallet:
     """
     Create a new wallet for a user based on challenge type.
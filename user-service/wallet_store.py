@@ -0,0 +1,950 @@
+"""
+Storage backends for wallets and transactions.
+
+The repository layer talks to a WalletStore instead of module-level dicts so
+that every gunicorn worker (and every Cloud Run instance) sees the same state.
+
+Backends:
+    - memory: process-local state (single worker only), optionally made
+              durable by an append-only log (WALLET_WAL_PATH, see wallet_wal)
+    - sqlite: embedded SQLite file in WAL mode, shared by all workers on a host
+    - mongo:  MongoDB collections, shared by all instances
+
+Select the backend with WALLET_STORE (default: sqlite).
+
+Transactions are the source of truth. Each one carries a per-user seq and the
+wallet row is a projection of the log (see wallet_schemas.apply_transaction),
+snapshotted every WALLET_SNAPSHOT_EVERY events. A wallet can always be rebuilt
+from its latest snapshot plus the transactions after it.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Callable, Tuple, Iterable
+from transaction_columns import TransactionColumns
+from wallet_wal import WriteAheadLog, WALLET_WAL_PATH, WALLET_WAL_CHECKPOINT_RECORDS
+from wallet_schemas import (
+    TransactionQuery, apply_transaction, dict_to_wallet, dict_to_transaction, wallet_to_dict
+)
+from shared_utils import log
+
+logger = log.get_logger('wallet_store')
+
+# Storage configuration
+WALLET_STORE = os.getenv('WALLET_STORE', 'sqlite').lower()
+WALLET_SQLITE_PATH = os.getenv('WALLET_SQLITE_PATH', '/tmp/neuralbets_wallets.db')
+MONGO_URI = os.getenv('MONGO_CONNECTION_STRING', None)
+WALLET_MONGO_DB = os.getenv('WALLET_MONGO_DB', 'betting_users_db')
+
+WALLET_FIELDS = [
+    'user_id', 'balance', 'challenge_type', 'starting_balance', 'target_balance',
+    'created_at', 'updated_at', 'total_wagered', 'total_won', 'total_lost',
+    'bets_placed', 'bets_won', 'bets_lost', 'event_seq'
+]
+TRANSACTION_FIELDS = [
+    'transaction_id', 'user_id', 'type', 'amount', 'balance_before',
+    'balance_after', 'bet_id', 'description', 'created_at', 'seq', 'stake'
+]
+MEMORY_LOCK_STRIPES = 64
+
+# Win and loss of a bet share the idempotency key type 'settle', so a bet
+# cannot be settled both ways
+SETTLEMENT_TYPES = ('bet_won', 'bet_lost')
+SETTLE_KEY_TYPE = 'settle'
+
+# Idempotency keys (user_id, bet_id, type) are remembered for this long
+WALLET_IDEMPOTENCY_TTL_SECONDS = int(os.getenv('WALLET_IDEMPOTENCY_TTL_SECONDS', 7 * 24 * 3600))
+WALLET_IDEMPOTENCY_MAX_KEYS = int(os.getenv('WALLET_IDEMPOTENCY_MAX_KEYS', 1000000))
+IDEMPOTENCY_PRUNE_EVERY = 1000
+
+# A wallet snapshot is written every N events, bounding replay on rebuild to N
+WALLET_SNAPSHOT_EVERY = max(int(os.getenv('WALLET_SNAPSHOT_EVERY', 100)), 1)
+
+# Transactions or idempotency entries per checkpoint record
+CHECKPOINT_CHUNK = 1000
+
+# Looks up a previously processed (bet_id, type) for the wallet being mutated.
+# Returns {'transaction': ..., 'wallet': ...} as recorded at commit, or None.
+IdempotencyLookup = Callable[[str, str], Optional[Dict[str, Any]]]
+
+# A mutation receives the current wallet dict and an IdempotencyLookup, and
+# returns the updated wallet dict plus the transactions to record with it.
+# Returning (None, []) leaves the wallet untouched. Raising aborts it.
+WalletMutation = Callable[
+    [Dict[str, Any], IdempotencyLookup],
+    Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]
+]
+
+
+def idempotency_type(transaction_type: str) -> str:
+    """Type part of the idempotency key of a transaction type."""
+    return SETTLE_KEY_TYPE if transaction_type in SETTLEMENT_TYPES else transaction_type
+
+
+def idempotency_records(wallet: Dict[str, Any], transactions: List[Dict[str, Any]]):
+    """Yield ((user_id, bet_id, key type), record) for each bet transaction being committed."""
+    for transaction in transactions:
+        if transaction.get('bet_id'):
+            key = (transaction['user_id'], transaction['bet_id'], idempotency_type(transaction['type']))
+            yield key, {'transaction': transaction, 'wallet': wallet}
+
+
+def snapshot_due(previous_seq: int, seq: int) -> bool:
+    """True if a mutation moving a wallet from previous_seq to seq crossed a snapshot boundary."""
+    return seq // WALLET_SNAPSHOT_EVERY > previous_seq // WALLET_SNAPSHOT_EVERY
+
+
+def project_wallet(snapshot: Dict[str, Any], transactions: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Replay transactions on top of a wallet snapshot.
+    
+    Args:
+        snapshot: Wallet dict as of snapshot['event_seq']
+        transactions: The user's transactions; those at or before the snapshot are skipped
+    
+    Returns:
+        The projected wallet dict
+    """
+    wallet = dict_to_wallet(dict(snapshot))
+    for transaction in sorted(transactions, key=lambda t: t['seq']):
+        if transaction['seq'] <= wallet.event_seq:
+            continue
+        if transaction['seq'] != wallet.event_seq + 1:
+            raise ValueError(
+                f"Gap in transaction log for {wallet.user_id}: "
+                f"expected seq {wallet.event_seq + 1}, found {transaction['seq']}"
+            )
+        apply_transaction(wallet, dict_to_transaction(transaction))
+    return wallet_to_dict(wallet)
+
+
+class WalletStore:
+    """
+    Interface every wallet storage backend implements.
+    Wallets and transactions are exchanged as plain dicts (see wallet_schemas).
+    """
+
+    def get_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def iter_wallets(self) -> Iterable[Dict[str, Any]]:
+        """Iterate over every wallet (used to seed derived indexes)."""
+        raise NotImplementedError
+
+    def insert_wallet(self, wallet: Dict[str, Any], transaction: Dict[str, Any]) -> None:
+        """Insert a new wallet with its opening transaction. Raises ValueError if it exists."""
+        raise NotImplementedError
+
+    def mutate_wallet(self, user_id: str, mutation: WalletMutation) -> Dict[str, Any]:
+        """
+        Atomically read-modify-write a wallet. Concurrent mutations of the same
+        wallet are serialized and the wallet update commits together with its
+        transactions and their idempotency records. Raises ValueError if the
+        wallet does not exist.
+        """
+        raise NotImplementedError
+
+    def mutate_wallets(self, mutations: Dict[str, WalletMutation]) -> Dict[str, Any]:
+        """
+        Apply one mutation per user. Each user's mutation is atomic on its own;
+        a failure for one user does not affect the others.
+        
+        Returns:
+            Dict of user_id -> updated wallet dict, or the exception raised
+        """
+        results = {}
+        for user_id, mutation in mutations.items():
+            try:
+                results[user_id] = self.mutate_wallet(user_id, mutation)
+            except Exception as e:
+                results[user_id] = e
+        return results
+
+    def query_transactions(self, user_id: str, query: TransactionQuery) -> List[Dict[str, Any]]:
+        """
+        Return one page of the user's transactions ordered by
+        (created_at, transaction_id), most recent first.
+        """
+        raise NotImplementedError
+
+    def change_token(self) -> Optional[Any]:
+        """
+        Cheap value that changes whenever another process commits a write.
+        Used by WalletCache for cross-process invalidation. None = not supported.
+        """
+        return None
+
+    def rebuild_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Recompute a wallet from its latest snapshot and the transactions after
+        it, and store the result. Returns None if the user has no snapshot.
+        """
+        raise NotImplementedError
+
+    def find_stale_wallets(self) -> List[str]:
+        """User ids whose wallet row is behind their transaction log."""
+        return []
+
+    def recover(self) -> int:
+        """
+        Rebuild every stale wallet (run once at startup).
+        
+        Returns:
+            Number of wallets rebuilt
+        """
+        started = time.perf_counter()
+        stale = self.find_stale_wallets()
+        for user_id in stale:
+            self.rebuild_wallet(user_id)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if stale:
+            logger.info(f"Rebuilt {len(stale)} wallet(s) from the transaction log in {elapsed_ms:.1f}ms")
+        return len(stale)
+
+
+class MemoryWalletStore(WalletStore):
+    """
+    Process-local storage. State is not shared between workers.
+    Transactions are kept in a columnar log (see transaction_columns) with a
+    per-user time-ordered index for binary search by cursor.
+
+    Args:
+        wal: Optional write-ahead log. Its records are replayed on startup and
+            every write is applied only once its record is durable (or, in
+            async mode, appended). Once the log holds
+            WALLET_WAL_CHECKPOINT_RECORDS records, the next wallet snapshot
+            triggers a checkpoint of the whole store in the background.
+    """
+
+    def __init__(self, wal: Optional[WriteAheadLog] = None):
+        self.wallets: Dict[str, Dict[str, Any]] = {}
+        self.transactions = TransactionColumns()
+        # Latest wallet snapshot per user
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        # Striped locks: per-user serialization without a lock object per user
+        self._locks = [threading.Lock() for _ in range(MEMORY_LOCK_STRIPES)]
+        # (user_id, bet_id, type) -> (expires_at, record), oldest first
+        self._idempotency: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._idempotency_lock = threading.Lock()
+        self._wal = wal
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_due = threading.Event()
+        if wal is not None:
+            self._replay()
+            threading.Thread(target=self._checkpoint_loop, name='wallet-checkpoint', daemon=True).start()
+
+    def _replay(self):
+        started = time.perf_counter()
+        now = time.monotonic()
+        for record in self._wal.read_checkpoint():
+            if record['kind'] == 'wallet':
+                self.wallets[record['wallet']['user_id']] = record['wallet']
+                self.snapshots[record['wallet']['user_id']] = record['snapshot']
+            elif record['kind'] == 'transactions':
+                for transaction in record['rows']:
+                    self.transactions.append(transaction)
+            elif record['kind'] == 'idempotency':
+                for key, seconds_left, entry in record['entries']:
+                    self._idempotency[tuple(key)] = (now + seconds_left, entry)
+        count = 0
+        for record in self._wal.replay():
+            self._replay_record(record)
+            count += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(
+            f"Loaded {len(self.wallets)} wallet(s) from {self._wal.path} "
+            f"({count} log record(s) after the checkpoint) in {elapsed_ms:.1f}ms"
+        )
+        # Leave a short log for the next start
+        if self._wal.has_previous_segment or self._wal.records >= WALLET_WAL_CHECKPOINT_RECORDS:
+            self.checkpoint()
+
+    def _replay_record(self, record: Dict[str, Any]):
+        # A crash between writing a checkpoint and deleting the segment it
+        # replaces leaves records the checkpoint already holds. event_seq only
+        # grows, so a record no newer than the wallet in memory is skipped
+        wallet, transactions = record['wallet'], record['transactions']
+        current = self.wallets.get(wallet['user_id'])
+        if record['kind'] == 'insert':
+            if current is None:
+                self._apply_insert(wallet, transactions[0])
+            return
+        seq = wallet.get('event_seq', 0)
+        current_seq = current.get('event_seq', 0) if current else -1
+        if seq > current_seq or (seq == current_seq and not transactions):
+            self._apply_mutation(current or {}, wallet, transactions)
+
+    def checkpoint(self):
+        """
+        Write the whole store to the log's checkpoint and drop the log records
+        it covers. Writers are paused only while the state is copied and the
+        log switches to a new segment; the checkpoint is written after.
+        """
+        with self._checkpoint_lock:
+            started = time.perf_counter()
+            for lock in self._locks:
+                lock.acquire()
+            try:
+                wallets = dict(self.wallets)
+                snapshots = dict(self.snapshots)
+                # The transaction log is append-only: its first rows are stable
+                rows = len(self.transactions)
+                now = time.monotonic()
+                with self._idempotency_lock:
+                    idempotency = [
+                        [list(key), expires_at - now, entry]
+                        for key, (expires_at, entry) in self._idempotency.items() if expires_at > now
+                    ]
+                self._wal.rotate()
+            finally:
+                for lock in self._locks:
+                    lock.release()
+            self._wal.write_checkpoint(self._checkpoint_records(wallets, snapshots, rows, idempotency))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info(f"Checkpointed {len(wallets)} wallet(s) and {rows} transaction(s) in {elapsed_ms:.1f}ms")
+
+    def _checkpoint_records(self, wallets: Dict[str, Dict[str, Any]], snapshots: Dict[str, Dict[str, Any]],
+                            rows: int, idempotency: List[list]) -> Iterable[Dict[str, Any]]:
+        for user_id, wallet in wallets.items():
+            yield {'kind': 'wallet', 'wallet': wallet, 'snapshot': snapshots.get(user_id, wallet)}
+        for start in range(0, rows, CHECKPOINT_CHUNK):
+            yield {
+                'kind': 'transactions',
+                'rows': [self.transactions.materialize(row) for row in range(start, min(start + CHECKPOINT_CHUNK, rows))]
+            }
+        for start in range(0, len(idempotency), CHECKPOINT_CHUNK):
+            yield {'kind': 'idempotency', 'entries': idempotency[start:start + CHECKPOINT_CHUNK]}
+
+    def _request_checkpoint(self):
+        # Called under a user's lock when a wallet snapshot is taken; the
+        # checkpoint itself runs in the background thread
+        if self._wal is not None and self._wal.records >= WALLET_WAL_CHECKPOINT_RECORDS:
+            self._checkpoint_due.set()
+
+    def _checkpoint_loop(self):
+        while True:
+            self._checkpoint_due.wait()
+            self._checkpoint_due.clear()
+            if self._wal.records < WALLET_WAL_CHECKPOINT_RECORDS:
+                continue
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.exception(f"Could not checkpoint the wallet log: {e}")
+
+    def _log(self, kind: str, wallet: Dict[str, Any], transactions: List[Dict[str, Any]]) -> int:
+        # Called under the user's lock, so each user's records are in commit order
+        if self._wal is None:
+            return 0
+        return self._wal.append({'kind': kind, 'wallet': wallet, 'transactions': transactions})
+
+    def _wait_durable(self, lsn: int):
+        if self._wal is not None and lsn:
+            self._wal.wait(lsn)
+
+    @staticmethod
+    def _stripe(user_id: str) -> int:
+        return hash(user_id) % MEMORY_LOCK_STRIPES
+
+    def _lock_for(self, user_id: str) -> threading.Lock:
+        return self._locks[self._stripe(user_id)]
+
+    def _lookup_idempotent(self, user_id: str, bet_id: str, type: str) -> Optional[Dict[str, Any]]:
+        entry = self._idempotency.get((user_id, bet_id, type))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def _remember_idempotent(self, wallet: Dict[str, Any], transactions: List[Dict[str, Any]]):
+        now = time.monotonic()
+        with self._idempotency_lock:
+            for key, record in idempotency_records(wallet, transactions):
+                self._idempotency[key] = (now + WALLET_IDEMPOTENCY_TTL_SECONDS, record)
+                self._idempotency.move_to_end(key)
+            # Entries are ordered by insertion, so expired ones sit at the front
+            while self._idempotency:
+                expires_at, _ = next(iter(self._idempotency.values()))
+                if expires_at >= now and len(self._idempotency) <= WALLET_IDEMPOTENCY_MAX_KEYS:
+                    break
+                self._idempotency.popitem(last=False)
+
+    def get_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        wallet = self.wallets.get(user_id)
+        return dict(wallet) if wallet else None
+
+    def iter_wallets(self) -> Iterable[Dict[str, Any]]:
+        return [dict(w) for w in list(self.wallets.values())]
+
+    def _apply_insert(self, wallet: Dict[str, Any], transaction: Dict[str, Any]):
+        self.wallets[wallet['user_id']] = dict(wallet)
+        self.snapshots[wallet['user_id']] = dict(wallet)
+        self.transactions.append(transaction)
+
+    def _apply_mutation(self, current: Dict[str, Any], wallet: Dict[str, Any],
+                        transactions: List[Dict[str, Any]]):
+        self.wallets[wallet['user_id']] = dict(wallet)
+        for transaction in transactions:
+            self.transactions.append(transaction)
+        if snapshot_due(current.get('event_seq', 0), wallet.get('event_seq', 0)):
+            self.snapshots[wallet['user_id']] = dict(wallet)
+            self._request_checkpoint()
+        self._remember_idempotent(dict(wallet), transactions)
+
+    def insert_wallet(self, wallet: Dict[str, Any], transaction: Dict[str, Any]) -> None:
+        with self._lock_for(wallet['user_id']):
+            if wallet['user_id'] in self.wallets:
+                raise ValueError("Wallet already exists for this user")
+            self._wait_durable(self._log('insert', wallet, [transaction]))
+            self._apply_insert(wallet, transaction)
+
+    def _prepare(self, user_id: str, mutation: WalletMutation):
+        # Called under the user's lock. Returns (current, wallet, transactions,
+        # lsn), with wallet None if the mutation left the wallet untouched
+        current = self.wallets.get(user_id)
+        if not current:
+            raise ValueError("Wallet not found")
+        lookup = lambda bet_id, type: self._lookup_idempotent(user_id, bet_id, type)
+        wallet, transactions = mutation(dict(current), lookup)
+        if wallet is None:
+            return current, None, [], 0
+        return current, wallet, transactions, self._log('mutate', wallet, transactions)
+
+    def mutate_wallet(self, user_id: str, mutation: WalletMutation) -> Dict[str, Any]:
+        # A write is applied in memory only once its log record is durable, so
+        # no reader ever sees a write the log could lose. The wait holds only
+        # this user's lock stripe: writes to other wallets join the same group
+        # commit meanwhile
+        with self._lock_for(user_id):
+            current, wallet, transactions, lsn = self._prepare(user_id, mutation)
+            if wallet is None:
+                return dict(current)
+            self._wait_durable(lsn)
+            self._apply_mutation(current, wallet, transactions)
+            return dict(wallet)
+
+    def mutate_wallets(self, mutations: Dict[str, WalletMutation]) -> Dict[str, Any]:
+        # The lock stripes of every user in the batch are taken (in order, so
+        # batches cannot deadlock) for one durability wait for the whole batch
+        stripes = sorted({self._stripe(user_id) for user_id in mutations})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            results = {}
+            prepared = {}
+            last_lsn = 0
+            for user_id, mutation in mutations.items():
+                try:
+                    current, wallet, transactions, lsn = self._prepare(user_id, mutation)
+                except Exception as e:
+                    results[user_id] = e
+                    continue
+                if wallet is None:
+                    results[user_id] = dict(current)
+                else:
+                    prepared[user_id] = (current, wallet, transactions)
+                    last_lsn = max(last_lsn, lsn)
+            try:
+                self._wait_durable(last_lsn)
+            except Exception as e:
+                results.update((user_id, e) for user_id in prepared)
+                prepared = {}
+            for user_id, (current, wallet, transactions) in prepared.items():
+                self._apply_mutation(current, wallet, transactions)
+                results[user_id] = dict(wallet)
+            return {user_id: results[user_id] for user_id in mutations}
+        finally:
+            for stripe in stripes:
+                self._locks[stripe].release()
+
+    def rebuild_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock_for(user_id):
+            snapshot = self.snapshots.get(user_id)
+            if snapshot is None:
+                return None
+            wallet = project_wallet(snapshot, self.transactions.transactions_after(user_id, snapshot['event_seq']))
+            self._wait_durable(self._log('mutate', wallet, []))
+            self.wallets[user_id] = wallet
+        return dict(wallet)
+
+    def find_stale_wallets(self) -> List[str]:
+        stale = []
+        for user_id in self.transactions.user_ids():
+            wallet = self.wallets.get(user_id)
+            if wallet is None or wallet.get('event_seq', 0) < self.transactions.last_seq(user_id):
+                stale.append(user_id)
+        return stale
+
+    def query_transactions(self, user_id: str, query: TransactionQuery) -> List[Dict[str, Any]]:
+        return self.transactions.query(user_id, query)
+
+
+class SQLiteWalletStore(WalletStore):
+    """
+    Embedded SQLite storage in WAL mode.
+    Readers never block the writer, so all gunicorn workers on the same host can
+    share one database file. Connections are opened per thread and per process
+    (after the gunicorn fork).
+    """
+
+    def __init__(self, path: str = WALLET_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS wallets (
+                user_id TEXT PRIMARY KEY,
+                balance REAL NOT NULL,
+                challenge_type TEXT NOT NULL,
+                starting_balance REAL NOT NULL,
+                target_balance REAL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                total_wagered REAL NOT NULL DEFAULT 0,
+                total_won REAL NOT NULL DEFAULT 0,
+                total_lost REAL NOT NULL DEFAULT 0,
+                bets_placed INTEGER NOT NULL DEFAULT 0,
+                bets_won INTEGER NOT NULL DEFAULT 0,
+                bets_lost INTEGER NOT NULL DEFAULT 0,
+                event_seq INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS transactions (
+                transaction_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                balance_before REAL NOT NULL,
+                balance_after REAL NOT NULL,
+                bet_id TEXT,
+                description TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                stake REAL
+            );
+            DROP INDEX IF EXISTS idx_transactions_user_created;
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_created_id
+                ON transactions (user_id, created_at, transaction_id);
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                user_id TEXT NOT NULL,
+                bet_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                record TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (user_id, bet_id, type)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_idempotency_created
+                ON idempotency_keys (created_at);
+            CREATE TABLE IF NOT EXISTS wallet_snapshots (
+                user_id TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                wallet TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        self._migrate_schema(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_seq ON transactions (user_id, seq)")
+
+    def _migrate_schema(self, conn: sqlite3.Connection):
+        # Databases created before the event log gained seq/stake columns
+        for table, column, definition in (
+            ('wallets', 'event_seq', 'INTEGER NOT NULL DEFAULT 0'),
+            ('transactions', 'seq', 'INTEGER NOT NULL DEFAULT 0'),
+            ('transactions', 'stake', 'REAL'),
+        ):
+            columns = [row['name'] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        # Existing wallets become the baseline snapshot of their (seq 0) log
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM wallets WHERE user_id NOT IN (SELECT user_id FROM wallet_snapshots)"
+            ).fetchall()
+            for row in rows:
+                self._write_snapshot(conn, dict(row))
+
+    def _write_snapshot(self, conn: sqlite3.Connection, wallet: Dict[str, Any]):
+        conn.execute(
+            "INSERT OR REPLACE INTO wallet_snapshots (user_id, seq, wallet) VALUES (?, ?, ?)",
+            (wallet['user_id'], wallet['event_seq'], json.dumps(wallet))
+        )
+
+    def _insert_transaction(self, conn: sqlite3.Connection, transaction: Dict[str, Any]):
+        conn.execute(
+            f"INSERT INTO transactions ({', '.join(TRANSACTION_FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in TRANSACTION_FIELDS)})",
+            [transaction[f] for f in TRANSACTION_FIELDS]
+        )
+
+    def get_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT * FROM wallets WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def iter_wallets(self) -> Iterable[Dict[str, Any]]:
+        for row in self._connect().execute("SELECT * FROM wallets"):
+            yield dict(row)
+
+    def insert_wallet(self, wallet: Dict[str, Any], transaction: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    f"INSERT INTO wallets ({', '.join(WALLET_FIELDS)}) "
+                    f"VALUES ({', '.join('?' for _ in WALLET_FIELDS)})",
+                    [wallet[f] for f in WALLET_FIELDS]
+                )
+                self._insert_transaction(conn, transaction)
+                self._write_snapshot(conn, wallet)
+        except sqlite3.IntegrityError:
+            raise ValueError("Wallet already exists for this user")
+
+    def _lookup_idempotent(self, conn: sqlite3.Connection, user_id: str,
+                           bet_id: str, type: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            "SELECT record FROM idempotency_keys "
+            "WHERE user_id = ? AND bet_id = ? AND type = ? AND created_at >= ?",
+            (user_id, bet_id, type, time.time() - WALLET_IDEMPOTENCY_TTL_SECONDS)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _remember_idempotent(self, conn: sqlite3.Connection, wallet: Dict[str, Any],
+                             transactions: List[Dict[str, Any]]):
+        now = time.time()
+        for (user_id, bet_id, type), record in idempotency_records(wallet, transactions):
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (user_id, bet_id, type, record, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, bet_id, type, json.dumps(record), now)
+            )
+            self._local.writes = getattr(self._local, 'writes', 0) + 1
+            if self._local.writes % IDEMPOTENCY_PRUNE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM idempotency_keys WHERE created_at < ?",
+                    (now - WALLET_IDEMPOTENCY_TTL_SECONDS,)
+                )
+
+    def _apply_mutation(self, conn: sqlite3.Connection, user_id: str, mutation: WalletMutation) -> Dict[str, Any]:
+        fields = [f for f in WALLET_FIELDS if f != 'user_id']
+        row = conn.execute("SELECT * FROM wallets WHERE user_id = ?", (user_id,)).fetchone()
+        if not row:
+            raise ValueError("Wallet not found")
+        lookup = lambda bet_id, type: self._lookup_idempotent(conn, user_id, bet_id, type)
+        wallet, transactions = mutation(dict(row), lookup)
+        if wallet is None:
+            return dict(row)
+        conn.execute(
+            f"UPDATE wallets SET {', '.join(f'{f} = ?' for f in fields)} WHERE user_id = ?",
+            [wallet[f] for f in fields] + [user_id]
+        )
+        for transaction in transactions:
+            self._insert_transaction(conn, transaction)
+        if snapshot_due(row['event_seq'], wallet['event_seq']):
+            self._write_snapshot(conn, wallet)
+        self._remember_idempotent(conn, wallet, transactions)
+        return wallet
+
+    def mutate_wallet(self, user_id: str, mutation: WalletMutation) -> Dict[str, Any]:
+        # BEGIN IMMEDIATE takes the database write lock up front, so the read
+        # below cannot be interleaved with a write from another worker
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return self._apply_mutation(conn, user_id, mutation)
+
+    def mutate_wallets(self, mutations: Dict[str, WalletMutation]) -> Dict[str, Any]:
+        # One write transaction (one WAL commit) for the whole batch; a
+        # savepoint per user rolls back only that user's changes on failure
+        conn = self._connect()
+        results = {}
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for user_id, mutation in mutations.items():
+                conn.execute("SAVEPOINT wallet_mutation")
+                try:
+                    results[user_id] = self._apply_mutation(conn, user_id, mutation)
+                    conn.execute("RELEASE wallet_mutation")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO wallet_mutation")
+                    conn.execute("RELEASE wallet_mutation")
+                    results[user_id] = e
+        return results
+
+    def query_transactions(self, user_id: str, query: TransactionQuery) -> List[Dict[str, Any]]:
+        # Keyset pagination on idx_transactions_user_created_id: the cursor
+        # becomes an index range bound, so deep pages cost the same as page one
+        clauses = ["user_id = ?"]
+        params: List[Any] = [user_id]
+        if query.before is not None:
+            clauses.append("(created_at, transaction_id) < (?, ?)")
+            params.extend(query.before)
+        if query.after is not None:
+            clauses.append("(created_at, transaction_id) > (?, ?)")
+            params.extend(query.after)
+        if query.start is not None:
+            clauses.append("created_at >= ?")
+            params.append(query.start)
+        if query.end is not None:
+            clauses.append("created_at < ?")
+            params.append(query.end)
+        if query.type is not None:
+            clauses.append("type = ?")
+            params.append(query.type)
+        if query.bet_id is not None:
+            clauses.append("bet_id = ?")
+            params.append(query.bet_id)
+        order = "ASC" if query.after is not None else "DESC"
+        rows = self._connect().execute(
+            f"SELECT * FROM transactions WHERE {' AND '.join(clauses)} "
+            f"ORDER BY created_at {order}, transaction_id {order} LIMIT ?",
+            params + [max(query.limit, 0)]
+        ).fetchall()
+        page = [dict(r) for r in rows]
+        if query.after is not None:
+            page.reverse()
+        return page
+
+    def change_token(self) -> Optional[Any]:
+        # data_version changes whenever another connection commits to the file
+        return self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    def rebuild_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT seq, wallet FROM wallet_snapshots WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if not row:
+                return None
+            tail = conn.execute(
+                "SELECT * FROM transactions WHERE user_id = ? AND seq > ? ORDER BY seq",
+                (user_id, row['seq'])
+            ).fetchall()
+            wallet = project_wallet(json.loads(row['wallet']), [dict(t) for t in tail])
+            conn.execute(
+                f"INSERT OR REPLACE INTO wallets ({', '.join(WALLET_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in WALLET_FIELDS)})",
+                [wallet[f] for f in WALLET_FIELDS]
+            )
+            return wallet
+
+    def find_stale_wallets(self) -> List[str]:
+        # One idx_transactions_user_seq lookup per snapshotted user
+        rows = self._connect().execute("""
+            SELECT s.user_id FROM wallet_snapshots s
+            LEFT JOIN wallets w ON w.user_id = s.user_id
+            WHERE w.user_id IS NULL
+               OR w.event_seq < (SELECT MAX(seq) FROM transactions t WHERE t.user_id = s.user_id)
+        """).fetchall()
+        return [row[0] for row in rows]
+
+
+class MongoWalletStore(WalletStore):
+    """
+    MongoDB storage shared by all service instances.
+    Uses the same MONGO_CONNECTION_STRING as the bet-service.
+    """
+
+    def __init__(self, uri: str = MONGO_URI, db_name: str = WALLET_MONGO_DB):
+        from pymongo import MongoClient, ASCENDING, DESCENDING
+        self.client = MongoClient(
+            uri,
+            serverSelectionTimeoutMS=3000,
+            connectTimeoutMS=3000,
+            socketTimeoutMS=3000
+        )
+        db = self.client[db_name]
+        self.wallets = db['wallets']
+        self.transactions = db['wallet_transactions']
+        self.idempotency = db['wallet_idempotency']
+        self.snapshots = db['wallet_snapshots']
+        self.wallets.create_index([('user_id', ASCENDING)], unique=True)
+        # Mongo's TTL monitor removes idempotency keys once expires_at passes
+        self.idempotency.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+        self.transactions.create_index(
+            [('user_id', ASCENDING), ('created_at', DESCENDING), ('transaction_id', DESCENDING)]
+        )
+        self.transactions.create_index([('user_id', ASCENDING), ('seq', ASCENDING)])
+
+    def get_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.wallets.find_one({'user_id': user_id}, {'_id': 0, 'version': 0})
+
+    def iter_wallets(self) -> Iterable[Dict[str, Any]]:
+        return self.wallets.find({}, {'_id': 0, 'version': 0})
+
+    def insert_wallet(self, wallet: Dict[str, Any], transaction: Dict[str, Any]) -> None:
+        from pymongo.errors import DuplicateKeyError
+
+        def txn(session):
+            self.wallets.insert_one(dict(wallet, version=0), session=session)
+            self.transactions.insert_one(dict(transaction), session=session)
+            self._write_snapshot(session, wallet)
+
+        try:
+            with self.client.start_session() as session:
+                session.with_transaction(txn)
+        except DuplicateKeyError:
+            raise ValueError("Wallet already exists for this user")
+
+    def mutate_wallet(self, user_id: str, mutation: WalletMutation) -> Dict[str, Any]:
+        # Optimistic concurrency: the update only matches the version we read.
+        # A concurrent writer makes it match nothing (or raises a write
+        # conflict), and with_transaction / the loop below retry from a fresh read.
+        result = {}
+
+        def txn(session):
+            current = self.wallets.find_one({'user_id': user_id}, {'_id': 0}, session=session)
+            if not current:
+                raise ValueError("Wallet not found")
+            version = current.pop('version', 0)
+            lookup = lambda bet_id, type: self._lookup_idempotent(session, user_id, bet_id, type)
+            wallet, transactions = mutation(dict(current), lookup)
+            if wallet is None:
+                result['wallet'] = current
+                return True
+            updated = self.wallets.update_one(
+                {'user_id': user_id, 'version': version},
+                {'$set': wallet, '$inc': {'version': 1}},
+                session=session
+            )
+            if updated.matched_count == 0:
+                return False
+            if transactions:
+                self.transactions.insert_many([dict(t) for t in transactions], session=session)
+            if snapshot_due(current.get('event_seq', 0), wallet.get('event_seq', 0)):
+                self._write_snapshot(session, wallet)
+            self._remember_idempotent(session, wallet, transactions)
+            result['wallet'] = wallet
+            return True
+
+        with self.client.start_session() as session:
+            while not session.with_transaction(txn):
+                pass
+        return result['wallet']
+
+    def _lookup_idempotent(self, session, user_id: str, bet_id: str, type: str) -> Optional[Dict[str, Any]]:
+        doc = self.idempotency.find_one(
+            {'_id': f"{user_id}|{bet_id}|{type}", 'expires_at': {'$gt': datetime.utcnow()}},
+            session=session
+        )
+        return doc['record'] if doc else None
+
+    def _remember_idempotent(self, session, wallet: Dict[str, Any], transactions: List[Dict[str, Any]]):
+        expires_at = datetime.utcnow() + timedelta(seconds=WALLET_IDEMPOTENCY_TTL_SECONDS)
+        for (user_id, bet_id, type), record in idempotency_records(wallet, transactions):
+            self.idempotency.replace_one(
+                {'_id': f"{user_id}|{bet_id}|{type}"},
+                {'record': record, 'expires_at': expires_at},
+                upsert=True,
+                session=session
+            )
+
+    def _write_snapshot(self, session, wallet: Dict[str, Any]):
+        self.snapshots.replace_one(
+            {'_id': wallet['user_id']},
+            {'seq': wallet['event_seq'], 'wallet': dict(wallet)},
+            upsert=True,
+            session=session
+        )
+
+    def rebuild_wallet(self, user_id: str) -> Optional[Dict[str, Any]]:
+        # Wallet rows and transactions commit in one multi-document transaction,
+        # so they cannot drift; rebuilds are only run on demand
+        from pymongo import ASCENDING
+        result = {}
+
+        def txn(session):
+            snapshot = self.snapshots.find_one({'_id': user_id}, session=session)
+            if not snapshot:
+                result['wallet'] = None
+                return
+            tail = self.transactions.find(
+                {'user_id': user_id, 'seq': {'$gt': snapshot['seq']}}, {'_id': 0}, session=session
+            ).sort([('seq', ASCENDING)])
+            wallet = project_wallet(snapshot['wallet'], list(tail))
+            self.wallets.update_one(
+                {'user_id': user_id},
+                {'$set': wallet, '$inc': {'version': 1}},
+                upsert=True,
+                session=session
+            )
+            result['wallet'] = wallet
+
+        with self.client.start_session() as session:
+            session.with_transaction(txn)
+        return result['wallet']
+
+    def query_transactions(self, user_id: str, query: TransactionQuery) -> List[Dict[str, Any]]:
+        from pymongo import ASCENDING, DESCENDING
+        if query.limit <= 0:
+            return []
+        conditions: List[Dict[str, Any]] = [{'user_id': user_id}]
+        for position, op in ((query.before, '$lt'), (query.after, '$gt')):
+            if position is not None:
+                created_at, transaction_id = position
+                conditions.append({'$or': [
+                    {'created_at': {op: created_at}},
+                    {'created_at': created_at, 'transaction_id': {op: transaction_id}}
+                ]})
+        if query.start is not None:
+            conditions.append({'created_at': {'$gte': query.start}})
+        if query.end is not None:
+            conditions.append({'created_at': {'$lt': query.end}})
+        if query.type is not None:
+            conditions.append({'type': query.type})
+        if query.bet_id is not None:
+            conditions.append({'bet_id': query.bet_id})
+        direction = ASCENDING if query.after is not None else DESCENDING
+        cursor = self.transactions.find({'$and': conditions}, {'_id': 0}) \
+            .sort([('created_at', direction), ('transaction_id', direction)]) \
+            .limit(query.limit)
+        page = list(cursor)
+        if query.after is not None:
+            page.reverse()
+        return page
+
+
+def create_wallet_store(backend: str = WALLET_STORE) -> WalletStore:
+    """
+    Build the configured storage backend.
+    Falls back to the in-memory store if the configured backend is unavailable.
+    """
+    try:
+        if backend == 'mongo':
+            if not MONGO_URI:
+                raise RuntimeError("MONGO_CONNECTION_STRING not set")
+            store = MongoWalletStore()
+        elif backend == 'sqlite':
+            store = SQLiteWalletStore()
+        elif WALLET_WAL_PATH:
+            store = MemoryWalletStore(WriteAheadLog(WALLET_WAL_PATH))
+        else:
+            store = MemoryWalletStore()
+        logger.info(f"Using {type(store).__name__}")
+        return store
+    except Exception as e:
+        logger.warning(f"{backend} store unavailable ({e}), using in-memory store")
+        logger.warning("Wallet state will not be shared between workers")
+        return MemoryWalletStore()
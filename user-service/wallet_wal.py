@@ -0,0 +1,340 @@
+"""
+Append-only write-ahead log for the in-memory wallet store.
+
+Every wallet write is made durable in the log before it is applied in memory, and
+the log is replayed on startup to restore state. Records are binary frames:
+
+    <u32 payload length> <u32 crc32 of payload> <payload: compact JSON>
+
+A torn or corrupt frame at the tail (crash mid-write) ends the replay and is
+truncated away.
+
+Checkpoints keep the log bounded. The store calls rotate(), which renames the
+log to <path>.1 and starts an empty one, then writes its full state with
+write_checkpoint() to <path>.checkpoint (atomically, via a rename) and the
+previous segment is deleted. Startup loads the checkpoint and replays
+<path>.1 (left behind if a crash interrupted a checkpoint) and <path>.
+
+A failed write or fsync is never retried: the log truncates what it may have
+written past the last successful fsync and refuses every later append, so
+the store stays at its last durable state until restarted.
+
+Durability modes (WALLET_WAL_MODE):
+    - sync:  every write is fsynced before the call returns
+    - group: writes are buffered and fsynced together by a background thread;
+             callers wait for their batch. Records arriving during an fsync
+             form the next batch. When the previous batch showed concurrent
+             writers, the flusher also holds a batch open for up to
+             WALLET_WAL_GROUP_MS or until WALLET_WAL_GROUP_RECORDS records
+             (like Postgres commit_delay), so a lone writer never pays the delay
+    - async: like group, but callers do not wait (the last few ms of writes
+             can be lost on a crash)
+"""
+
+import os
+import json
+import zlib
+import struct
+import threading
+from typing import Optional, Dict, Any, Iterator, Iterable, Tuple
+
+from shared_utils import log
+
+logger = log.get_logger('wallet_wal')
+
+# Log configuration
+WALLET_WAL_PATH = os.getenv('WALLET_WAL_PATH', None)
+WALLET_WAL_MODE = os.getenv('WALLET_WAL_MODE', 'group').lower()
+WALLET_WAL_GROUP_MS = float(os.getenv('WALLET_WAL_GROUP_MS', 5.0))
+WALLET_WAL_GROUP_RECORDS = int(os.getenv('WALLET_WAL_GROUP_RECORDS', 256))
+# The store checkpoints once the current segment holds this many records
+WALLET_WAL_CHECKPOINT_RECORDS = max(int(os.getenv('WALLET_WAL_CHECKPOINT_RECORDS', 100000)), 1)
+WAL_MODES = ('sync', 'group', 'async')
+
+FRAME_HEADER = struct.Struct('<II')
+READ_CHUNK_BYTES = 1 << 20
+
+
+def _frame(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, separators=(',', ':')).encode()
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_frames(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Yield (end offset, record) for each intact frame of a file, streaming it
+    in chunks. Stops at the first torn or corrupt frame.
+    """
+    with open(path, 'rb') as f:
+        buffer = bytearray()
+        offset = 0
+        eof = False
+        while True:
+            if len(buffer) < FRAME_HEADER.size and not eof:
+                chunk = f.read(READ_CHUNK_BYTES)
+                eof = not chunk
+                buffer += chunk
+                continue
+            if len(buffer) < FRAME_HEADER.size:
+                return
+            length, crc = FRAME_HEADER.unpack_from(buffer)
+            end = FRAME_HEADER.size + length
+            while len(buffer) < end and not eof:
+                chunk = f.read(max(READ_CHUNK_BYTES, end - len(buffer)))
+                eof = not chunk
+                buffer += chunk
+            payload = bytes(buffer[FRAME_HEADER.size:end])
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset += end
+            del buffer[:end]
+            yield offset, json.loads(payload)
+
+
+def _fsync_dir(path: str):
+    # Makes renames and unlinks in the directory durable
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Append-only log file with group commit.
+
+    Args:
+        path: Log file (created if missing)
+        mode: 'sync', 'group' or 'async'
+        group_ms: Longest time a batch is held open for more records
+        group_records: Buffered records that trigger an fsync immediately
+    """
+
+    def __init__(self, path: str, mode: str = WALLET_WAL_MODE,
+                 group_ms: float = WALLET_WAL_GROUP_MS,
+                 group_records: int = WALLET_WAL_GROUP_RECORDS):
+        if mode not in WAL_MODES:
+            raise ValueError(f"Unknown WAL mode: {mode} (expected one of {', '.join(WAL_MODES)})")
+        self.path = path
+        self.previous_path = path + '.1'
+        self.checkpoint_path = path + '.checkpoint'
+        self.mode = mode
+        self.group_seconds = group_ms / 1000.0
+        self.group_records = max(group_records, 1)
+        # Unbuffered, so a failed write leaves nothing behind to be flushed later
+        self._file = open(path, 'ab', buffering=0)
+        self._lock_file()
+        # File size as of the last successful fsync
+        self._durable_size = os.fstat(self._file.fileno()).st_size
+        # LSNs count appended records; _durable is the highest fsynced one
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._appended = 0
+        self._durable = 0
+        self._last_batch = 0
+        # Records in the current segment, i.e. appended since the last rotate()
+        self.records = 0
+        self._error: Optional[Exception] = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._flusher = None
+        if mode != 'sync':
+            self._flusher = threading.Thread(target=self._flush_loop, name='wallet-wal', daemon=True)
+            self._flusher.start()
+
+    def _lock_file(self):
+        # One writer per log: a second process appending would interleave frames
+        try:
+            import fcntl
+        except ImportError:
+            return
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise RuntimeError(f"{self.path} is in use by another process")
+
+    def read_checkpoint(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the records of the last checkpoint (nothing if there is none).
+
+        Raises:
+            RuntimeError: If the checkpoint is incomplete or corrupt
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return
+        last = None
+        for _, last in _read_frames(self.checkpoint_path):
+            if last['kind'] != 'end':
+                yield last
+        if last is None or last['kind'] != 'end':
+            raise RuntimeError(f"{self.checkpoint_path} is incomplete or corrupt")
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the records logged since the last checkpoint, in order: those of
+        a previous segment left by an interrupted checkpoint, then the current
+        one. Records may repeat what the checkpoint holds. Call before the
+        first append. A torn or corrupt tail (crash mid-write) is truncated.
+        """
+        if os.path.exists(self.previous_path):
+            for _, record in _read_frames(self.previous_path):
+                yield record
+        offset = 0
+        for offset, record in _read_frames(self.path):
+            self.records += 1
+            yield record
+        size = os.fstat(self._file.fileno()).st_size
+        if offset < size:
+            logger.warning(f"Discarding {size - offset} bytes of incomplete log tail")
+            self._file.truncate(offset)
+            self._durable_size = offset
+
+    @property
+    def has_previous_segment(self) -> bool:
+        """True if a segment awaits a checkpoint (one was interrupted)."""
+        return os.path.exists(self.previous_path)
+
+    def rotate(self):
+        """
+        Start a new segment once every appended record is durable. The current
+        one becomes the previous segment, until write_checkpoint() removes it;
+        if a previous segment is still there, the current one is appended to it.
+        Writers must be paused, so that the rotation is a consistent cut.
+        """
+        with self._cond:
+            while self._durable < self._appended and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise RuntimeError(f"Wallet log unavailable: {self._error}")
+            if os.path.exists(self.previous_path):
+                with open(self.path, 'rb') as src, open(self.previous_path, 'ab') as dst:
+                    while chunk := src.read(READ_CHUNK_BYTES):
+                        dst.write(chunk)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                self._file.truncate(0)
+                os.fsync(self._file.fileno())
+            else:
+                os.rename(self.path, self.previous_path)
+                new_file = open(self.path, 'ab', buffering=0)
+                self._file.close()
+                self._file = new_file
+                self._lock_file()
+                _fsync_dir(self.path)
+            self._durable_size = 0
+            self.records = 0
+
+    def write_checkpoint(self, records: Iterable[Dict[str, Any]]):
+        """
+        Write a checkpoint holding the given records (the full state as of the
+        last rotate()) and drop the segment it replaces.
+        """
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(_frame(record))
+            f.write(_frame({'kind': 'end'}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        _fsync_dir(self.checkpoint_path)
+        if os.path.exists(self.previous_path):
+            os.remove(self.previous_path)
+            _fsync_dir(self.previous_path)
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """
+        Append a record. In sync mode it is durable when this returns;
+        otherwise pass the returned LSN to wait().
+
+        Returns:
+            Log sequence number of the record
+        """
+        frame = _frame(record)
+        with self._cond:
+            if self._error is not None:
+                raise RuntimeError(f"Wallet log unavailable: {self._error}")
+            if self._closed:
+                raise RuntimeError("Wallet log is closed")
+            self._appended += 1
+            self.records += 1
+            lsn = self._appended
+            if self.mode == 'sync':
+                try:
+                    self._write(frame)
+                except Exception as e:
+                    self._fail(e)
+                    raise RuntimeError(f"Wallet log unavailable: {e}")
+                self._durable = lsn
+                return lsn
+            self._buffer += frame
+            self._buffered += 1
+            # Wake the flusher to open a batch, and again once the batch is full
+            if self._buffered == 1 or self._buffered >= self.group_records:
+                self._cond.notify_all()
+            return lsn
+
+    def wait(self, lsn: int):
+        """Block until the record with this LSN is on disk (no-op in async mode)."""
+        if self.mode == 'async' or lsn <= self._durable:
+            return
+        with self._cond:
+            while self._durable < lsn:
+                if self._error is not None:
+                    raise RuntimeError(f"Wallet log unavailable: {self._error}")
+                self._cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffered and not self._closed:
+                    self._cond.wait()
+                if not self._buffered and self._closed:
+                    return
+                # With concurrent writers, let the batch grow until it is full
+                # or group_ms has passed
+                if self._last_batch > 1 and self._buffered < self.group_records and not self._closed:
+                    self._cond.wait(self.group_seconds)
+                data, lsn = bytes(self._buffer), self._appended
+                self._last_batch = self._buffered
+                self._buffer.clear()
+                self._buffered = 0
+            try:
+                self._write(data)
+            except Exception as e:
+                with self._cond:
+                    self._fail(e)
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = lsn
+                self._cond.notify_all()
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+        os.fsync(self._file.fileno())
+        self._durable_size += len(data)
+
+    def _fail(self, error: Exception):
+        # Called with the condition held. After a failed fsync the page cache
+        # may hold data that never reaches the disk, so nothing is retried
+        logger.error(f"Could not write wallet log, refusing further writes: {error}")
+        self._error = error
+        try:
+            self._file.truncate(self._durable_size)
+        except Exception as e:
+            logger.error(f"Could not truncate wallet log to its last durable size: {e}")
+
+    def close(self):
+        """Flush buffered records and close the file."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        self._file.close()
+